@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+
+
+# ==============================================
+# AGENDADOR DE ENVIO (TOKEN BUCKET POR REMETENTE)
+# ==============================================
+# Cada instância remetente tem um balde de fichas: até RAJADA mensagens
+# podem sair juntas e, depois, a vazão sustentada é de TAXA mensagens por
+# minuto. Cada mensagem recebe um horário planejado com uma pausa aleatória
+# (jitter) para não soar robótico; como o balde continua enchendo durante a
+# pausa, o jitter desloca cada envio sem reduzir a vazão média. Erros da
+# Evolution API derrubam a taxa pela metade; uma sequência longa sem erro
+# sobe a taxa aos poucos, sem passar do teto configurado.
+TAXA_POR_MINUTO = 60 / 21          # o antigo intervalo fixo de 21 s
+TAXA_MINIMA_POR_MINUTO = 1.0
+TAXA_MAXIMA_POR_MINUTO = 5.0
+RAJADA = 3
+JITTER = 0.5                        # pausa extra de até 50% do intervalo médio
+FATOR_RECUO = 0.5
+FATOR_ACELERACAO = 1.1
+SUCESSOS_PARA_ACELERAR = 50
+TOLERANCIA_ERROS = 0.1              # falhas isoladas (número ruim) não derrubam a taxa
+PESO_ERROS_RECENTES = 0.3           # média móvel da fração de erros usada na ETA
+
+
+class Relogio:
+
+    def agora(self):
+        return time.monotonic()
+
+    def dormir(self, segundos):
+        if segundos > 0:
+            time.sleep(segundos)
+
+
+class RelogioSimulado(Relogio):
+    # Tempo virtual: dormir só avança o ponteiro, para medir vazão sem esperar
+
+    def __init__(self, inicio=0.0):
+        self._agora = inicio
+        self._lock = threading.Lock()
+
+    def agora(self):
+        with self._lock:
+            return self._agora
+
+    def dormir(self, segundos):
+        with self._lock:
+            self._agora += max(0.0, segundos)
+
+
+class _Balde:
+
+    def __init__(self, taxa, rajada, taxa_minima, taxa_maxima, agora):
+        self.taxa = taxa                # fichas por segundo
+        self.rajada = rajada
+        self.taxa_minima = taxa_minima
+        self.taxa_maxima = taxa_maxima
+        self.fichas = float(rajada)
+        self.referencia = agora         # instante em que "fichas" é válido
+        self.cursor = agora             # último horário já reservado
+        self.sucessos_seguidos = 0
+        self.erros = 0
+        self.enviados = 0
+        self.fracao_erros = 0.0         # média móvel dos erros por resultado registrado
+
+
+class AgendadorEnvio:
+
+    def __init__(self, taxa_por_minuto=TAXA_POR_MINUTO, rajada=RAJADA,
+                 taxa_minima_por_minuto=TAXA_MINIMA_POR_MINUTO, taxa_maxima_por_minuto=TAXA_MAXIMA_POR_MINUTO,
+                 jitter=JITTER, limites_por_instancia=None, relogio=None, semente=None):
+        self.taxa_por_minuto = taxa_por_minuto
+        self.rajada = rajada
+        self.taxa_minima_por_minuto = taxa_minima_por_minuto
+        self.taxa_maxima_por_minuto = taxa_maxima_por_minuto
+        self.jitter = jitter
+        # {instancia: {'taxa_por_minuto', 'rajada', 'taxa_maxima_por_minuto', ...}} sobrescreve o padrão
+        self.limites_por_instancia = limites_por_instancia or {}
+        self.relogio = relogio or Relogio()
+        self._aleatorio = random.Random(semente)
+        self._baldes = {}
+        self._lock = threading.Lock()
+
+    def _balde(self, instancia):
+        balde = self._baldes.get(instancia)
+        if balde is None:
+            limites = self.limites_por_instancia.get(instancia, {})
+            maxima = limites.get('taxa_maxima_por_minuto', self.taxa_maxima_por_minuto) / 60
+            minima = limites.get('taxa_minima_por_minuto', self.taxa_minima_por_minuto) / 60
+            taxa = min(maxima, max(minima, limites.get('taxa_por_minuto', self.taxa_por_minuto) / 60))
+            balde = self._baldes[instancia] = _Balde(
+                taxa, limites.get('rajada', self.rajada), minima, maxima, self.relogio.agora()
+            )
+        return balde
+
+    def _reservar(self, balde, quantidade, agora, jitter, projetar_aceleracao=False):
+        # Avança o cursor do balde reservando um horário por mensagem. Para a
+        # ETA, projeta a aceleração que um envio sem erros teria; com erros
+        # acima da tolerância o AIMD vai recuando, então projeta a taxa mínima.
+        t = max(agora, balde.cursor)
+        fichas, referencia = balde.fichas, balde.referencia
+        taxa, seguidos = balde.taxa, balde.sucessos_seguidos
+        if projetar_aceleracao and balde.fracao_erros > TOLERANCIA_ERROS:
+            taxa, projetar_aceleracao = balde.taxa_minima, False
+        horarios = []
+        for _ in range(quantidade):
+            fichas = min(balde.rajada, fichas + (t - referencia) * taxa)
+            referencia = t
+            if fichas < 1:
+                t += (1 - fichas) / taxa
+                fichas, referencia = 1.0, t
+            fichas -= 1
+            if jitter:
+                t += self._aleatorio.uniform(0, jitter / taxa)
+            horarios.append(t)
+            if projetar_aceleracao:
+                seguidos += 1
+                if seguidos >= SUCESSOS_PARA_ACELERAR:
+                    taxa, seguidos = min(balde.taxa_maxima, taxa * FATOR_ACELERACAO), 0
+        return horarios, fichas, referencia
+
+    def planejar(self, instancia, quantidade):
+        # Reserva horários para as próximas mensagens; retorna os instantes no relógio do agendador
+        with self._lock:
+            balde = self._balde(instancia)
+            horarios, balde.fichas, balde.referencia = self._reservar(
+                balde, quantidade, self.relogio.agora(), self.jitter
+            )
+            if horarios:
+                balde.cursor = horarios[-1]
+            return horarios
+
+    def eta(self, instancia, quantidade):
+        # Segundos até a última de "quantidade" mensagens sair, na taxa atual (jitter médio)
+        if quantidade <= 0:
+            return 0.0
+        with self._lock:
+            balde = self._balde(instancia)
+            agora = self.relogio.agora()
+            horarios, _, _ = self._reservar(balde, quantidade, agora, 0, projetar_aceleracao=True)
+        return horarios[-1] - agora + (self.jitter / 2) / balde.taxa
+
+    def intervalo_medio(self, instancia):
+        with self._lock:
+            balde = self._balde(instancia)
+            return 1 / balde.taxa
+
+    def registrar_resultado(self, instancia, sucessos, erros):
+        # AIMD: recua rápido no erro, acelera devagar quando tudo vai bem
+        with self._lock:
+            balde = self._balde(instancia)
+            balde.enviados += sucessos
+            balde.erros += erros
+            if sucessos + erros:
+                balde.fracao_erros += PESO_ERROS_RECENTES * (erros / (sucessos + erros) - balde.fracao_erros)
+            if erros and erros / max(1, sucessos + erros) > TOLERANCIA_ERROS:
+                balde.taxa = max(balde.taxa_minima, balde.taxa * FATOR_RECUO)
+                balde.sucessos_seguidos = 0
+                return
+            balde.sucessos_seguidos += sucessos
+            if balde.sucessos_seguidos >= SUCESSOS_PARA_ACELERAR:
+                balde.taxa = min(balde.taxa_maxima, balde.taxa * FATOR_ACELERACAO)
+                balde.sucessos_seguidos = 0
+
+    def aguardar_ate(self, instante):
+        self.relogio.dormir(instante - self.relogio.agora())
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                instancia: {
+                    'taxa_por_minuto': round(b.taxa * 60, 2),
+                    'fichas': round(b.fichas, 2),
+                    'enviados': b.enviados,
+                    'erros': b.erros,
+                }
+                for instancia, b in self._baldes.items()
+            }
+
+
+def simular_envio(total, taxa_erro=0.0, tamanho_lote=20, semente=42, **config):
+    # Roda o agendador em relógio simulado e compara vazão e ETA previstos com o obtido
+    relogio = RelogioSimulado()
+    agendador = AgendadorEnvio(relogio=relogio, semente=semente, **config)
+    aleatorio = random.Random(semente)
+    instancia = "simulacao"
+
+    # A ETA inicial não prevê erros futuros; a refeita na metade do envio já
+    # reflete o recuo da taxa e é a que a tela mostra dali em diante
+    eta_inicial = agendador.eta(instancia, total)
+    meio = (total // tamanho_lote // 2) * tamanho_lote
+    eta_meio = inicio_meio = None
+    ultimo = 0.0
+    for inicio in range(0, total, tamanho_lote):
+        if inicio == meio:
+            inicio_meio, eta_meio = relogio.agora(), agendador.eta(instancia, total - inicio)
+        horarios = agendador.planejar(instancia, min(tamanho_lote, total - inicio))
+        agendador.aguardar_ate(horarios[-1])
+        ultimo = horarios[-1]
+        erros = sum(1 for _ in horarios if aleatorio.random() < taxa_erro)
+        agendador.registrar_resultado(instancia, len(horarios) - erros, erros)
+
+    return {
+        'mensagens': total,
+        'duracao_s': round(ultimo, 1),
+        'vazao_por_minuto': round(total / ultimo * 60, 3) if ultimo else None,
+        'eta_inicial_s': round(eta_inicial, 1),
+        'erro_eta_pct': round((eta_inicial / ultimo - 1) * 100, 1) if ultimo else None,
+        'erro_eta_meio_pct': round((eta_meio / (ultimo - inicio_meio) - 1) * 100, 1) if ultimo > inicio_meio else None,
+        'taxa_final_por_minuto': agendador.estatisticas()[instancia]['taxa_por_minuto'],
+    }
+
@@ -0,0 +1,402 @@
+import json
+import sqlite3
+import threading
+import time
+
+import gspread
+import pandas as pd
+
+from planilhas import LeitorMensagensIncremental, escrever_aba, letra_coluna
+
+
+# ==============================================
+# ARMAZENAMENTO DOS DADOS DO JOB
+# ==============================================
+# Os dados de cada job (linhas da planilha + mensagem gerada + status de
+# envio) ficam num backend por instância. O Google Sheets é o padrão porque
+# é onde o n8n lê e escreve; o backend local (SQLite) serve só para o
+# benchmark e testes sem acesso ao Sheets, já que o n8n não tem como lê-lo.
+COLUNA_MENSAGEM = "Mensagem Gerada"
+COLUNA_STATUS_ENVIO = "Status Envio WA"
+
+
+def preparar_linhas(df):
+    # Cabeçalho + linhas como texto, no formato esperado pelo n8n
+    df_saida = df.copy()
+    for col in df_saida.columns:
+        if str(df_saida[col].dtype).startswith("datetime"):
+            df_saida[col] = pd.to_datetime(df_saida[col]).dt.strftime("%d/%m/%Y")
+
+    df_saida = df_saida.fillna("").astype(str)
+
+    for col_name in [COLUNA_MENSAGEM, COLUNA_STATUS_ENVIO]:
+        if col_name not in df_saida.columns:
+            df_saida[col_name] = "" if col_name == COLUNA_MENSAGEM else "Pendente"
+
+    return [df_saida.columns.values.tolist()] + df_saida.values.tolist()
+
+
+class ArmazenamentoJobs:
+    # Interface comum. Cada operação é cronometrada para comparar backends.
+    nome = "base"
+
+    def __init__(self):
+        self._tempos = {}
+        self._lock_tempos = threading.Lock()
+
+    def _medir(self, operacao, funcao, *args):
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args)
+        finally:
+            duracao = time.perf_counter() - inicio
+            with self._lock_tempos:
+                chamadas, total = self._tempos.get(operacao, (0, 0.0))
+                self._tempos[operacao] = (chamadas + 1, total + duracao)
+
+    def destino(self, instancia):
+        raise NotImplementedError
+
+    def inserir_em_lote(self, instancia, df):
+        # Substitui os dados do job da instância; retorna um relatório da escrita
+        return self._medir("inserir_em_lote", self._inserir_em_lote, instancia, preparar_linhas(df))
+
+    def criar_leitor(self, instancia):
+        raise NotImplementedError
+
+    def ler_novas(self, leitor):
+        return self._medir("ler_novas", self._ler_novas, leitor)
+
+    def buscar_linha(self, instancia, linha):
+        # Linha da aba (1 = cabeçalho, dados a partir de 2) como {coluna: valor}
+        return self._medir("buscar_linha", self._buscar_linha, instancia, linha)
+
+    def registrar_mensagens(self, instancia, mensagens):
+        # Mensagens que chegaram por callback ganham a "linha" do job, para o
+        # status de envio voltar ao lugar certo; retorna quantas foram associadas
+        return 0
+
+    def ler_status_envio(self, instancia):
+        # {linha: status} da coluna "Status Envio WA"
+        return self._medir("ler_status_envio", self._ler_status_envio, instancia)
+
+    def atualizar_status_envio(self, instancia, status_por_linha):
+        if not status_por_linha:
+            return 0
+        return self._medir("atualizar_status_envio", self._atualizar_status_envio, instancia, status_por_linha)
+
+    def estatisticas(self):
+        with self._lock_tempos:
+            return {
+                operacao: {'chamadas': chamadas, 'media_ms': round(total / chamadas * 1000, 2)}
+                for operacao, (chamadas, total) in self._tempos.items()
+            }
+
+
+# ==============================================
+# BACKEND GOOGLE SHEETS
+# ==============================================
+class ArmazenamentoSheets(ArmazenamentoJobs):
+    nome = "sheets"
+
+    def __init__(self, pool, sheet_id, aba_base):
+        super().__init__()
+        self.pool = pool
+        self.sheet_id = sheet_id
+        self.aba_base = aba_base
+        self._colunas_status = {}   # aba -> índice (1-based) de "Status Envio WA"
+        self._linhas_cliente = {}   # aba -> (campos, {(código do cliente, telefone): [linhas]})
+        self._linhas_atribuidas = {}
+        self._lock_linhas = threading.Lock()
+
+    def destino(self, instancia):
+        return f"{self.aba_base} - {instancia}"
+
+    def _inserir_em_lote(self, instancia, dados):
+        nome_aba = self.destino(instancia)
+        # Redimensiona a aba e envia só as faixas alteradas, em blocos limitados
+        relatorio = self.pool.com_aba(self.sheet_id, nome_aba, lambda ws: escrever_aba(ws, dados), criar=True)
+        self.pool.esquecer_colunas(self.sheet_id, nome_aba)
+        self._colunas_status.pop(nome_aba, None)
+        with self._lock_linhas:
+            self._linhas_cliente.pop(nome_aba, None)
+            self._linhas_atribuidas.pop(nome_aba, None)
+        return relatorio
+
+    def criar_leitor(self, instancia):
+        return LeitorMensagensIncremental(self.sheet_id, self.destino(instancia))
+
+    def _ler_novas(self, leitor):
+        try:
+            return leitor.ler_novas(self.pool)
+        except gspread.exceptions.WorksheetNotFound:
+            return []
+
+    def _buscar_linha(self, instancia, linha):
+        def ler(ws):
+            cabecalho, valores = ws.batch_get(["1:1", f"{linha}:{linha}"])
+            cabecalho = cabecalho[0] if cabecalho else []
+            valores = valores[0] if valores else []
+            return {c: (valores[i] if i < len(valores) else "") for i, c in enumerate(cabecalho)}
+        return self.pool.com_aba(self.sheet_id, self.destino(instancia), ler)
+
+    def _ler_linhas_cliente(self, ws):
+        # Código do cliente e telefone de cada linha, numa única leitura por job
+        colunas = self.pool.colunas_aba(ws, self.sheet_id, ws.title)
+        campos = tuple(campo for campo in ('codigo_cliente', 'telefone') if campo in colunas)
+        if not campos:
+            return campos, {}
+        por_coluna = ws.batch_get([
+            f"{letra_coluna(colunas[campo] + 1)}2:{letra_coluna(colunas[campo] + 1)}" for campo in campos
+        ])
+
+        def valor(coluna, i):
+            return str(coluna[i][0]).strip() if i < len(coluna) and coluna[i] else ""
+
+        linhas = {}
+        for i in range(max(len(coluna) for coluna in por_coluna)):
+            linhas.setdefault(tuple(valor(coluna, i) for coluna in por_coluna), []).append(i + 2)
+        return campos, linhas
+
+    def registrar_mensagens(self, instancia, mensagens):
+        if not mensagens:
+            return 0
+        return self._medir("registrar_mensagens", self._registrar_mensagens, instancia, mensagens)
+
+    def _registrar_mensagens(self, instancia, mensagens):
+        # O n8n já escreveu o texto na aba; aqui só se descobre a linha. A que o
+        # n8n informar vale; as demais vão para a primeira linha ainda não
+        # atribuída do mesmo cliente/telefone
+        nome_aba = self.destino(instancia)
+        with self._lock_linhas:
+            if nome_aba not in self._linhas_cliente:
+                try:
+                    self._linhas_cliente[nome_aba] = self.pool.com_aba(
+                        self.sheet_id, nome_aba, self._ler_linhas_cliente
+                    )
+                except gspread.exceptions.WorksheetNotFound:
+                    return 0
+            campos, linhas_cliente = self._linhas_cliente[nome_aba]
+            atribuidas = self._linhas_atribuidas.setdefault(nome_aba, set())
+
+            associadas = 0
+            for mensagem in mensagens:
+                if mensagem.get('linha') is None:
+                    chave = tuple(str(mensagem.get(campo, '')).strip() for campo in campos)
+                    livre = next((l for l in linhas_cliente.get(chave, []) if l not in atribuidas), None)
+                    if livre is None:
+                        continue
+                    mensagem['linha'] = livre
+                atribuidas.add(mensagem['linha'])
+                associadas += 1
+        return associadas
+
+    def _coluna_status(self, ws):
+        if ws.title not in self._colunas_status:
+            cabecalho = ws.row_values(1)
+            if COLUNA_STATUS_ENVIO not in cabecalho:
+                return None
+            self._colunas_status[ws.title] = cabecalho.index(COLUNA_STATUS_ENVIO) + 1
+        return self._colunas_status[ws.title]
+
+    def _ler_status_envio(self, instancia):
+        def ler(ws):
+            coluna = self._coluna_status(ws)
+            if coluna is None:
+                return {}
+            letra = letra_coluna(coluna)
+            valores = ws.get(f"{letra}2:{letra}")
+            return {linha: (v[0] if v else "") for linha, v in enumerate(valores, start=2)}
+        try:
+            return self.pool.com_aba(self.sheet_id, self.destino(instancia), ler)
+        except gspread.exceptions.WorksheetNotFound:
+            return {}
+
+    def _atualizar_status_envio(self, instancia, status_por_linha):
+        def escrever(ws):
+            coluna = self._coluna_status(ws)
+            if coluna is None:
+                return 0
+            letra = letra_coluna(coluna)
+            # Linhas consecutivas com qualquer status viram um único intervalo
+            linhas = sorted(status_por_linha)
+            dados = []
+            inicio = anterior = linhas[0]
+            for linha in linhas[1:] + [None]:
+                if linha is not None and linha == anterior + 1:
+                    anterior = linha
+                    continue
+                dados.append({
+                    'range': f"{letra}{inicio}:{letra}{anterior}",
+                    'values': [[status_por_linha[n]] for n in range(inicio, anterior + 1)],
+                })
+                if linha is not None:
+                    inicio = anterior = linha
+            ws.batch_update(dados, value_input_option="RAW")
+            return len(linhas)
+        return self.pool.com_aba(self.sheet_id, self.destino(instancia), escrever)
+
+
+# ==============================================
+# BACKEND LOCAL (SQLITE)
+# ==============================================
+class LeitorLocal:
+
+    def __init__(self, instancia):
+        self.instancia = instancia
+        self.ultima_linha = 1
+        self.linhas_vistas = set()
+        self.total_lido = 0
+
+
+class ArmazenamentoLocal(ArmazenamentoJobs):
+    nome = "local"
+
+    def __init__(self, caminho):
+        super().__init__()
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        if caminho != ":memory:":
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS linhas_job (
+                instancia TEXT NOT NULL,
+                linha INTEGER NOT NULL,
+                nome TEXT NOT NULL DEFAULT '',
+                telefone TEXT NOT NULL DEFAULT '',
+                codigo_cliente TEXT NOT NULL DEFAULT '',
+                mensagem TEXT NOT NULL DEFAULT '',
+                status_envio TEXT NOT NULL DEFAULT 'Pendente',
+                dados TEXT NOT NULL,
+                PRIMARY KEY (instancia, linha)
+            );
+            CREATE TABLE IF NOT EXISTS cabecalho_job (
+                instancia TEXT PRIMARY KEY,
+                colunas TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_linhas_cliente ON linhas_job (instancia, codigo_cliente, telefone);
+        """)
+
+    def destino(self, instancia):
+        return f"local:{instancia}"
+
+    def _inserir_em_lote(self, instancia, dados):
+        cabecalho, corpo = dados[0], dados[1:]
+        indice = {c: i for i, c in enumerate(cabecalho)}
+
+        def campo(valores, coluna):
+            i = indice.get(coluna)
+            return valores[i] if i is not None else ""
+
+        registros = [
+            (
+                instancia, numero, campo(valores, "Nome"), campo(valores, "Telefone"),
+                campo(valores, "Cliente"), campo(valores, COLUNA_MENSAGEM),
+                campo(valores, COLUNA_STATUS_ENVIO) or "Pendente", json.dumps(valores, ensure_ascii=False),
+            )
+            for numero, valores in enumerate(corpo, start=2)
+        ]
+        with self._lock:
+            self._conexao.execute("BEGIN")
+            self._conexao.execute("DELETE FROM linhas_job WHERE instancia = ?", (instancia,))
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO cabecalho_job (instancia, colunas) VALUES (?, ?)",
+                (instancia, json.dumps(cabecalho, ensure_ascii=False))
+            )
+            self._conexao.executemany("INSERT INTO linhas_job VALUES (?, ?, ?, ?, ?, ?, ?, ?)", registros)
+            self._conexao.execute("COMMIT")
+
+        return {'modo': 'completo', 'linhas': len(dados), 'colunas': len(cabecalho), 'celulas': len(corpo) * len(cabecalho)}
+
+    def criar_leitor(self, instancia):
+        return LeitorLocal(instancia)
+
+    def _ler_novas(self, leitor):
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT linha, nome, telefone, mensagem, codigo_cliente FROM linhas_job "
+                "WHERE instancia = ? AND linha > ? AND mensagem != '' ORDER BY linha",
+                (leitor.instancia, leitor.ultima_linha)
+            ).fetchall()
+
+        novas = []
+        for linha, nome, telefone, mensagem, codigo in linhas:
+            if linha in leitor.linhas_vistas:
+                continue
+            leitor.linhas_vistas.add(linha)
+            novas.append({
+                'linha': linha,
+                'nome': nome[:100],
+                'telefone': telefone[:20],
+                'mensagem': mensagem[:2000],
+                'codigo_cliente': codigo[:50],
+            })
+        while leitor.ultima_linha + 1 in leitor.linhas_vistas:
+            leitor.ultima_linha += 1
+            leitor.linhas_vistas.discard(leitor.ultima_linha)
+        leitor.total_lido += len(novas)
+        return novas
+
+    def _buscar_linha(self, instancia, linha):
+        with self._lock:
+            cabecalho = self._conexao.execute(
+                "SELECT colunas FROM cabecalho_job WHERE instancia = ?", (instancia,)
+            ).fetchone()
+            if linha == 1:
+                return {c: c for c in json.loads(cabecalho[0])} if cabecalho else {}
+            registro = self._conexao.execute(
+                "SELECT dados, mensagem, status_envio FROM linhas_job WHERE instancia = ? AND linha = ?",
+                (instancia, linha)
+            ).fetchone()
+        if not registro or not cabecalho:
+            return {}
+        resultado = dict(zip(json.loads(cabecalho[0]), json.loads(registro[0])))
+        resultado[COLUNA_MENSAGEM] = registro[1]
+        resultado[COLUNA_STATUS_ENVIO] = registro[2]
+        return resultado
+
+    def registrar_mensagens(self, instancia, mensagens):
+        # Grava na linha informada pelo n8n ou na primeira do mesmo cliente/telefone ainda sem texto
+        gravadas = 0
+        with self._lock:
+            self._conexao.execute("BEGIN")
+            for mensagem in mensagens:
+                if mensagem.get('linha') is not None:
+                    encontrada = self._conexao.execute(
+                        "SELECT linha FROM linhas_job WHERE instancia = ? AND linha = ?",
+                        (instancia, mensagem['linha'])
+                    ).fetchone()
+                else:
+                    encontrada = self._conexao.execute(
+                        "SELECT linha FROM linhas_job WHERE instancia = ? AND codigo_cliente = ? "
+                        "AND telefone = ? AND mensagem = '' ORDER BY linha LIMIT 1",
+                        (instancia, mensagem.get('codigo_cliente', ''), mensagem.get('telefone', ''))
+                    ).fetchone()
+                if encontrada is None:
+                    continue
+                self._conexao.execute(
+                    "UPDATE linhas_job SET mensagem = ? WHERE instancia = ? AND linha = ?",
+                    (mensagem.get('mensagem', ''), instancia, encontrada[0])
+                )
+                # A linha acompanha a mensagem para o status de envio voltar ao lugar certo
+                mensagem['linha'] = encontrada[0]
+                gravadas += 1
+            self._conexao.execute("COMMIT")
+        return gravadas
+
+    def _ler_status_envio(self, instancia):
+        with self._lock:
+            return dict(self._conexao.execute(
+                "SELECT linha, status_envio FROM linhas_job WHERE instancia = ?", (instancia,)
+            ).fetchall())
+
+    def _atualizar_status_envio(self, instancia, status_por_linha):
+        with self._lock:
+            self._conexao.execute("BEGIN")
+            self._conexao.executemany(
+                "UPDATE linhas_job SET status_envio = ? WHERE instancia = ? AND linha = ?",
+                [(status, instancia, linha) for linha, status in status_por_linha.items()]
+            )
+            self._conexao.execute("COMMIT")
+        return len(status_por_linha)
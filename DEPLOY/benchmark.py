@@ -0,0 +1,275 @@
+import argparse
+import io
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import requests
+
+from armazenamento import COLUNA_MENSAGEM, ArmazenamentoLocal, ArmazenamentoSheets
+from carga_planilha import carregar_planilha
+from agendador import AgendadorEnvio, RelogioSimulado
+from envio import DespachanteEnvios
+from servicos_falsos import PlanilhaFalsa, PoolSheetsFalso, ServidorFalso
+from telefones import colunas_visiveis, numeros_unicos, serie_validos
+from validacao import validar_numeros
+
+
+# ==============================================
+# BENCHMARK PONTA A PONTA
+# ==============================================
+# Percorre upload → validação → geração → envio usando os módulos do app
+# contra serviços falsos locais, repete as operações de dados do job no
+# Sheets e no backend local lado a lado e grava o resultado em JSON.
+#
+#   python DEPLOY/benchmark.py --linhas 100 1000 10000 50000
+#   python DEPLOY/benchmark.py --linhas 1000 --comparar benchmark_anterior.json
+INSTANCIA_BENCH = "5511999990000"
+ABA_BENCH = "Dados de Cobrança"
+ABA_COMPARACAO = "Comparação de armazenamento"
+LINHAS_CONSULTADAS = 50     # buscas por linha em cada backend
+
+
+def gerar_planilha_sintetica(linhas, formato="xlsx", semente=42):
+    # ~3 boletos por cliente; parte dos telefones repete em outro formato
+    aleatorio = random.Random(semente)
+    clientes = max(1, linhas // 3)
+    telefones = [f"{aleatorio.randint(11, 99)}9{aleatorio.randint(10_000_000, 99_999_999)}" for _ in range(clientes)]
+    registros = []
+    for i in range(linhas):
+        c = i % clientes
+        tel = telefones[c]
+        if i % 7 == 0:
+            tel = f"({tel[:2]}) {tel[2:7]}-{tel[7:]}"
+        registros.append({
+            "Cliente": f"{10_000_000 + c}",
+            "Nome": f"Cliente {c}",
+            "Valor": f"{aleatorio.uniform(50, 5000):.2f}",
+            "Vencimento": f"{aleatorio.randint(1, 28):02d}/{aleatorio.randint(1, 12):02d}/2026",
+            "Telefone": tel,
+        })
+    df = pd.DataFrame(registros)
+    buffer = io.BytesIO()
+    if formato == "xlsx":
+        df.to_excel(buffer, index=False)
+    else:
+        df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+def exercitar_armazenamento(armazenamento, df_job):
+    # Mesmo roteiro em cada backend: grava o job, lê as mensagens, busca
+    # linhas avulsas e devolve o status de envio de todas
+    armazenamento.inserir_em_lote(INSTANCIA_BENCH, df_job)
+    lidas = armazenamento.ler_novas(armazenamento.criar_leitor(INSTANCIA_BENCH))
+    for linha in range(2, min(len(df_job), LINHAS_CONSULTADAS) + 2):
+        armazenamento.buscar_linha(INSTANCIA_BENCH, linha)
+    armazenamento.atualizar_status_envio(INSTANCIA_BENCH, {m['linha']: "Enviado" for m in lidas})
+    armazenamento.ler_status_envio(INSTANCIA_BENCH)
+    return len(lidas)
+
+def versao_codigo():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return ""
+
+
+class Medidor:
+
+    def __init__(self, fontes_chamadas, medir_memoria=True):
+        self.fontes_chamadas = fontes_chamadas
+        self.medir_memoria = medir_memoria
+        self.estagios = {}
+
+    def _chamadas(self):
+        total = Counter()
+        for fonte in self.fontes_chamadas:
+            total.update(fonte)
+        return total
+
+    @contextmanager
+    def estagio(self, nome):
+        antes = self._chamadas()
+        if self.medir_memoria:
+            tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            chamadas = self._chamadas() - antes
+            self.estagios[nome] = {
+                'tempo_s': round(duracao, 4),
+                'chamadas_externas': dict(chamadas),
+                'total_chamadas': sum(chamadas.values()),
+                'pico_memoria_mb': round(tracemalloc.get_traced_memory()[1] / 1e6, 2) if self.medir_memoria else None,
+            }
+
+
+def executar_cenario(linhas, args):
+    conteudo = gerar_planilha_sintetica(linhas, args.formato, args.semente)
+    planilha = PlanilhaFalsa(latencia=args.latencia_sheets)
+    servidor = ServidorFalso(
+        latencia=args.latencia_http,
+        taxa_erro=args.taxa_erro,
+        planilha=planilha,
+        lote_geracao=max(1, linhas // args.lotes_geracao),
+        intervalo_geracao=args.intervalo_geracao,
+        taxa_erro_envio=args.taxa_erro_envio,
+    )
+    armazenamento = ArmazenamentoSheets(PoolSheetsFalso(planilha), "planilha-bench", ABA_BENCH)
+    medidor = Medidor([servidor.chamadas, planilha.chamadas], medir_memoria=not args.sem_memoria)
+    headers_n8n = {"Content-Type": "application/json", "X-Chave-Secreta": servidor.chave_secreta}
+
+    try:
+        with medidor.estagio("upload"):
+            df, _ = carregar_planilha(conteudo, f"bench.{args.formato}", em_blocos=args.em_blocos)
+
+        with medidor.estagio("status_conexao"):
+            requests.get(f"{servidor.url}/instance/connectionState/{INSTANCIA_BENCH}", timeout=10)
+
+        with medidor.estagio("validacao"):
+            resultados = validar_numeros(numeros_unicos(df), INSTANCIA_BENCH, servidor.url, "bench")
+            df_validos = df.loc[serie_validos(df, resultados), colunas_visiveis(df)]
+
+        with medidor.estagio("salvar_dados"):
+            armazenamento.inserir_em_lote(INSTANCIA_BENCH, df_validos)
+
+        with medidor.estagio("webhook_gerar"):
+            resp = requests.post(servidor.url_gerar, json={
+                "tom_mensagem": "empático",
+                "total_clientes": len(df_validos),
+                "aba_google_sheets": armazenamento.destino(INSTANCIA_BENCH),
+                "remetente": INSTANCIA_BENCH,
+            }, headers=headers_n8n, timeout=60)
+            total_previsto = resp.json().get("total_mensagens_previstas", len(df_validos))
+
+        with medidor.estagio("geracao_polling"):
+            leitor = armazenamento.criar_leitor(INSTANCIA_BENCH)
+            mensagens = []
+            prazo = time.monotonic() + args.timeout_geracao
+            while len(mensagens) < total_previsto and time.monotonic() < prazo:
+                mensagens.extend(armazenamento.ler_novas(leitor))
+                if len(mensagens) < total_previsto:
+                    time.sleep(args.intervalo_polling)
+
+        with medidor.estagio("envio"):
+            # O ritmo de envio roda em relógio simulado: mede o custo do app e a vazão prevista
+            agendador = AgendadorEnvio(relogio=RelogioSimulado(), semente=args.semente)
+            despachante = DespachanteEnvios(
+                ":memory:", servidor.url_enviar, servidor.chave_secreta,
+                registrar_status=lambda instancia, _id_job, status: armazenamento.atualizar_status_envio(instancia, status),
+                agendador=agendador,
+            )
+            id_envio = despachante.criar_envio(INSTANCIA_BENCH, [{
+                "destinatario": m['telefone'],
+                "mensagem": m['mensagem'],
+                "codigo_cliente": m['codigo_cliente'],
+                "nome": m['nome'],
+                "linha": m.get('linha'),
+            } for m in mensagens])
+            eta_envio = despachante.eta(INSTANCIA_BENCH, len(mensagens))
+            despachante.iniciar(id_envio)
+            while despachante.em_andamento(id_envio):
+                time.sleep(0.01)
+            progresso_envio = despachante.progresso(id_envio)
+
+        # Os dois backends com os mesmos dados: a aba já com as mensagens geradas
+        df_job = df_validos.copy()
+        textos = {m['linha']: m['mensagem'] for m in mensagens}
+        df_job[COLUNA_MENSAGEM] = [textos.get(linha, "") for linha in range(2, len(df_job) + 2)]
+        comparados = [
+            ArmazenamentoSheets(PoolSheetsFalso(planilha), "planilha-bench", ABA_COMPARACAO),
+            ArmazenamentoLocal(":memory:"),
+        ]
+        for comparado in comparados:
+            with medidor.estagio(f"armazenamento_{comparado.nome}"):
+                exercitar_armazenamento(comparado, df_job)
+    finally:
+        servidor.encerrar()
+
+    return {
+        'linhas': linhas,
+        'numeros_unicos': len(resultados),
+        'validos': len(df_validos),
+        'mensagens_geradas': len(mensagens),
+        'mensagens_confirmadas': progresso_envio['enviados'],
+        'envio_simulado': {
+            'eta_inicial_s': round(eta_envio, 1),
+            'duracao_s': round(agendador.relogio.agora(), 1),
+            'taxa_final_por_minuto': agendador.estatisticas().get(INSTANCIA_BENCH, {}).get('taxa_por_minuto'),
+        },
+        'armazenamento': {comparado.nome: comparado.estatisticas() for comparado in comparados},
+        'estagios': medidor.estagios,
+        'total_s': round(sum(e['tempo_s'] for e in medidor.estagios.values()), 4),
+        'total_chamadas': sum(e['total_chamadas'] for e in medidor.estagios.values()),
+    }
+
+def imprimir_resumo(resultado, anterior=None):
+    anteriores = {c['linhas']: c for c in (anterior or {}).get('cenarios', [])}
+    for cenario in resultado['cenarios']:
+        print(f"\n== {cenario['linhas']} linhas | total {cenario['total_s']}s | {cenario['total_chamadas']} chamadas ==")
+        base = anteriores.get(cenario['linhas'], {}).get('estagios', {})
+        for nome, estagio in cenario['estagios'].items():
+            linha = (
+                f"  {nome:<22} {estagio['tempo_s']:>9.3f}s  {estagio['total_chamadas']:>6} chamadas"
+                f"  {estagio['pico_memoria_mb'] if estagio['pico_memoria_mb'] is not None else '-':>8} MB"
+            )
+            if nome in base and base[nome]['tempo_s']:
+                variacao = (estagio['tempo_s'] / base[nome]['tempo_s'] - 1) * 100
+                linha += f"  ({variacao:+.1f}% vs {anterior.get('versao') or 'anterior'})"
+            print(linha)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do Cobra AI contra serviços falsos")
+    parser.add_argument("--linhas", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--formato", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--em-blocos", action="store_true", help="usa a ingestão em blocos")
+    parser.add_argument("--latencia-http", type=float, default=0.02, help="latência (s) da Evolution API/n8n falsos")
+    parser.add_argument("--latencia-sheets", type=float, default=0.05, help="latência (s) de cada chamada ao Sheets falso")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de requisições HTTP que falham")
+    parser.add_argument("--taxa-erro-envio", type=float, default=0.0, help="fração de itens recusados no envio")
+    parser.add_argument("--lotes-geracao", type=int, default=20, help="em quantos lotes o n8n falso entrega as mensagens")
+    parser.add_argument("--intervalo-geracao", type=float, default=0.05)
+    parser.add_argument("--intervalo-polling", type=float, default=0.1)
+    parser.add_argument("--timeout-geracao", type=float, default=300)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--sem-memoria", action="store_true", help="desliga o tracemalloc (mais rápido)")
+    parser.add_argument("--saida", default="benchmark_resultados.json")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    if not args.sem_memoria:
+        tracemalloc.start()
+
+    resultado = {
+        'versao': versao_codigo(),
+        'data': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'parametros': vars(args),
+        'cenarios': [executar_cenario(linhas, args) for linhas in args.linhas],
+    }
+
+    with open(args.saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+    imprimir_resumo(resultado, anterior)
+    print(f"\nResultado gravado em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+
+from telefones import adicionar_chave_telefone
+
+
+# ==============================================
+# LEITURA E LIMPEZA DA PLANILHA ENVIADA
+# ==============================================
+COLUNAS_OBRIGATORIAS = ["Cliente", "Nome", "Valor", "Vencimento", "Telefone"]
+MAX_PLANILHAS_EM_CACHE = 8
+TAMANHO_BLOCO_LEITURA = 5000
+
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+def ler_planilha(conteudo, nome_arquivo):
+    if nome_arquivo.lower().endswith(".xlsx"):
+        return pd.read_excel(BytesIO(conteudo), dtype=str)
+    return pd.read_csv(BytesIO(conteudo), dtype=str)
+
+def limpar_planilha(df):
+    # Remove espaços das células de texto, trata vazio como nulo e descarta linhas em branco
+    df = df.apply(lambda col: col.str.strip() if col.dtype == object else col)
+    df = df.replace("", pd.NA)
+    return df.dropna(how="all")
+
+def colunas_faltantes(df):
+    return [c for c in COLUNAS_OBRIGATORIAS if c not in df.columns]
+
+# ==============================================
+# LEITURA EM BLOCOS (PLANILHAS GRANDES)
+# ==============================================
+def _texto_celula(valor):
+    # Mesmo texto que pd.read_excel(dtype=str) produziria para a célula
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+def _cabecalho_xlsx(valores):
+    return [str(v).strip() if v is not None else f"Unnamed: {i}" for i, v in enumerate(valores)]
+
+def _blocos_xlsx(conteudo, tamanho_bloco):
+    # read_only: as linhas são lidas do XML sob demanda, sem montar a planilha inteira
+    livro = openpyxl.load_workbook(BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        linhas = livro.active.iter_rows(values_only=True)
+        try:
+            cabecalho = _cabecalho_xlsx(next(linhas))
+        except StopIteration:
+            return
+        largura = len(cabecalho)
+
+        bloco = []
+        for linha in linhas:
+            valores = [_texto_celula(v) for v in linha[:largura]]
+            valores.extend([None] * (largura - len(valores)))
+            bloco.append(valores)
+            if len(bloco) >= tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=cabecalho, dtype=object)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=cabecalho, dtype=object)
+    finally:
+        livro.close()
+
+def ler_em_blocos(conteudo, nome_arquivo, tamanho_bloco=TAMANHO_BLOCO_LEITURA):
+    if nome_arquivo.lower().endswith(".xlsx"):
+        yield from _blocos_xlsx(conteudo, tamanho_bloco)
+    else:
+        yield from pd.read_csv(BytesIO(conteudo), dtype=str, chunksize=tamanho_bloco)
+
+def ler_e_limpar_em_blocos(conteudo, nome_arquivo, tamanho_bloco=TAMANHO_BLOCO_LEITURA):
+    # Limpa e confere as colunas bloco a bloco; se faltar coluna obrigatória,
+    # para no primeiro bloco em vez de ler o arquivo inteiro
+    blocos = []
+    tempo_leitura = 0.0
+    tempo_limpeza = 0.0
+    leitor = ler_em_blocos(conteudo, nome_arquivo, tamanho_bloco)
+    while True:
+        inicio = time.perf_counter()
+        bloco = next(leitor, None)
+        tempo_leitura += time.perf_counter() - inicio
+        if bloco is None:
+            break
+
+        inicio = time.perf_counter()
+        blocos.append(limpar_planilha(bloco))
+        tempo_limpeza += time.perf_counter() - inicio
+
+        if len(blocos) == 1 and colunas_faltantes(blocos[0]):
+            leitor.close()
+            break
+
+    if not blocos:
+        return pd.DataFrame(), tempo_leitura, tempo_limpeza
+    return pd.concat(blocos, ignore_index=True), tempo_leitura, tempo_limpeza
+
+
+class CachePlanilhas:
+    # DataFrames já limpos por hash do conteúdo, com descarte do menos usado
+
+    def __init__(self, max_entradas=MAX_PLANILHAS_EM_CACHE):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.ultimos_tempos = {}
+
+    def obter(self, id_arquivo):
+        with self._lock:
+            entrada = self._entradas.get(id_arquivo)
+            if entrada is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(id_arquivo)
+            self.hits += 1
+            return entrada
+
+    def guardar(self, id_arquivo, df, tempos):
+        with self._lock:
+            self._entradas[id_arquivo] = (df, tempos)
+            self._entradas.move_to_end(id_arquivo)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            self.ultimos_tempos = tempos
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'hits': self.hits,
+                'misses': self.misses,
+                'ultima_carga': dict(self.ultimos_tempos),
+            }
+
+
+def carregar_planilha(conteudo, nome_arquivo, id_arquivo=None, cache=None, em_blocos=False):
+    # Retorna (df limpo, tempos). O DataFrame em cache é compartilhado:
+    # quem precisar alterá-lo deve trabalhar numa cópia.
+    id_arquivo = id_arquivo or hash_conteudo(conteudo)
+    if cache is not None:
+        entrada = cache.obter(id_arquivo)
+        if entrada is not None:
+            df, tempos = entrada
+            return df, dict(tempos, do_cache=True)
+
+    if em_blocos:
+        df, tempo_leitura, tempo_limpeza = ler_e_limpar_em_blocos(conteudo, nome_arquivo)
+    else:
+        inicio = time.perf_counter()
+        df = ler_planilha(conteudo, nome_arquivo)
+        meio = time.perf_counter()
+        df = limpar_planilha(df)
+        tempo_leitura = meio - inicio
+        tempo_limpeza = time.perf_counter() - meio
+
+    # Chave normalizada do telefone calculada uma vez por arquivo
+    df = adicionar_chave_telefone(df)
+
+    tempos = {
+        'leitura_s': round(tempo_leitura, 4),
+        'limpeza_s': round(tempo_limpeza, 4),
+        'linhas': len(df),
+        'em_blocos': em_blocos,
+        'do_cache': False,
+    }
+    if cache is not None:
+        cache.guardar(id_arquivo, df, tempos)
+    return df, tempos
@@ -4,47 +4,41 @@ import pandas as pd
 import requests
 import traceback
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import re
 import base64
 from io import BytesIO
 import time
-
-
-# ==============================================
-# PROTEÇÃO TEMPORÁRIA POR SENHA
-# ==============================================
-escopo = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+import os
+import uuid
+
+from agendador import AgendadorEnvio
+from armazenamento import ArmazenamentoSheets
+from carga_planilha import CachePlanilhas, carregar_planilha, colunas_faltantes, hash_conteudo
+from envio import ESTADO_CONCLUIDO, DespachanteEnvios
+from fila import ControladorAdmissao
+from jobs import ETAPA_ENVIANDO, ETAPA_GERANDO, ETAPA_REVISAO, RegistroJobs
+from metricas import CronometroRerun, RegistroMetricas, ServidorMetricas
+from notificacoes import DespachanteTelegram, carregar_config_telegram
+from planilhas import PoolSheets
+from receptor_callback import ReceptorCallback
+from revisao import diferencas_edicao, itens_para_envio, posicoes_aprovadas, preparar_quadro_revisao, registros_aprovados
+from status_conexao import CacheStatusConexao
+from telefones import colunas_visiveis, normalizar_telefone, numeros_unicos, serie_validos
+from validacao import ESTADO_CANCELADA, ESTADO_CONCLUIDA, ESTADO_FALHOU, CacheValidacao, ExecutorValidacao
+
+# Orçamento do rerun: o relógio começa antes de qualquer trabalho do script
+cronometro_rerun = CronometroRerun()
 
 #NOTIFICAÇÃO - TELEGRAM
+# Config lida uma vez por processo; o envio acontece numa thread própria
+@st.cache_resource
+def obter_despachante_telegram():
+    bot_token, chat_id = carregar_config_telegram()
+    return DespachanteTelegram(bot_token, chat_id, metricas=obter_metricas())
+
 def notificar_telegram(mensagem):
     try:
-        import toml
-        import os
-
-        # Tenta ler do st.secrets primeiro
-        try:
-            config = toml.load(".streamlit/secrets.toml")
-            bot_token = config.get("TELEGRAM_BOT_TOKEN", "")
-            chat_id = config.get("TELEGRAM_CHAT_ID", "")
-        except Exception:
-            # Se falhar, tenta variáveis de ambiente (produção)
-            bot_token = os.environ.get("TELEGRAM_BOT_TOKEN", "")
-            chat_id = os.environ.get("TELEGRAM_CHAT_ID", "")
-
-        if not bot_token or not chat_id:
-            return
-
-        requests.post(
-            f"https://api.telegram.org/bot{bot_token}/sendMessage",
-            json={
-                "chat_id": chat_id,
-                "text": mensagem,
-                "parse_mode": "Markdown"
-            },
-            timeout=(5, 10)
-        )
+        with medir("telegram_enfileirar"):
+            obter_despachante_telegram().notificar(mensagem)
     except Exception:
         pass
 
@@ -81,18 +75,84 @@ if not verificar_senha():
 # ==============================================
 # CONFIGURAÇÕES GLOBAIS
 # ==============================================
-EVOLUTION_API_KEY = st.secrets["EVOLUTION_API_KEY"]
-CHAVE_SECRETA_N8N = st.secrets["CHAVE_SECRETA_N8N"]
-credenciais = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["google_sheets_credentials"], escopo)
+# Segredos lidos uma vez por processo (limpar o cache de recursos recarrega)
+@st.cache_resource
+def ler_segredos():
+    return dict(st.secrets)
+
+SEGREDOS = ler_segredos()
+EVOLUTION_API_KEY = SEGREDOS["EVOLUTION_API_KEY"]
+CHAVE_SECRETA_N8N = SEGREDOS["CHAVE_SECRETA_N8N"]
 EVOLUTION_API_URL = "https://evolution.simplefin.ia.br"
 ID_PLANILHA_GOOGLE = "1xmXgoaDWUnOaqQRnqYi14OligNoq36LbLVahL2zY89M"
 URL_WEBHOOK_N8N_GERAR = "https://app.simplefin.ia.br/webhook/cob"
 URL_WEBHOOK_N8N_ENVIAR = "https://app.simplefin.ia.br/webhook/enviar-wa"
 ABA_GOOGLE_SHEETS = "Dados de Cobrança"
-MAX_REGISTROS = 500
-MAX_CLIENTES = 100    # Máximo de clientes distintos
+# Só "sheets": o n8n lê a aba do job; o backend local fica para benchmark e testes
+BACKEND_ARMAZENAMENTO = SEGREDOS.get("BACKEND_ARMAZENAMENTO", "sheets")
+# Ingestão em blocos: lê CSV/XLSX aos pedaços (memória limitada) e libera planilhas grandes
+MODO_INGESTAO_STREAMING = bool(SEGREDOS.get("MODO_INGESTAO_STREAMING", False))
+MAX_REGISTROS = 50_000 if MODO_INGESTAO_STREAMING else 500
+MAX_CLIENTES = 10_000 if MODO_INGESTAO_STREAMING else 100    # Máximo de clientes distintos
+MAX_MENSAGENS = MAX_REGISTROS
+LINHAS_POR_PAGINA_PREVIEW = 500     # acima disso o preview é paginado
 TIMEOUT_FILA = 300
 MAX_USUARIOS_SIMULTANEOS = 3
+FILA_ARQUIVO = SEGREDOS.get("FILA_ARQUIVO", "")    # SQLite compartilhado entre processos (opcional)
+MODO_DEBUG = bool(SEGREDOS.get("MODO_DEBUG", False))
+INTERVALO_POLLING = 5
+INTERVALO_TELA_ENVIO = 2            # atualização do painel de envio (só o fragmento)
+# Modo callback: o n8n empurra as mensagens para um endpoint local em vez
+# de o app ler a planilha a cada INTERVALO_POLLING segundos
+CALLBACK_HOST = SEGREDOS.get("CALLBACK_HOST", "0.0.0.0")
+CALLBACK_PORTA = int(SEGREDOS.get("CALLBACK_PORTA", 8765))
+CALLBACK_URL_PUBLICA = SEGREDOS.get("CALLBACK_URL_PUBLICA", "")
+# Sem URL pública o n8n receberia http://0.0.0.0:porta, que não é um destino:
+# o modo callback fica desligado e a geração segue só com polling
+CALLBACK_SEM_URL = bool(SEGREDOS.get("MODO_CALLBACK", False)) and not CALLBACK_URL_PUBLICA
+MODO_CALLBACK = bool(SEGREDOS.get("MODO_CALLBACK", False)) and not CALLBACK_SEM_URL
+CALLBACK_ESPERA_SEGUNDOS = 0.5      # quanto cada atualização do fragmento espera por dados
+INTERVALO_TELA_GERACAO = 1 if MODO_CALLBACK else INTERVALO_POLLING
+CALLBACK_FALLBACK_SEGUNDOS = 120    # sem callback por esse tempo, volta a ler a planilha
+CACHE_VALIDACAO_ARQUIVO = SEGREDOS.get(
+    "CACHE_VALIDACAO_ARQUIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_validacao.sqlite3")
+)
+CACHE_VALIDACAO_TTL_POSITIVO = int(SEGREDOS.get("CACHE_VALIDACAO_TTL_POSITIVO", 30 * 24 * 3600))
+CACHE_VALIDACAO_TTL_NEGATIVO = int(SEGREDOS.get("CACHE_VALIDACAO_TTL_NEGATIVO", 24 * 3600))
+CACHE_VALIDACAO_MAX_ENTRADAS = int(SEGREDOS.get("CACHE_VALIDACAO_MAX_ENTRADAS", 200_000))
+# Métricas: arquivo .prom para o textfile collector e/ou endpoint /metrics (porta 0 = desligado)
+METRICAS_ARQUIVO = SEGREDOS.get("METRICAS_ARQUIVO", "")
+METRICAS_PORTA = int(SEGREDOS.get("METRICAS_PORTA", 0))
+METRICAS_LOG_DIR = SEGREDOS.get(
+    "METRICAS_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs_jobs")
+)
+# Envio em lotes confirmados; o andamento de cada item fica neste SQLite
+ENVIOS_ARQUIVO = SEGREDOS.get(
+    "ENVIOS_ARQUIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "envios.sqlite3")
+)
+TAMANHO_LOTE_ENVIO = int(SEGREDOS.get("TAMANHO_LOTE_ENVIO", 20))
+# Ritmo de envio por remetente (token bucket): vazão sustentada, rajada e limites da adaptação
+ENVIO_TAXA_POR_MINUTO = float(SEGREDOS.get("ENVIO_TAXA_POR_MINUTO", 60 / 21))
+ENVIO_TAXA_MINIMA_POR_MINUTO = float(SEGREDOS.get("ENVIO_TAXA_MINIMA_POR_MINUTO", 1.0))
+ENVIO_TAXA_MAXIMA_POR_MINUTO = float(SEGREDOS.get("ENVIO_TAXA_MAXIMA_POR_MINUTO", 5.0))
+ENVIO_RAJADA = int(SEGREDOS.get("ENVIO_RAJADA", 3))
+ENVIO_JITTER = float(SEGREDOS.get("ENVIO_JITTER", 0.5))
+ENVIO_LIMITES_POR_INSTANCIA = {    # {instancia: {taxa_por_minuto, rajada, ...}} para remetentes específicos
+    instancia: dict(limites) for instancia, limites in SEGREDOS.get("ENVIO_LIMITES_POR_INSTANCIA", {}).items()
+}
+# Registro dos jobs (etapa, contagens, planilha) para retomar após recarregar a página
+JOBS_ARQUIVO = SEGREDOS.get(
+    "JOBS_ARQUIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs_registro.sqlite3")
+)
+ORCAMENTO_RERUN_MS = int(SEGREDOS.get("ORCAMENTO_RERUN_MS", 300))   # acima disso o rerun conta como estouro
+
+# O n8n não tem como ler "local:<instancia>": com outro backend a geração nunca sairia do lugar
+if BACKEND_ARMAZENAMENTO != "sheets":
+    st.error(
+        f"❌ BACKEND_ARMAZENAMENTO={BACKEND_ARMAZENAMENTO!r} não é suportado no app: o n8n só lê o Google Sheets. "
+        "Use \"sheets\"; o backend local é só para o benchmark e os testes."
+    )
+    st.stop()
 
 # ==============================================
 # INICIALIZAÇÃO DE ESTADOS
@@ -101,6 +161,8 @@ defaults = {
     'tel_corporativo': "",
     'is_connected': False,
     'mensagens_recebidas': [],
+    'leitor_mensagens': None,
+    'id_job_callback': None,
     'processo_concluido': False,
     'processo_iniciado': False,
     'geracao_finalizada': False,
@@ -108,182 +170,138 @@ defaults = {
     'selecionar_todos': True,
     'progress_step': 0,
     'total_mensagens_previstas': 0,
-    'instancias_ocupadas': {},
     'minha_instancia_atual': None,
     'mostrar_validacao_visual': False,
-    'fila_usuarios': {},
     'minha_posicao_fila': None,
+    'aguardando_fila': False,
     'validacao_backend_concluida': False,
     'resultados_validacao': {},
     'notificou_login': False,  # Controla se já notificou o login desta sessão
+    'id_job': None,
+    'id_sessao': uuid.uuid4().hex[:12],   # dono da vaga na fila
+    'id_job_arquivo': None,
+    'id_grupo_envio': None,
+    'arquivo_retomado': None,
 }
 
+# Cronômetros/contadores do processo, rotulados por etapa e instância
+@st.cache_resource
+def obter_metricas():
+    return RegistroMetricas(METRICAS_ARQUIVO or None, METRICAS_LOG_DIR or None)
+
+@st.cache_resource
+def obter_servidor_metricas():
+    if not METRICAS_PORTA:
+        return None
+    try:
+        return ServidorMetricas(obter_metricas(), porta=METRICAS_PORTA)
+    except OSError:
+        return None
+
+def medir(etapa, instancia=None, **dados):
+    # Mede um bloco e, se houver job em andamento, registra no log do job
+    return obter_metricas().medir(
+        etapa,
+        st.session_state.get('tel_corporativo', "") if instancia is None else instancia,
+        st.session_state.get('id_job'),
+        **dados
+    )
+
+obter_servidor_metricas()
+
+# Fila e travas vivem num controlador único do processo (não na sessão),
+# para que MAX_USUARIOS_SIMULTANEOS valha entre usuários diferentes
+@st.cache_resource
+def obter_controlador_fila():
+    return ControladorAdmissao(MAX_USUARIOS_SIMULTANEOS, TIMEOUT_FILA, FILA_ARQUIVO or None)
+
 def verificar_trava_instancia(instancia):
-    ocupadas = st.session_state.get('instancias_ocupadas', {})
-    if ocupadas.get(instancia, False):
+    if obter_controlador_fila().em_geracao(instancia):
         return False, "Instância em uso"
     return True, None
 
 def definir_instancia_ocupada(instancia, ocupada=True):
-    if 'instancias_ocupadas' not in st.session_state:
-        st.session_state.instancias_ocupadas = {}
-    st.session_state.instancias_ocupadas[instancia] = ocupada
+    obter_controlador_fila().marcar_geracao(instancia, ocupada)
     st.session_state.minha_instancia_atual = instancia if ocupada else None
 
 # ==============================================
 # SISTEMA DE FILA
 # ==============================================
 def verificar_fila(instancia):
-    agora = time.time()
-    fila = st.session_state.get('fila_usuarios', {})
-    fila_limpa = {k: v for k, v in fila.items() if (agora - v) < TIMEOUT_FILA}
-    st.session_state.fila_usuarios = fila_limpa
-
-    if instancia in fila_limpa:
-        st.session_state.fila_usuarios[instancia] = agora
-        return True, 1, len(fila_limpa), "Processando"
-
-    if len(fila_limpa) < MAX_USUARIOS_SIMULTANEOS:
-        st.session_state.fila_usuarios[instancia] = agora
-        return True, 1, len(fila_limpa) + 1, "Entrou na fila"
-
-    instancias_ordenadas = sorted(fila_limpa.items(), key=lambda x: x[1])
-    posicao = len([i for i, t in instancias_ordenadas if t < fila_limpa.get(instancia, agora)]) + 1
-    return False, posicao, len(fila_limpa), f"Fila cheia. Sua posição: {posicao}"
+    # Entra na fila (FIFO) e renova o lease; retorna admitido, posição e espera estimada
+    return obter_controlador_fila().solicitar(instancia, st.session_state.id_sessao)
 
 def sair_da_fila(instancia):
-    if instancia in st.session_state.get('fila_usuarios', {}):
-        del st.session_state.fila_usuarios[instancia]
+    obter_controlador_fila().liberar(instancia, st.session_state.id_sessao)
 
 for key, val in defaults.items():
     if key not in st.session_state:
         st.session_state[key] = val
 
+# Fecha a conta do rerun anterior desta sessão e passa a medir este
+cronometro_rerun.marcar("configuracao")
+if st.session_state.get('cronometro_rerun') is not None:
+    st.session_state.ultimo_rerun = st.session_state.cronometro_rerun.finalizar(
+        obter_metricas(), st.session_state.tel_corporativo
+    )
+st.session_state.cronometro_rerun = cronometro_rerun
+
 # ==============================================
 # FUNÇÕES
 # ==============================================
-def salvar_no_google_sheets(df, sheet_id, instancia, aba_base=ABA_GOOGLE_SHEETS):
+# Cliente e abas do Google Sheets são compartilhados por todo o processo
+@st.cache_resource
+def obter_pool_sheets():
+    return PoolSheets(st.secrets["google_sheets_credentials"])
+
+# Backend dos dados do job: a aba do Google Sheets que o n8n lê e preenche
+@st.cache_resource
+def obter_armazenamento():
+    return ArmazenamentoSheets(obter_pool_sheets(), ID_PLANILHA_GOOGLE, ABA_GOOGLE_SHEETS)
+
+def salvar_dados_job(df, instancia):
+    armazenamento = obter_armazenamento()
     try:
-        escopo = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        credenciais = ServiceAccountCredentials.from_json_keyfile_dict(
-    dict(st.secrets["google_sheets_credentials"]), escopo
-)
-        cliente = gspread.authorize(credenciais)
-        planilha = cliente.open_by_key(sheet_id)
-
-        nome_aba = f"{aba_base} - {instancia}"
-
-        try:
-            worksheet = planilha.worksheet(nome_aba)
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = planilha.add_worksheet(title=nome_aba, rows="2000", cols="20")
-
-        df_para_sheets = df.copy()
-        for col in df_para_sheets.columns:
-            if str(df_para_sheets[col].dtype).startswith("datetime"):
-                df_para_sheets[col] = pd.to_datetime(df_para_sheets[col]).dt.strftime("%d/%m/%Y")
-
-        df_para_sheets = df_para_sheets.fillna("").astype(str)
-
-        for col_name in ["Mensagem Gerada", "Status Envio WA"]:
-            if col_name not in df_para_sheets.columns:
-                df_para_sheets[col_name] = "" if col_name == "Mensagem Gerada" else "Pendente"
-
-        worksheet.clear()
-        dados_lista = [df_para_sheets.columns.values.tolist()] + df_para_sheets.values.tolist()
-        worksheet.update(dados_lista, value_input_option="USER_ENTERED")
-
-        return True, nome_aba
+        with medir("salvar_dados", instancia, linhas=len(df), backend=armazenamento.nome) as dados:
+            st.session_state.ultima_escrita_sheets = armazenamento.inserir_em_lote(instancia, df)
+            dados['requisicoes'] = st.session_state.ultima_escrita_sheets.get('requisicoes')
+        return True, armazenamento.destino(instancia)
 
     except Exception as e:
-        st.error(f"❌ Erro ao salvar no Google Sheets: {str(e)}")
+        st.error(f"❌ Erro ao salvar os dados ({armazenamento.nome}): {str(e)}")
         return False, None
 
-def carregar_mensagens_do_sheets(sheet_id, instancia, aba_base=ABA_GOOGLE_SHEETS):
+def carregar_mensagens_job(instancia):
+    # Leitura completa, sem guardar estado entre chamadas
+    armazenamento = obter_armazenamento()
     try:
-        escopo = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        credenciais = ServiceAccountCredentials.from_json_keyfile_dict(
-    dict(st.secrets["google_sheets_credentials"]), escopo
-)
-        cliente = gspread.authorize(credenciais)
-
-        nome_aba = f"{aba_base} - {instancia}"
-
-        try:
-            worksheet = cliente.open_by_key(sheet_id).worksheet(nome_aba)
-        except gspread.exceptions.WorksheetNotFound:
-            return []
-
-        dados = worksheet.get_all_records()
-
-        if not dados or not isinstance(dados, list):
-            return []
-
-        try:
-            df = pd.DataFrame(dados)
-        except Exception:
-            return []
-
-        if df.empty:
-            return []
-
-        df.columns = df.columns.astype(str).str.strip()
-
-        col_nome = None
-        col_telefone = None
-        col_mensagem = None
-        col_cliente = None
-
-        for col in df.columns:
-            col_lower = col.lower().strip()
-            if col_lower in ['nome', 'name', 'cliente_nome']:
-                col_nome = col
-            elif col_lower in ['telefone', 'tel', 'fone', 'whatsapp', 'numero', 'phone', 'whats']:
-                col_telefone = col
-            elif col_lower in ['mensagem gerada', 'mensagem', 'message', 'msg', 'texto']:
-                col_mensagem = col
-            elif col_lower in ['cliente', 'codigo', 'codigo_cliente', 'id_cliente', 'código', 'cod_cliente']:
-                col_cliente = col
-
-        if col_mensagem is None:
-            return []
-
-        mensagens = []
-        for _, row in df.iterrows():
-            try:
-                mensagem_texto = str(row.get(col_mensagem, '')) if col_mensagem else ''
-                if mensagem_texto and mensagem_texto.strip() and mensagem_texto.lower() not in ['nan', 'none', '']:
-                    mensagem = {
-                        'nome': str(row.get(col_nome, ''))[:100] if col_nome else '',
-                        'telefone': str(row.get(col_telefone, ''))[:20] if col_telefone else '',
-                        'mensagem': mensagem_texto[:2000],
-                        'codigo_cliente': str(row.get(col_cliente, ''))[:50] if col_cliente else '',
-                    }
-                    mensagens.append(mensagem)
-            except Exception:
-                continue
-
-        return mensagens
-
+        return armazenamento.ler_novas(armazenamento.criar_leitor(instancia))
     except Exception:
         return []
 
-def normalizar_telefone_instancia(telefone):
-    nums = re.sub(r'\D', '', telefone)
-    if not nums.startswith('55') and len(nums) in (10, 11):
-        nums = '55' + nums
-    if len(nums) == 12:
-        nums = nums[:4] + '9' + nums[4:]
-    return nums
+def carregar_novas_mensagens(instancia):
+    # Retorna só as mensagens que ainda não foram lidas nesta sessão
+    armazenamento = obter_armazenamento()
+    leitor = st.session_state.get('leitor_mensagens')
+    if leitor is None or st.session_state.get('leitor_destino') != armazenamento.destino(instancia):
+        leitor = armazenamento.criar_leitor(instancia)
+        st.session_state.leitor_mensagens = leitor
+        st.session_state.leitor_destino = armazenamento.destino(instancia)
+    with medir("polling_leitura", instancia, backend=armazenamento.nome) as dados:
+        novas = armazenamento.ler_novas(leitor)
+        dados['novas'] = len(novas)
+    return novas
 
 def check_status(instance):
     headers = {"apikey": EVOLUTION_API_KEY}
     try:
-        res = requests.get(
-            f"{EVOLUTION_API_URL}/instance/connectionState/{instance}",
-            headers=headers,
-            timeout=5
-        )
+        # Roda na thread do cache de status: sem session_state, sem log de job
+        with obter_metricas().medir("status_conexao", instance):
+            res = requests.get(
+                f"{EVOLUTION_API_URL}/instance/connectionState/{instance}",
+                headers=headers,
+                timeout=5
+            )
         if res.status_code == 200:
             try:
                 return res.json().get("instance", {}).get("state")
@@ -293,6 +311,136 @@ def check_status(instance):
     except requests.exceptions.RequestException:
         return "error"
 
+@st.cache_resource
+def obter_cache_status():
+    return CacheStatusConexao(check_status)
+
+@st.cache_resource
+def obter_cache_validacao():
+    return CacheValidacao(
+        CACHE_VALIDACAO_ARQUIVO,
+        ttl_positivo=CACHE_VALIDACAO_TTL_POSITIVO,
+        ttl_negativo=CACHE_VALIDACAO_TTL_NEGATIVO,
+        max_entradas=CACHE_VALIDACAO_MAX_ENTRADAS,
+    )
+
+# Validações rodam em threads do processo, fora dos reruns; a sessão só acompanha
+@st.cache_resource
+def obter_executor_validacao():
+    return ExecutorValidacao(
+        EVOLUTION_API_URL,
+        EVOLUTION_API_KEY,
+        cache=obter_cache_validacao(),
+        metricas=obter_metricas(),
+    )
+
+@st.cache_resource
+def obter_cache_planilhas():
+    return CachePlanilhas()
+
+@st.cache_resource
+def obter_receptor_callback():
+    try:
+        return ReceptorCallback(CALLBACK_HOST, CALLBACK_PORTA, CHAVE_SECRETA_N8N, CALLBACK_URL_PUBLICA)
+    except OSError:
+        # Porta ocupada/indisponível: segue só com polling
+        return None
+
+@st.cache_resource
+def obter_agendador_envio():
+    return AgendadorEnvio(
+        taxa_por_minuto=ENVIO_TAXA_POR_MINUTO,
+        rajada=ENVIO_RAJADA,
+        taxa_minima_por_minuto=ENVIO_TAXA_MINIMA_POR_MINUTO,
+        taxa_maxima_por_minuto=ENVIO_TAXA_MAXIMA_POR_MINUTO,
+        jitter=ENVIO_JITTER,
+        limites_por_instancia=ENVIO_LIMITES_POR_INSTANCIA,
+    )
+
+def concluir_grupo_envio(id_grupo_envio, progresso_envio):
+    # Chamado pela thread do envio quando o grupo termina, com ou sem sessão aberta
+    obter_registro_jobs().concluir_envio(
+        id_grupo_envio, {'enviados': progresso_envio['enviados'], 'falhos': progresso_envio['falhos']}
+    )
+    recusadas = f" · ❌ Recusadas: *{progresso_envio['falhos']}*" if progresso_envio['falhos'] else ""
+    obter_despachante_telegram().notificar(
+        f"✅ *Envio Confirmado!*\n"
+        f"📱 WhatsApp: `{', '.join(shard['instancia'] for shard in progresso_envio['shards'])}`\n"
+        f"📨 Confirmadas: *{progresso_envio['enviados']}*{recusadas}\n"
+        f"📅 {datetime.now().strftime('%d/%m/%Y às %H:%M')}"
+    )
+
+def registrar_status_envio(instancia, id_job, status_por_linha):
+    # A aba da instância é reescrita a cada geração: o status de um envio só
+    # volta para ela enquanto os dados ainda forem do job que o originou
+    if id_job is not None and obter_registro_jobs().job_dos_dados(instancia) != id_job:
+        return 0
+    return obter_armazenamento().atualizar_status_envio(instancia, status_por_linha)
+
+@st.cache_resource
+def obter_despachante_envios():
+    return DespachanteEnvios(
+        ENVIOS_ARQUIVO,
+        URL_WEBHOOK_N8N_ENVIAR,
+        CHAVE_SECRETA_N8N,
+        tamanho_lote=TAMANHO_LOTE_ENVIO,
+        registrar_status=registrar_status_envio,
+        metricas=obter_metricas(),
+        agendador=obter_agendador_envio(),
+        ao_concluir_grupo=concluir_grupo_envio,
+    )
+
+@st.cache_resource
+def obter_registro_jobs():
+    return RegistroJobs(JOBS_ARQUIVO)
+
+def retomar_job(job):
+    # Devolve à sessão o estado de um job aberto, sem disparar a geração de novo
+    st.session_state.id_job = job['id_job']
+    st.session_state.id_job_arquivo = job['id_arquivo']
+    st.session_state.ultimo_arquivo = job['id_arquivo']     # sem repetir o aviso de upload
+    st.session_state.arquivo_retomado = job['id_arquivo']
+    st.session_state.total_mensagens_previstas = job['total_previsto'] or 0
+    st.session_state.leitor_mensagens = None
+    if job['etapa'] == ETAPA_GERANDO:
+        # A leitura recomeça do início da aba; o que já foi gerado entra de uma vez
+        st.session_state.processo_iniciado = True
+        st.session_state.mensagens_recebidas = []
+        st.session_state.id_job_callback = job['id_job_callback']
+        st.session_state.ultimo_callback = time.time()
+        receptor = obter_receptor_callback() if (MODO_CALLBACK and job['id_job_callback']) else None
+        if receptor is not None and receptor.registrado(job['id_job_callback']):
+            # Com callback a aba não é relida no polling: o que a sessão anterior já
+            # tirou da fila vem da aba agora, e a fila fica só com o que falta
+            st.session_state.mensagens_recebidas = carregar_mensagens_job(job['instancia'])
+            receptor.retomar(job['id_job_callback'], st.session_state.mensagens_recebidas)
+    else:
+        st.session_state.geracao_finalizada = True
+        st.session_state.mensagens_recebidas = carregar_mensagens_job(job['instancia'])
+    obter_registro_jobs().marcar_retomada()
+    obter_metricas().registrar_evento(job['id_job'], job['instancia'], "job_retomado", etapa_job=job['etapa'])
+
+# Derivados da planilha que só dependem do conteúdo: calculados uma vez por arquivo
+@st.cache_resource(max_entries=16)
+def resumo_planilha(id_arquivo, _df):
+    if 'Código_Cliente' in _df.columns:
+        clientes_unicos = _df['Código_Cliente'].nunique()
+    elif 'Cliente' in _df.columns:
+        clientes_unicos = _df['Cliente'].nunique()
+    else:
+        clientes_unicos = len(_df)
+
+    colunas = colunas_visiveis(_df)
+    coluna_telefone = None
+    for col in colunas:
+        if "tel" in col.lower() or "fone" in col.lower() or "whats" in col.lower():
+            coluna_telefone = col
+            break
+    if coluna_telefone is None and 'Telefone' in _df.columns:
+        coluna_telefone = 'Telefone'
+
+    return {'clientes_unicos': clientes_unicos, 'coluna_telefone': coluna_telefone, 'colunas_visiveis': colunas}
+
 def toggle_all_messages_selection():
     st.session_state.selecionar_todos = st.session_state.master_select_all_checkbox_key
 
@@ -311,13 +459,13 @@ with st.sidebar:
         key="tel_corporativo_input"
     )
 
-    tel_limpo = normalizar_telefone_instancia(tel_input) if tel_input else ""
+    tel_limpo = normalizar_telefone(tel_input) if tel_input else ""
 
     if len(tel_limpo) == 13:
         st.caption(f"ID: {tel_limpo}")
         st.session_state.tel_corporativo = tel_limpo
 
-        status = check_status(tel_limpo)
+        status = obter_cache_status().obter(tel_limpo)
 
         if status == "open":
             st.success("✅ WhatsApp Conectado")
@@ -344,6 +492,7 @@ with st.sidebar:
                         except requests.exceptions.RequestException:
                             st.error("Erro ao tentar criar instância.")
                             st.stop()
+                        obter_cache_status().forcar(tel_limpo)
 
                     try:
                         res_qr = requests.get(
@@ -359,6 +508,7 @@ with st.sidebar:
                             if base64_qr:
                                 st.image(base64.b64decode(base64_qr))
                                 if st.button("🔄 Atualizar Status"):
+                                    obter_cache_status().forcar(tel_limpo)
                                     st.rerun()
                             else:
                                 st.error("Não foi possível gerar QR Code.")
@@ -370,6 +520,47 @@ with st.sidebar:
         st.error("Número inválido")
         st.session_state.is_connected = False
 
+    if MODO_DEBUG:
+        with st.expander("🛠️ Diagnóstico", expanded=False):
+            if CALLBACK_SEM_URL:
+                st.error("MODO_CALLBACK ignorado: configure CALLBACK_URL_PUBLICA (endereço que o n8n alcança).")
+            st.caption("Cache de validação")
+            st.json(obter_cache_validacao().estatisticas())
+            st.caption("Validações em segundo plano")
+            st.json(obter_executor_validacao().estatisticas())
+            st.caption("Planilhas enviadas")
+            st.json(obter_cache_planilhas().estatisticas())
+            st.caption("Fila")
+            st.json(obter_controlador_fila().estado())
+            st.caption("Status de conexão")
+            st.json(obter_cache_status().estatisticas())
+            st.caption("Telegram")
+            st.json(obter_despachante_telegram().estatisticas())
+            st.caption("Google Sheets")
+            st.json(obter_pool_sheets().estatisticas())
+            st.caption(f"Armazenamento ({obter_armazenamento().nome})")
+            st.json(obter_armazenamento().estatisticas())
+            if st.session_state.get('ultima_escrita_sheets'):
+                st.caption("Última escrita dos dados do job")
+                st.json(st.session_state.ultima_escrita_sheets)
+            st.caption("Jobs")
+            st.json(obter_registro_jobs().estatisticas())
+            st.caption("Envios")
+            st.json(obter_despachante_envios().estatisticas())
+            st.caption("Ritmo de envio por remetente")
+            st.json(obter_agendador_envio().estatisticas())
+            st.caption("Tempo por etapa (processo)")
+            st.json(obter_metricas().resumo())
+            st.caption(f"Orçamento do rerun ({ORCAMENTO_RERUN_MS} ms)")
+            if st.session_state.get('ultimo_rerun'):
+                st.json({'ultimo_desta_sessao': st.session_state.ultimo_rerun})
+            st.json(obter_metricas().resumo_reruns(ORCAMENTO_RERUN_MS))
+            if st.session_state.get('id_job'):
+                st.caption(f"Log do job {st.session_state.id_job}")
+                st.json(obter_metricas().ler_log(st.session_state.id_job)[-20:])
+
+cronometro_rerun.marcar("sidebar")
+
 if not st.session_state.tel_corporativo or not st.session_state.is_connected:
     st.title("Cobra AI")
     st.info("👈 Informe o WhatsApp corporativo.")
@@ -391,6 +582,14 @@ if not st.session_state.tel_corporativo or not st.session_state.is_connected:
 st.title("Cobra AI")
 st.caption(f"ID: 📱 {st.session_state.tel_corporativo}")
 
+# Sessão nova (página recarregada, conexão caída): reencontra o job aberto da instância
+if st.session_state.id_job is None and st.session_state.get('job_verificado') != st.session_state.tel_corporativo:
+    st.session_state.job_verificado = st.session_state.tel_corporativo
+    job_aberto = obter_registro_jobs().job_retomavel(st.session_state.tel_corporativo)
+    if job_aberto:
+        retomar_job(job_aberto)
+        st.toast(f"🔄 Retomando o job de {job_aberto['nome_arquivo']} ({job_aberto['etapa']})")
+
 # Etapa 1: Upload
 st.subheader("📁 1. Envie sua planilha")
 with st.expander("Upload", expanded=False):
@@ -406,30 +605,60 @@ with st.expander("Upload", expanded=False):
         ,
     )
 
-if not uploaded_file:
+# Lê e limpa a planilha uma única vez por conteúdo (não pelo nome do arquivo);
+# o hash do conteúdo fica guardado por upload para não refazê-lo a cada rerun
+if uploaded_file:
+    conteudo_arquivo = uploaded_file.getvalue()
+    nome_arquivo = uploaded_file.name
+    if st.session_state.get('hash_upload', (None, None))[0] != uploaded_file.file_id:
+        st.session_state.hash_upload = (uploaded_file.file_id, hash_conteudo(conteudo_arquivo))
+    id_arquivo = st.session_state.hash_upload[1]
+elif st.session_state.arquivo_retomado:
+    # Job retomado: a planilha vem do registro, sem novo upload
+    nome_arquivo, conteudo_arquivo = obter_registro_jobs().arquivo(st.session_state.arquivo_retomado)
+    if conteudo_arquivo is None:
+        st.session_state.arquivo_retomado = None
+        st.stop()
+    id_arquivo = st.session_state.arquivo_retomado
+    st.caption(f"📄 {nome_arquivo} (job retomado)")
+else:
     st.stop()
 
-# Barra de progresso apenas para novo arquivo
-# Logo após o upload, antes da validação
-if st.session_state.get('ultimo_arquivo') != uploaded_file.name:
-    # Novo arquivo: lê e valida colunas
-    df = (
-        pd.read_excel(uploaded_file, dtype=str)
-        if uploaded_file.name.endswith(".xlsx")
-        else pd.read_csv(uploaded_file, dtype=str)
+# Cada planilha nova abre um job; o log do job acompanha até o envio
+job_novo = st.session_state.id_job_arquivo != id_arquivo
+if job_novo:
+    st.session_state.id_job = uuid.uuid4().hex[:12]
+    st.session_state.id_job_arquivo = id_arquivo
+    if st.session_state.aguardando_fila:
+        # Pedido de geração da planilha anterior: não vale para esta
+        sair_da_fila(st.session_state.tel_corporativo)
+        st.session_state.aguardando_fila = False
+
+with medir("carga_planilha", bytes=len(conteudo_arquivo)) as dados_carga:
+    df, tempos_carga = carregar_planilha(
+        conteudo_arquivo,
+        nome_arquivo,
+        id_arquivo,
+        cache=obter_cache_planilhas(),
+        em_blocos=MODO_INGESTAO_STREAMING,
     )
-    
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-    df = df.replace("", pd.NA)
-    df = df.dropna(how="all")
-
+    dados_carga.update(tempos_carga)
+if job_novo:
+    obter_registro_jobs().criar(
+        st.session_state.id_job, st.session_state.tel_corporativo, id_arquivo, nome_arquivo, len(df)
+    )
+arquivo_novo = st.session_state.get('ultimo_arquivo') != id_arquivo
 
-    colunas_obrigatorias = ["Cliente", "Nome", "Valor", "Vencimento", "Telefone"]
-    colunas_faltantes = [c for c in colunas_obrigatorias if c not in df.columns]
+if MODO_DEBUG:
+    st.caption(
+        f"⏱️ Leitura: {tempos_carga['leitura_s']}s · Limpeza: {tempos_carga['limpeza_s']}s"
+        f"{' (cache)' if tempos_carga['do_cache'] else ''}"
+    )
 
-    if colunas_faltantes:
-        st.error(f"❌ Colunas faltantes: {', '.join(colunas_faltantes)}")
-        st.info("""
+faltantes = colunas_faltantes(df)
+if faltantes:
+    st.error(f"❌ Colunas faltantes: {', '.join(faltantes)}")
+    st.info("""
      📋 **Formato correto da planilha**
 
      **Cliente** → Código único do cliente (8 dígitos iniciais do CNPJ/CPF)
@@ -438,16 +667,14 @@ if st.session_state.get('ultimo_arquivo') != uploaded_file.name:
      
      **Valor** → Valor do boleto em aberto
      """)
-        st.write("Colunas encontradas:", df.columns.tolist())
-        st.stop()
-  
+    st.write("Colunas encontradas:", df.columns.tolist())
+    st.stop()
 
-    if 'Código_Cliente' in df.columns:
-        clientes_unicos = df['Código_Cliente'].nunique()
-    elif 'Cliente' in df.columns:
-        clientes_unicos = df['Cliente'].nunique()
-    else:
-        clientes_unicos = len(df)
+derivados_planilha = resumo_planilha(id_arquivo, df)
+clientes_unicos = derivados_planilha['clientes_unicos']
+coluna_telefone = derivados_planilha['coluna_telefone']
+
+if arquivo_novo:
     # Valida limite de linhas
     if len(df) > MAX_REGISTROS:
         st.error(
@@ -456,15 +683,14 @@ if st.session_state.get('ultimo_arquivo') != uploaded_file.name:
         )
         st.stop()
 
-     # Notifica upload apenas para arquivo novo
-if st.session_state.get('ultimo_arquivo') != uploaded_file.name:
+    # Notifica upload apenas para arquivo novo
     notificar_telegram(
         f"📤 *Planilha Enviada!*\n"
         f"📱 WhatsApp: `{st.session_state.tel_corporativo}`\n"
         f"👥 Clientes distintos: *{clientes_unicos}*\n"
         f"📋 Total de registros: *{len(df)}*\n"
         f"📅 {datetime.now().strftime('%d/%m/%Y às %H:%M')}"
-    )   
+    )
 
     # Valida limite de clientes distintos
     if clientes_unicos > MAX_CLIENTES:
@@ -472,146 +698,90 @@ if st.session_state.get('ultimo_arquivo') != uploaded_file.name:
             f"⚠️ Sua planilha possui **{clientes_unicos}** clientes distintos, o limite é de **{MAX_CLIENTES}**. "
             f"Divida a planilha em partes menores e tente novamente."
         )
-        st.stop()    
-
-else:
-    df = (
-        pd.read_excel(uploaded_file, dtype=str)
-        if uploaded_file.name.endswith(".xlsx")
-        else pd.read_csv(uploaded_file, dtype=str)
-    )
-
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-    df = df.replace("", pd.NA)
-    df = df.dropna(how="all")
-
-    colunas_obrigatorias = ["Cliente", "Nome", "Valor", "Vencimento", "Telefone"]
-    colunas_faltantes = [c for c in colunas_obrigatorias if c not in df.columns]
-
-    if colunas_faltantes:
-        st.error(f"❌ Colunas faltantes: {', '.join(colunas_faltantes)}")
-        st.write("Colunas encontradas:", df.columns.tolist())
         st.stop()
 
-    if 'Código_Cliente' in df.columns:
-        clientes_unicos = df['Código_Cliente'].nunique()
-    elif 'Cliente' in df.columns:
-        clientes_unicos = df['Cliente'].nunique()
-    else:
-        clientes_unicos = len(df)
-        
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-    df = df.replace("", pd.NA)
-    df = df.dropna(how="all")    
-
-# Inicializa estado para validação em background (SEMPRE EXECUTA)
-if 'validacao_backend_concluida' not in st.session_state or st.session_state.get('ultimo_arquivo') != uploaded_file.name:
-    st.session_state.validacao_backend_concluida = False
-    st.session_state.resultados_validacao = {}
-    st.session_state.indice_validacao = 0
-    st.session_state.ultimo_arquivo = uploaded_file.name
+# Lista de números a validar, montada uma vez por planilha
+if 'lista_numeros' not in st.session_state or arquivo_novo:
+    st.session_state.ultimo_arquivo = id_arquivo
 
-    numeros_brutos = df['Telefone'].dropna().astype(str).str.replace('.0', '', regex=False).str.strip().tolist()
-    st.session_state.lista_numeros = list(set(numeros_brutos))
+    # Formatos diferentes do mesmo número já chegam colapsados pela chave normalizada
+    st.session_state.lista_numeros = numeros_unicos(df)
 
-coluna_telefone = None
-for col in df.columns:
-    if "tel" in col.lower() or "fone" in col.lower() or "whats" in col.lower():
-        coluna_telefone = col
-        break
+cronometro_rerun.marcar("carga_planilha")
 
-if coluna_telefone is None and 'Telefone' in df.columns:
-    coluna_telefone = 'Telefone'
-
-    
 # ==========================================
 # VALIDAÇÃO EM BACKGROUND (SEMPRE EXECUTA)
 # ==========================================
-# SUBSTITUA o bloco de validação em background por este:
-if not st.session_state.validacao_backend_concluida:
-    total_numeros = len(st.session_state.lista_numeros)
-    inicio = st.session_state.indice_validacao
-    fim = min(inicio + 5, total_numeros)
-
-    # Barra de progresso real vinculada à validação
-    pct = int((inicio / total_numeros) * 100) if total_numeros > 0 else 0
-    texto_progresso = f"🔍 Analisando dados enviados... {pct}%"
-    
-    st.progress(pct, text=texto_progresso)
-
-    if inicio < total_numeros:
-        lote = st.session_state.lista_numeros[inicio:fim]
-
-        for numero in lote:
-            chave = re.sub(r'\D', '', str(numero))
-            if not chave or chave in st.session_state.resultados_validacao:
-                continue
-
-            try:
-                numero_api = chave
-                if not numero_api.startswith('55') and len(numero_api) in (10, 11):
-                    numero_api = '55' + numero_api
-                if len(numero_api) == 12:
-                    numero_api = numero_api[:4] + '9' + numero_api[4:]
-
-                url_check = f"{EVOLUTION_API_URL}/chat/whatsappNumbers/{st.session_state.tel_corporativo}"
-                payload = {"numbers": [numero_api]}
-                headers = {"apikey": EVOLUTION_API_KEY, "Content-Type": "application/json"}
-
-                resp = requests.post(url_check, json=payload, headers=headers, timeout=5)
-
-                valido = False
-                if resp.status_code in [200, 201]:
-                    try:
-                        dados = resp.json()
-                        if isinstance(dados, list) and len(dados) > 0:
-                            valido = dados[0].get('exists', False)
-                    except Exception:
-                        valido = False
-
-                st.session_state.resultados_validacao[chave] = {'valido': valido}
-
-            except Exception:
-                st.session_state.resultados_validacao[chave] = {'valido': False}
-
-            time.sleep(0.2)
-
-        st.session_state.indice_validacao = fim
-        st.rerun()
+# Um trabalho por (planilha, instância) roda no executor do processo e segue
+# mesmo sem reruns; nova planilha ou novo número cancela o trabalho anterior
+chave_validacao = (id_arquivo, st.session_state.tel_corporativo)
+if st.session_state.get('chave_validacao') != chave_validacao:
+    if st.session_state.get('chave_validacao'):
+        obter_executor_validacao().cancelar(st.session_state.chave_validacao)
+    st.session_state.chave_validacao = chave_validacao
+    st.session_state.validacao_backend_concluida = False
+    st.session_state.resultados_validacao = {}
 
-    else:
+@st.fragment(run_every=1)
+def acompanhar_validacao(chave_validacao, numeros, id_job):
+    trabalho = obter_executor_validacao().obter(chave_validacao)
+    if trabalho is None or trabalho['estado'] == ESTADO_CANCELADA:
+        # Outra sessão com a mesma planilha cancelou (ou o resultado expirou): recomeça
+        trabalho = obter_executor_validacao().iniciar(chave_validacao, numeros, chave_validacao[1], id_job)
+    if trabalho['estado'] == ESTADO_CONCLUIDA:
+        st.session_state.resultados_validacao = obter_executor_validacao().resultados(chave_validacao)
         st.session_state.validacao_backend_concluida = True
         st.rerun()
+    if trabalho['estado'] == ESTADO_FALHOU:
+        st.error(f"❌ Erro ao validar os números: {trabalho['erro']}")
+        # iniciar substitui o trabalho que falhou
+        if st.button("🔄 Tentar novamente", key="tentar_validacao_novamente"):
+            obter_executor_validacao().iniciar(chave_validacao, numeros, chave_validacao[1], id_job)
+            st.rerun(scope="fragment")
+        return
+    pct = int(trabalho['concluidos'] / trabalho['total'] * 100) if trabalho['total'] else 100
+    st.progress(
+        pct,
+        text=f"🔍 Analisando dados enviados... {pct}% (lote {trabalho['lotes_prontos']}/{trabalho['total_lotes']})"
+    )
+
+if not st.session_state.validacao_backend_concluida:
+    # O fragmento inicia o trabalho; um que falhou só recomeça pelo botão
+    acompanhar_validacao(chave_validacao, st.session_state.lista_numeros, st.session_state.id_job)
+    cronometro_rerun.marcar("validacao")
+    st.stop()
+
+cronometro_rerun.marcar("validacao")
 
 # ==========================================
 # EXIBIÇÃO FINAL COM VALIDAÇÃO VISUAL OPCIONAL
 # ==========================================
+# Validade por linha, via junção da chave normalizada com os resultados;
+# refeita só quando o arquivo ou a quantidade de resultados muda
+chave_validos = (id_arquivo, len(st.session_state.resultados_validacao))
+if st.session_state.get('chave_validos') != chave_validos:
+    with obter_metricas().medir("pandas_validos", st.session_state.tel_corporativo):
+        st.session_state.validos_planilha = serie_validos(df, st.session_state.resultados_validacao)
+    st.session_state.chave_validos = chave_validos
+validos = st.session_state.validos_planilha
+
 if st.session_state.validacao_backend_concluida and coluna_telefone:
     total_registros = len(df)
-    validos_count = 0
-    invalidos_count = 0
-
-    def get_status_bool(tel):
-        chave = re.sub(r'\D', '', str(tel or ""))
-        return st.session_state.resultados_validacao.get(chave, {}).get('valido', False)
-
-    for tel in df[coluna_telefone]:
-        if get_status_bool(tel):
-            validos_count += 1
-        else:
-            invalidos_count += 1
+    validos_count = int(validos.sum())
+    invalidos_count = total_registros - validos_count
 
     st.success(f"✅ Planilha carregada com sucesso! {total_registros} registros encontrados.")
 # Toggle apenas para exibição visual
     st.session_state.mostrar_validacao_visual = st.toggle(
         "🔍 WhatsApp?",
         value=st.session_state.mostrar_validacao_visual,
-        help="Destaca em vermelho os números sem WhatsApp."
+        help="Mostra quais números têm WhatsApp."
     )
+    so_invalidos = False
     if st.session_state.mostrar_validacao_visual and invalidos_count > 0:
         st.caption(f"⚠️ {invalidos_count} número(s) sem WhatsApp.")
+        so_invalidos = st.checkbox("Mostrar só os números sem WhatsApp", value=False)
 
-    MAX_MENSAGENS = 500
     if validos_count > MAX_MENSAGENS:
         st.error(f"⚠️ Limite de {MAX_MENSAGENS} mensagens excedido. Você tem {validos_count} válidos.")
         st.stop()
@@ -620,25 +790,38 @@ if st.session_state.validacao_backend_concluida and coluna_telefone:
         st.error("❌ Nenhum telefone válido encontrado.")
         st.stop()
 
-    def destacar_celula_numero(val):
-        if not st.session_state.mostrar_validacao_visual:
-            return ""
-        chave = re.sub(r'\D', '', str(val))
-        info = st.session_state.resultados_validacao.get(chave, {})
-        if not info.get('valido', False):
-            return "background-color: rgba(255, 80, 80, 0.2);"
-        return ""
+    # Preview sem Styler: a validade é uma coluna comum (column_config) e só
+    # a página visível vai para o navegador, então o custo não cresce com a planilha
+    linhas_preview = df[~validos] if so_invalidos else df
+    total_paginas = max(1, -(-len(linhas_preview) // LINHAS_POR_PAGINA_PREVIEW))
+    pagina = 1
+    if total_paginas > 1:
+        pagina = st.number_input(
+            f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1, step=1,
+            key=f"pagina_preview_{id_arquivo[:12]}_{int(so_invalidos)}",
+        )
+    inicio = (pagina - 1) * LINHAS_POR_PAGINA_PREVIEW
+    df_pagina = linhas_preview.iloc[inicio:inicio + LINHAS_POR_PAGINA_PREVIEW]
 
+    colunas_preview = derivados_planilha['colunas_visiveis']
     if st.session_state.mostrar_validacao_visual:
-        styled_df = df.style.applymap(destacar_celula_numero, subset=[coluna_telefone])
-        st.write("📋 **Preview dos Dados:** (Números sem WhatsApp destacados em vermelho)")
+        df_pagina = df_pagina.assign(_whatsapp=validos.loc[df_pagina.index])
+        colunas_preview = ["_whatsapp"] + colunas_preview
+        st.write("📋 **Preview dos Dados:** (✔ = número com WhatsApp)")
     else:
-        styled_df = df
         st.write("📋 **Preview dos Dados:**")
 
-    st.dataframe(styled_df, use_container_width=True, hide_index=True, height=500)
+    st.dataframe(
+        df_pagina, use_container_width=True, hide_index=True, height=500,
+        column_order=colunas_preview,
+        column_config={"_whatsapp": st.column_config.CheckboxColumn("WhatsApp?", width="small")},
+    )
+    if total_paginas > 1:
+        st.caption(f"Linhas {inicio + 1}–{inicio + len(df_pagina)} de {len(linhas_preview)}")
     st.divider()
 
+cronometro_rerun.marcar("preview")
+
 # Etapa 2: Tom da mensagem
 st.subheader("⚙️ 2. Configurar Tom da Mensagem")
 template = st.selectbox("Selecione o tom", ["Empático", "Formal", "Urgente"], index=0)
@@ -648,18 +831,17 @@ st.divider()
 # Etapa 3: Gerar
 st.subheader("🪄 3. Gerar mensagens personalizadas")
 
-pode_gerar = not st.session_state.processo_iniciado and not st.session_state.geracao_finalizada
 instancia_atual = st.session_state.tel_corporativo
-
-# Verifica fila de lotação
-pode_prosseguir, posicao, total_fila, msg_fila = verificar_fila(instancia_atual)
-
-if not pode_prosseguir:
-    st.info(f"⏳ {msg_fila}")
-    st.progress(0)
-    st.caption(f"Capacidade: {total_fila}/{MAX_USUARIOS_SIMULTANEOS} usuários simultâneos")
-    time.sleep(3)
-    st.rerun()
+# Uma geração nova reescreve a aba da instância: espera o envio em curso terminar
+envio_em_curso = obter_despachante_envios().grupo_enviando(instancia_atual)
+pode_gerar = (
+    not st.session_state.processo_iniciado
+    and not st.session_state.geracao_finalizada
+    and not envio_em_curso
+    and verificar_trava_instancia(instancia_atual)[0]
+)
+if envio_em_curso and not st.session_state.geracao_finalizada:
+    st.caption("⏳ Há um envio em andamento neste número; a geração libera quando ele terminar.")
 
 st.markdown("""
 <style>
@@ -676,20 +858,50 @@ div.stButton > button:first-child:hover {
 """, unsafe_allow_html=True)
 
 
-if st.button("Gerar mensagens agora", type="primary", use_container_width=True, disabled=not pode_gerar):
+# A fila só vale para a geração: entra ao clicar em "Gerar", segura a vaga
+# durante o polling (heartbeat) e sai quando a geração termina. Preview,
+# revisão e envio nunca esperam por ela.
+@st.fragment(run_every=3)
+def aguardar_vaga(instancia_atual):
+    if st.button("Sair da fila", key="sair_da_fila"):
+        sair_da_fila(instancia_atual)
+        st.session_state.aguardando_fila = False
+        st.rerun()
+    status_fila = verificar_fila(instancia_atual)
+    if status_fila['admitido']:
+        st.rerun()
+    st.info(f"⏳ {status_fila['mensagem']}")
+    st.caption(
+        f"Capacidade: {status_fila['ativos']}/{MAX_USUARIOS_SIMULTANEOS} usuários simultâneos · "
+        f"{status_fila['na_fila']} na fila · espera estimada ~{max(1, round(status_fila['espera_estimada_s'] / 60))} min"
+    )
+
+if st.button(
+    "Gerar mensagens agora", type="primary", use_container_width=True,
+    disabled=not pode_gerar or st.session_state.aguardando_fila,
+):
+    st.session_state.aguardando_fila = True
+
+iniciar_geracao = False
+if st.session_state.aguardando_fila and pode_gerar:
+    if verificar_fila(instancia_atual)['admitido']:
+        st.session_state.aguardando_fila = False
+        iniciar_geracao = True
+    else:
+        aguardar_vaga(instancia_atual)
+cronometro_rerun.marcar("fila")
+
+if iniciar_geracao:
     if len(df) > MAX_REGISTROS:
+        sair_da_fila(instancia_atual)
         st.warning(f"⚠️ Sua planilha tem {len(df)} registros, mas o limite por execução é {MAX_REGISTROS}.")
         st.stop()
 
-    st.session_state.fila_usuarios[instancia_atual] = time.time()
     definir_instancia_ocupada(instancia_atual, True)
 
     # SEMPRE filtra apenas números válidos (independente do toggle visual)
-    def eh_valido(tel):
-        chave = re.sub(r'\D', '', str(tel or ""))
-        return st.session_state.resultados_validacao.get(chave, {}).get('valido', False)
-
-    df_filtrado = df[df['Telefone'].apply(eh_valido)].copy()
+    with medir("pandas_filtrar_validos", linhas=len(df)):
+        df_filtrado = df.loc[validos, derivados_planilha['colunas_visiveis']].copy()
 
     if len(df_filtrado) == 0:
         sair_da_fila(instancia_atual)
@@ -698,31 +910,44 @@ if st.button("Gerar mensagens agora", type="primary", use_container_width=True,
         st.stop()
 
     # Salva no Google Sheets sem spinner
-    sucesso, nome_aba_usada = salvar_no_google_sheets(df_filtrado, ID_PLANILHA_GOOGLE, instancia_atual)
+    sucesso, nome_aba_usada = salvar_dados_job(df_filtrado, instancia_atual)
     if not sucesso:
         sair_da_fila(instancia_atual)
         definir_instancia_ocupada(instancia_atual, False)
         st.info("💡 Verifique se o credentials.json está na pasta.")
         st.stop()
 
+    payload_geracao = {
+        "tom_mensagem": template.lower(),
+        "total_clientes": len(df_filtrado),
+        "data_execucao": datetime.now().isoformat(),
+        "data_hoje": datetime.now().strftime("%d/%m/%Y"),
+        "aba_google_sheets": nome_aba_usada,
+        "remetente": instancia_atual
+    }
+
+    # Registra o job antes do webhook para não perder callbacks imediatos
+    receptor = obter_receptor_callback() if MODO_CALLBACK else None
+    id_job_callback = None
+    if receptor is not None:
+        id_job_callback = uuid.uuid4().hex
+        receptor.registrar(id_job_callback)
+        payload_geracao["id_job"] = id_job_callback
+        payload_geracao["url_callback"] = receptor.url_para(id_job_callback)
+
     # Aciona o webhook sem spinner
     try:
-        resp = requests.post(
-            URL_WEBHOOK_N8N_GERAR,
-            json={
-                "tom_mensagem": template.lower(),
-                "total_clientes": len(df_filtrado),
-                "data_execucao": datetime.now().isoformat(),
-                "data_hoje": datetime.now().strftime("%d/%m/%Y"),
-                "aba_google_sheets": nome_aba_usada,
-                "remetente": instancia_atual
-            },
-            headers={
-                "Content-Type": "application/json",
-                "X-Chave-Secreta": CHAVE_SECRETA_N8N
-            },
-            timeout=(10, 60)  # (conexão, leitura)
-        )
+        with medir("webhook_gerar", clientes=len(df_filtrado)) as dados_webhook:
+            resp = requests.post(
+                URL_WEBHOOK_N8N_GERAR,
+                json=payload_geracao,
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Chave-Secreta": CHAVE_SECRETA_N8N
+                },
+                timeout=(10, 60)  # (conexão, leitura)
+            )
+            dados_webhook['status'] = resp.status_code
 
         resposta_n8n = None
         if resp.status_code == 200:
@@ -731,6 +956,8 @@ if st.button("Gerar mensagens agora", type="primary", use_container_width=True,
             except Exception:
                 resposta_n8n = {"total_mensagens_previstas": len(df_filtrado)}
         else:
+            if id_job_callback:
+                receptor.remover(id_job_callback)
             sair_da_fila(instancia_atual)
             definir_instancia_ocupada(instancia_atual, False)
             st.error(f"❌ Erro ao iniciar: Status {resp.status_code}")
@@ -752,6 +979,18 @@ if st.button("Gerar mensagens agora", type="primary", use_container_width=True,
         st.session_state.ultima_atualizacao = time.time()
         st.session_state.progress_step = 0
         st.session_state.mensagens_recebidas = []
+        st.session_state.leitor_mensagens = None
+        st.session_state.id_job_callback = id_job_callback
+        obter_registro_jobs().iniciar_geracao(
+            st.session_state.id_job,
+            instancia_atual,
+            conteudo_arquivo,
+            tom=template,
+            total_validos=len(df_filtrado),
+            total_previsto=int(total_previsto),
+            id_job_callback=id_job_callback,
+        )
+        st.session_state.ultimo_callback = time.time()
         notificar_telegram(
     f"🤖 *Geração Iniciada!*\n"
     f"📱 WhatsApp: `{instancia_atual}`\n"
@@ -762,11 +1001,15 @@ if st.button("Gerar mensagens agora", type="primary", use_container_width=True,
         st.rerun()
 
     except Exception as e:
+        if id_job_callback:
+            receptor.remover(id_job_callback)
         sair_da_fila(instancia_atual)
         definir_instancia_ocupada(instancia_atual, False)
         st.error(f"❌ Erro inesperado: {str(e)}")
         st.code(traceback.format_exc())
 
+cronometro_rerun.marcar("geracao")
+
 # ==============================================
 # POLLING
 # ==============================================
@@ -781,38 +1024,134 @@ condicao_polling = processo_iniciado or (
     len(mensagens_recebidas) < total_previsto
 )
 
-if condicao_polling:
-    if instancia_atual in st.session_state.get('fila_usuarios', {}):
-        st.session_state.fila_usuarios[instancia_atual] = time.time()
+# Só este trecho se repete no próprio timer; o resto da página fica parado
+# até a geração terminar, quando um rerun completo abre a revisão
+@st.fragment(run_every=INTERVALO_TELA_GERACAO)
+def acompanhar_geracao(instancia_atual, total_padrao):
+    obter_controlador_fila().heartbeat(instancia_atual)
 
-    try:
-        mensagens = carregar_mensagens_do_sheets(ID_PLANILHA_GOOGLE, instancia_atual)
-        if not isinstance(mensagens, list):
-            mensagens = []
-        st.session_state.mensagens_recebidas = mensagens
-    except Exception:
-        mensagens = st.session_state.get('mensagens_recebidas', []) or []
-        st.session_state.mensagens_recebidas = mensagens
+    id_job_callback = st.session_state.get('id_job_callback')
+    receptor = obter_receptor_callback() if (MODO_CALLBACK and id_job_callback) else None
+    usar_callback = receptor is not None and receptor.registrado(id_job_callback)
 
-    total_gerado = len(mensagens) if isinstance(mensagens, list) else 0
-    total_esperado = st.session_state.get("total_mensagens_previstas", len(df)) or 1
+    with medir("fragmento_geracao", instancia_atual, callback=usar_callback):
+        try:
+            if usar_callback:
+                with medir("callback_espera") as dados_espera:
+                    novas = receptor.aguardar(id_job_callback, timeout=CALLBACK_ESPERA_SEGUNDOS)
+                    dados_espera['novas'] = len(novas)
+                if novas:
+                    st.session_state.ultimo_callback = time.time()
+                    with medir("callback_registrar", mensagens=len(novas)):
+                        obter_armazenamento().registrar_mensagens(instancia_atual, novas)
+                elif time.time() - st.session_state.get('ultimo_callback', 0) > CALLBACK_FALLBACK_SEGUNDOS:
+                    # n8n não está avisando: volta a ler a planilha desde o início
+                    receptor.remover(id_job_callback)
+                    st.session_state.id_job_callback = None
+                    st.session_state.leitor_mensagens = None
+                    st.session_state.mensagens_recebidas = []
+                    usar_callback = False
+                    novas = carregar_novas_mensagens(instancia_atual)
+            else:
+                novas = carregar_novas_mensagens(instancia_atual)
+            mensagens = (st.session_state.get('mensagens_recebidas', []) or []) + novas
+            st.session_state.mensagens_recebidas = mensagens
+        except Exception:
+            mensagens = st.session_state.get('mensagens_recebidas', []) or []
+            st.session_state.mensagens_recebidas = mensagens
+
+        total_gerado = len(mensagens) if isinstance(mensagens, list) else 0
+        total_esperado = st.session_state.get("total_mensagens_previstas", total_padrao) or 1
+        concluida = total_esperado > 0 and total_gerado >= total_esperado
+
+        if concluida:
+            if usar_callback:
+                receptor.remover(id_job_callback)
+                st.session_state.id_job_callback = None
+            st.session_state.processo_iniciado = False
+            st.session_state.geracao_finalizada = True
+            obter_metricas().registrar_evento(
+                st.session_state.id_job, instancia_atual, "geracao_concluida", mensagens=total_gerado
+            )
+            obter_registro_jobs().atualizar(st.session_state.id_job, etapa=ETAPA_REVISAO, total_gerado=total_gerado)
+            definir_instancia_ocupada(instancia_atual, False)  # antes de sair, para registrar a duração
+            sair_da_fila(instancia_atual)
+        else:
+            st.info(f"✨ IA escrevendo mensagens ... ({total_gerado}/{total_esperado})")
+            if total_esperado > 0:
+                progresso = min(100, int((total_gerado / total_esperado) * 100))
+                st.progress(progresso)
 
-    if total_esperado > 0 and total_gerado >= total_esperado:
-        st.session_state.processo_iniciado = False
-        st.session_state.geracao_finalizada = True
-        sair_da_fila(instancia_atual)
-        definir_instancia_ocupada(instancia_atual, False)
-        time.sleep(3)
+    if concluida:
         st.rerun()
-    else:
-        st.info(f"✨ IA escrevendo mensagens ... ({total_gerado}/{total_esperado})")
-        if total_esperado > 0:
-            progresso = min(100, int((total_gerado / total_esperado) * 100))
-            st.progress(progresso)
 
-        time.sleep(5)
+if condicao_polling:
+    acompanhar_geracao(instancia_atual, len(df))
+
+cronometro_rerun.marcar("polling")
+
+# ==============================================
+# ACOMPANHAMENTO DO ENVIO
+# ==============================================
+# Envio desta sessão ou um envio anterior da instância que ficou sem confirmação completa
+despachante_envios = obter_despachante_envios()
+id_grupo_envio = st.session_state.id_grupo_envio or despachante_envios.grupo_em_aberto(instancia_atual)
+progresso_envio = despachante_envios.progresso_grupo(id_grupo_envio) if id_grupo_envio else None
+
+def exibir_progresso_envio(progresso_envio):
+    confirmadas = progresso_envio['enviados'] + progresso_envio['falhos']
+    total_envio = progresso_envio['total'] or 1
+    st.progress(
+        min(100, int(confirmadas / total_envio * 100)),
+        text=f"📤 {confirmadas}/{progresso_envio['total']} mensagens confirmadas pelo n8n "
+             f"({progresso_envio['lotes_confirmados']} lotes)"
+    )
+    if progresso_envio['pendentes']:
+        st.caption(f"⏱️ Término estimado em ~{max(1, round(progresso_envio['eta_s'] / 60))} min")
+    if len(progresso_envio['shards']) > 1:
+        for shard in progresso_envio['shards']:
+            st.caption(
+                f"📱 {shard['instancia']}: {shard['enviados'] + shard['falhos']}/{shard['total']}"
+                f"{' · ~' + str(max(1, round(shard['eta_s'] / 60))) + ' min' if shard['pendentes'] else ' ✅'}"
+            )
+
+# Enquanto o envio roda, só a barra se atualiza; ao terminar, um rerun completo mostra o resultado
+@st.fragment(run_every=INTERVALO_TELA_ENVIO)
+def acompanhar_envio(id_grupo_envio):
+    with medir("fragmento_envio"):
+        progresso_envio = obter_despachante_envios().progresso_grupo(id_grupo_envio)
+        exibir_progresso_envio(progresso_envio)
+    if not progresso_envio['em_andamento']:
         st.rerun()
 
+if progresso_envio:
+    st.divider()
+    st.subheader("📤 Envio")
+
+    if progresso_envio['em_andamento']:
+        st.session_state.id_grupo_envio = id_grupo_envio
+        acompanhar_envio(id_grupo_envio)
+    elif progresso_envio['estado'] == ESTADO_CONCLUIDO:
+        # Registro do job e aviso no Telegram já saíram da thread do envio (concluir_grupo_envio)
+        exibir_progresso_envio(progresso_envio)
+        st.info("As mensagens serão enviadas com intervalo aleatório")
+        st.success(f"🎉 As {progresso_envio['enviados']} mensagens foram entregues ao n8n com sucesso!")
+        if progresso_envio['falhos']:
+            st.warning(f"⚠️ {progresso_envio['falhos']} mensagem(ns) recusada(s) pelo n8n.")
+        st.session_state.id_grupo_envio = None
+    else:
+        exibir_progresso_envio(progresso_envio)
+        st.warning(
+            f"⚠️ Envio interrompido: {progresso_envio['pendentes']} mensagem(ns) ainda sem confirmação."
+            f"{' Último erro: ' + progresso_envio['ultimo_erro'] if progresso_envio['ultimo_erro'] else ''}"
+        )
+        if st.button("🔁 Retomar envio", use_container_width=True):
+            st.session_state.id_grupo_envio = id_grupo_envio
+            despachante_envios.iniciar_grupo(id_grupo_envio)
+            st.rerun()
+
+cronometro_rerun.marcar("acompanhamento_envio")
+
 # ==============================================
 # SEÇÃO DE REVISÃO E ENVIO
 # ==============================================
@@ -823,38 +1162,31 @@ if not isinstance(mensagens_recebidas, list):
     mensagens_recebidas = []
     st.session_state.mensagens_recebidas = []
 
-if geracao_finalizada and len(mensagens_recebidas) > 0:
+if geracao_finalizada and len(mensagens_recebidas) > 0 and not condicao_polling:
     st.divider()
     st.subheader("✨ 4. Revisar e Enviar Mensagens")
 
-    try:
-        df_mensagens = pd.DataFrame(mensagens_recebidas)
-    except Exception as e:
-        st.error(f"❌ Erro ao processar mensagens: {str(e)}")
-        st.stop()
+    # Quadro da revisão montado uma vez por job; cada rerun só reaplica a seleção padrão
+    chave_revisao = (st.session_state.id_job, len(mensagens_recebidas))
+    if st.session_state.get('chave_revisao') != chave_revisao:
+        try:
+            with obter_metricas().medir("pandas_revisao", instancia_atual):
+                st.session_state.quadro_revisao = preparar_quadro_revisao(mensagens_recebidas)
+        except Exception as e:
+            st.error(f"❌ Erro ao processar mensagens: {str(e)}")
+            st.stop()
+        st.session_state.chave_revisao = chave_revisao
+        st.session_state.quadros_editor = {}
+    quadro_revisao = st.session_state.quadro_revisao
 
-    if df_mensagens.empty:
+    if quadro_revisao.empty:
         st.warning("⚠️ Nenhuma mensagem para exibir.")
         st.stop()
 
-    if 'nome' in df_mensagens.columns:
-        try:
-            df_mensagens = df_mensagens.sort_values('nome', ascending=True).reset_index(drop=True)
-        except Exception:
-            pass
-
-    # Remove colunas desnecessárias antes de exibir
-    colunas_remover = ['codigo_cliente', 'status_validacao']
-    for col in colunas_remover:
-        if col in df_mensagens.columns:
-            df_mensagens.drop(columns=[col], inplace=True)
-
-    # Adiciona coluna "Enviar"
-    df_mensagens.insert(0, "Enviar", st.session_state.selecionar_todos)
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-    df = df.replace("", pd.NA)
-    df = df.dropna(how="all")
-
+    selecionado_padrao = st.session_state.selecionar_todos
+    if selecionado_padrao not in st.session_state.quadros_editor:
+        st.session_state.quadros_editor[selecionado_padrao] = quadro_revisao.assign(Enviar=selecionado_padrao)
+    df_mensagens = st.session_state.quadros_editor[selecionado_padrao]
 
     # Checkbox mestre
     st.checkbox(
@@ -866,33 +1198,6 @@ if geracao_finalizada and len(mensagens_recebidas) > 0:
 
 
     st.write("📋 **Resumo das Mensagens:** (Dê dois cliques na mensagem para editar, se necessário. 😉)")
-    # ============================================
-    # REMOVE LINHAS EM BRANCO (VÁRIAS CONDIÇES)
-    # ============================================
-
-    # Remove linhas onde a mensagem está vazia, null ou só com espaços
-    df_mensagens = df_mensagens[
-        df_mensagens["mensagem"].notna() &  # não é null/NaN
-        (df_mensagens["mensagem"].astype(str).str.strip() != "")  # não é vazio nem só espaços
-    ]
-
-    # Remove linhas onde o telefone está vazio
-    df_mensagens = df_mensagens[
-        df_mensagens["telefone"].notna() &
-        (df_mensagens["telefone"].astype(str).str.strip() != "")
-    ]
-
-    # Remove linhas onde o nome está vazio (opcional - descomente se quiser)
-    df_mensagens = df_mensagens[
-         df_mensagens["nome"].notna() &
-         (df_mensagens["nome"].astype(str).str.strip() != "")
-    ]
-
-    # Reseta o índice após remover linhas
-    df_mensagens = df_mensagens.reset_index(drop=True)
-
-    # Mostra quantas linhas foram removidas (debug - pode remover depois)
-    linhas_removidas = len(df_mensagens)  # compare com total original se tiver 
     altura_tabela = min(800, max(300, len(df_mensagens) * 60))
 
 
@@ -923,13 +1228,14 @@ if geracao_finalizada and len(mensagens_recebidas) > 0:
     column_config = {k: v for k, v in column_config.items() if k in df_mensagens.columns}
 
     try:
-        df_editado = st.data_editor(
+        st.data_editor(
             df_mensagens,
             column_config=column_config,
             use_container_width=True,
             hide_index=True,
             height=altura_tabela,
             num_rows="fixed",
+            column_order=[c for c in ["Enviar", "nome", "telefone", "mensagem"] if c in df_mensagens.columns],
             key="all_messages_table"
         )
     except Exception as e:
@@ -937,9 +1243,37 @@ if geracao_finalizada and len(mensagens_recebidas) > 0:
         st.stop()      
 
 
-    total_aprovados = int(df_editado["Enviar"].sum()) if "Enviar" in df_editado.columns else 0
-    st.caption(f"{total_aprovados} de {len(df_editado)} mensagens selecionadas.")
-    
+    # O editor devolve só o que mudou; a contagem e o envio partem desse diff
+    diferencas = diferencas_edicao(
+        quadro_revisao,
+        st.session_state.get("all_messages_table", {}).get("edited_rows", {}),
+        selecionado_padrao,
+    )
+    total_aprovados = len(posicoes_aprovadas(quadro_revisao, diferencas, selecionado_padrao))
+    editadas = f" ✏️ {len(diferencas['editadas'])} editada(s)." if diferencas['editadas'] else ""
+    st.caption(f"{total_aprovados} de {len(quadro_revisao)} mensagens selecionadas.{editadas}")
+
+    # Outros números corporativos conectados dividem o envio com o do login
+    texto_remetentes = st.text_input(
+        "📱 Dividir o envio com outros WhatsApps corporativos (opcional)",
+        key="remetentes_extras_input",
+        placeholder="Ex: 11 98888-7777, 21 97777-6666",
+        help="Cada cliente recebe sempre do mesmo número. Só entram os números conectados."
+    )
+    remetentes_extras = []
+    for bruto in texto_remetentes.split(","):
+        numero = normalizar_telefone(bruto) if bruto.strip() else ""
+        if not numero or numero == instancia_atual or numero in remetentes_extras:
+            continue
+        if len(numero) != 13:
+            st.caption(f"⚠️ {bruto.strip()}: número inválido")
+        elif obter_cache_status().obter(numero) != "open":
+            st.caption(f"⚠️ {numero}: desconectado, fica fora do envio")
+        else:
+            remetentes_extras.append(numero)
+    if remetentes_extras:
+        st.caption(f"📤 Envio dividido entre {len(remetentes_extras) + 1} números.")
+
     st.divider()
 
     st.markdown("""
@@ -958,72 +1292,70 @@ div.stButton > button:first-child:hover {
 
 
     if st.button("🚀 Enviar Mensagens Aprovadas", use_container_width=True, disabled=total_aprovados == 0):
-        df_aprovados = df_editado[df_editado["Enviar"] == True]
-
-        with st.spinner(f"Enviando {total_aprovados} de {len(df_aprovados)} ..."):
-            itens_envio = []
-            for _, row in df_aprovados.iterrows():
-                try:
-                    itens_envio.append({
-                        "destinatario": str(row.get("telefone", ""))[:20],
-                        "mensagem": str(row.get("mensagem", ""))[:2000],
-                        "codigo_cliente": str(row.get("codigo_cliente", ""))[:50],
-                        "nome": str(row.get("nome", ""))[:100]
-                    })
-                except Exception:
-                    continue
+        registros = registros_aprovados(quadro_revisao, diferencas, selecionado_padrao)
+
+        with st.spinner(f"Preparando {len(registros)} mensagens ..."):
+            # Linhas já marcadas como enviadas no armazenamento não vão de novo
+            try:
+                status_envio = obter_armazenamento().ler_status_envio(instancia_atual)
+            except Exception:
+                status_envio = {}
+
+            itens_envio, editadas_envio, ja_enviadas = itens_para_envio(registros, status_envio)
 
             if len(itens_envio) == 0:
                 st.error("❌ Nenhuma mensagem válida para enviar.")
                 st.stop()
 
-            payload_envio = {
-                "remetente": st.session_state.tel_corporativo,
-                "itens": itens_envio,
-                "intervalo_segundos": 21
-            }
-
             try:
-                resp_envio = requests.post(
-                    URL_WEBHOOK_N8N_ENVIAR,
-                    json=payload_envio,
-                    headers={
-                        "Content-Type": "application/json",
-                        "X-Chave-Secreta": CHAVE_SECRETA_N8N,
-                    },
-                    timeout=(10,240)
+                # Confere de novo, na hora, que os remetentes extras continuam conectados
+                remetentes_envio = [instancia_atual] + [
+                    numero for numero in remetentes_extras if obter_cache_status().forcar(numero) == "open"
+                ]
+                eta_envio = despachante_envios.eta_distribuida(itens_envio, remetentes_envio)
+                id_grupo_envio = despachante_envios.distribuir(
+                    instancia_atual, itens_envio, remetentes_envio, id_job=st.session_state.id_job
                 )
-
-                if resp_envio.status_code == 200:
-                    notificar_telegram(
-        f"🚀 *Envio Realizado!*\n"
-        f"📱 WhatsApp: `{st.session_state.tel_corporativo}`\n"
-        f"📨 Mensagens enviadas: *{len(itens_envio)}*\n"
-        f"⏱️ Tempo estimado: *~{round((len(itens_envio) * 21) / 60, 1)} min*\n"
-        f"📅 {datetime.now().strftime('%d/%m/%Y às %H:%M')}"
-    )
-                    st.info(f"As mensagens serão enviadas com intervalo aleatório")
-                    st.success(f"🎉 As {len(itens_envio)} mensagens foram enviadas com sucesso!")
-                    st.session_state.mensagens_recebidas = []
-                    st.session_state.processo_iniciado = False
-                    st.session_state.geracao_finalizada = False
-                    st.session_state.selecionar_todos = True
-                    st.session_state.total_mensagens_previstas = 0
-                    sair_da_fila(instancia_atual)
-                    definir_instancia_ocupada(instancia_atual, False)
-                    time.sleep(2)
-                    st.rerun()
-                else:
-                    st.error(f"❌ Falha ao iniciar o envio. Status: {resp_envio.status_code}")
-                    try:
-                        st.code(resp_envio.text[:500])
-                    except Exception:
-                        pass
-
-            except requests.exceptions.RequestException as e:
-                st.error(f"❌ Erro de conexão ao enviar: {str(e)}")
+                despachante_envios.iniciar_grupo(id_grupo_envio)
             except Exception as e:
                 st.error(f"❌ Erro inesperado: {str(e)}")
+                st.stop()
+
+        notificar_telegram(
+            f"🚀 *Envio Iniciado!*\n"
+            f"📱 WhatsApp: `{', '.join(remetentes_envio)}`\n"
+            f"📨 Mensagens: *{len(itens_envio)}*"
+            f"{f' (+{ja_enviadas} já enviadas antes)' if ja_enviadas else ''}\n"
+            f"✏️ Editadas pelo operador: *{len(editadas_envio)}*\n"
+            f"⏱️ Tempo estimado: *~{round(eta_envio / 60, 1)} min*\n"
+            f"📅 {datetime.now().strftime('%d/%m/%Y às %H:%M')}"
+        )
+        # Quais mensagens o operador mudou fica no log do job e no registro
+        obter_metricas().registrar_evento(
+            st.session_state.id_job, instancia_atual, "revisao_edicoes",
+            aprovadas=len(itens_envio), desmarcadas=len(quadro_revisao) - len(registros), editadas=editadas_envio,
+        )
+        obter_registro_jobs().atualizar(
+            st.session_state.id_job,
+            etapa=ETAPA_ENVIANDO,
+            id_grupo_envio=id_grupo_envio,
+            resultado={'aprovadas': len(itens_envio), 'editadas': [item['linha'] for item in editadas_envio]},
+        )
+        st.session_state.id_grupo_envio = id_grupo_envio
+        st.session_state.arquivo_retomado = None
+        st.session_state.mensagens_recebidas = []
+        st.session_state.leitor_mensagens = None
+        st.session_state.processo_iniciado = False
+        st.session_state.geracao_finalizada = False
+        st.session_state.selecionar_todos = True
+        st.session_state.total_mensagens_previstas = 0
+        st.session_state.id_job_arquivo = None   # próximo job ganha um log novo
+        sair_da_fila(instancia_atual)
+        definir_instancia_ocupada(instancia_atual, False)
+        cronometro_rerun.marcar("envio")
+        st.rerun()
+
+cronometro_rerun.marcar("revisao")
 
 # ==============================================
 # RODAPÉ
@@ -1052,4 +1384,5 @@ with st.expander("Precisa de ajuda?", expanded=False):
 """)
 
 st.markdown("---")
-st.caption(f"Cobrança Inteligente | Atualizado em {datetime.now().strftime('%d/%m/%Y %H:%M')}")
\ No newline at end of file
+st.caption(f"Cobrança Inteligente | Atualizado em {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+cronometro_rerun.marcar("rodape")
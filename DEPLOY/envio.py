@@ -0,0 +1,441 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+
+
+# ==============================================
+# ENVIO EM LOTES COM CONFIRMAÇÃO E RETOMADA
+# ==============================================
+# Os itens aprovados vão para o n8n em lotes pequenos; cada lote só conta
+# como entregue quando o webhook responde 200. O estado de cada item fica
+# num SQLite, então um envio interrompido recomeça do primeiro item ainda
+# não confirmado. Cada item leva um "id" estável para o n8n descartar
+# repetições quando a confirmação de um lote se perde no caminho.
+#
+# Com um AgendadorEnvio, o ritmo é do app: cada lote só sai no horário da
+# sua primeira mensagem e cada item leva "atraso_segundos" (a partir do
+# recebimento) para o n8n respeitar.
+#
+# Um envio pode ser distribuído entre várias instâncias remetentes: cada
+# uma vira um "shard" (um envio próprio, com ritmo e andamento próprios) do
+# mesmo grupo. O cliente fica preso ao remetente que já falou com ele.
+TAMANHO_LOTE_ENVIO = 20
+MAX_TENTATIVAS_LOTE = 3
+TIMEOUT_LOTE_ENVIO = (10, 60)    # (conexão, leitura)
+INTERVALO_ENVIO_SEGUNDOS = 21
+
+STATUS_PENDENTE = "Pendente"
+STATUS_ENVIADO = "Enviado"
+STATUS_FALHOU = "Falhou"
+
+ESTADO_CRIADO = "criado"
+ESTADO_ENVIANDO = "enviando"
+ESTADO_INTERROMPIDO = "interrompido"
+ESTADO_CONCLUIDO = "concluido"
+
+
+def item_falhou(item):
+    # Status textual do n8n, status HTTP da Evolution repassado (>= 400) ou o corpo de erro dela
+    status = str(item.get("status", "")).strip().lower()
+    if status in ("erro", "error", "falhou", "failed") or (status.isdigit() and int(status) >= 400):
+        return True
+    return bool(item.get("erro") or item.get("error"))
+
+def status_do_retorno(resposta, ids):
+    # O n8n pode devolver o resultado por item ({"itens": [{"id", "status"}]});
+    # sem isso, o 200 confirma o lote inteiro
+    por_id = {}
+    if isinstance(resposta, dict) and isinstance(resposta.get("itens"), list):
+        for item in resposta["itens"]:
+            if isinstance(item, dict) and item.get("id") in ids:
+                por_id[item["id"]] = STATUS_FALHOU if item_falhou(item) else STATUS_ENVIADO
+    return {i: por_id.get(i, STATUS_ENVIADO) for i in ids}
+
+def chave_cliente(item):
+    return str(item.get("codigo_cliente") or "").strip() or str(item.get("destinatario") or "")
+
+def escolher_remetente(chave, instancias):
+    # Rendezvous hashing: a mesma chave cai sempre na mesma instância e, se
+    # uma instância sai, só os clientes dela mudam de remetente
+    return max(instancias, key=lambda instancia: hashlib.sha1(f"{chave}|{instancia}".encode()).hexdigest())
+
+
+class DespachanteEnvios:
+
+    def __init__(self, caminho, url_webhook, chave_secreta, tamanho_lote=TAMANHO_LOTE_ENVIO,
+                 max_tentativas=MAX_TENTATIVAS_LOTE, timeout=TIMEOUT_LOTE_ENVIO,
+                 intervalo_segundos=INTERVALO_ENVIO_SEGUNDOS, registrar_status=None, metricas=None,
+                 agendador=None, ao_concluir_grupo=None):
+        self.url_webhook = url_webhook
+        self.chave_secreta = chave_secreta
+        self.tamanho_lote = tamanho_lote
+        self.max_tentativas = max_tentativas
+        self.timeout = timeout
+        self.intervalo_segundos = intervalo_segundos
+        # registrar_status(instancia_job, id_job, status_por_linha) espelha o status
+        # no armazenamento do job ("Status Envio WA") se os dados ainda forem dele
+        self.registrar_status = registrar_status
+        # ao_concluir_grupo(id_grupo, progresso): uma vez por grupo, na thread do último shard
+        self.ao_concluir_grupo = ao_concluir_grupo
+        self.metricas = metricas
+        self.agendador = agendador
+        self._sessao = requests.Session()
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        if caminho != ":memory:":
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS envios (
+                id_envio TEXT PRIMARY KEY,
+                instancia TEXT NOT NULL,
+                id_grupo TEXT NOT NULL,
+                instancia_job TEXT NOT NULL,
+                id_job TEXT,
+                grupo_notificado INTEGER NOT NULL DEFAULT 0,
+                estado TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                lotes_confirmados INTEGER NOT NULL DEFAULT 0,
+                ultimo_erro TEXT NOT NULL DEFAULT '',
+                criado_em REAL NOT NULL,
+                atualizado_em REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS itens_envio (
+                id_envio TEXT NOT NULL,
+                posicao INTEGER NOT NULL,
+                linha INTEGER,
+                dados TEXT NOT NULL,
+                status TEXT NOT NULL,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (id_envio, posicao)
+            );
+            CREATE TABLE IF NOT EXISTS remetentes_cliente (
+                cliente TEXT PRIMARY KEY,
+                instancia TEXT NOT NULL,
+                atualizado_em REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_envios_instancia ON envios (instancia, criado_em);
+            CREATE INDEX IF NOT EXISTS idx_envios_grupo ON envios (id_grupo);
+            CREATE INDEX IF NOT EXISTS idx_envios_job ON envios (instancia_job, criado_em);
+        """)
+
+    # ---------- registro ----------
+    def criar_envio(self, instancia, itens, id_grupo=None, instancia_job=None, id_job=None):
+        # instancia = remetente; instancia_job/id_job = dona dos dados onde o status é espelhado
+        id_envio = uuid.uuid4().hex[:12]
+        agora = time.time()
+        with self._lock:
+            self._conexao.execute("BEGIN")
+            self._conexao.execute(
+                "INSERT INTO envios (id_envio, instancia, id_grupo, instancia_job, id_job, estado, total, criado_em, "
+                "atualizado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id_envio, instancia, id_grupo or id_envio, instancia_job or instancia, id_job, ESTADO_CRIADO,
+                 len(itens), agora, agora)
+            )
+            self._conexao.executemany(
+                "INSERT INTO itens_envio VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (id_envio, posicao, item.get("linha"), json.dumps(item, ensure_ascii=False), STATUS_PENDENTE, agora)
+                    for posicao, item in enumerate(itens)
+                ]
+            )
+            self._conexao.execute("COMMIT")
+        return id_envio
+
+    def _atribuir(self, itens, remetentes):
+        # Cliente -> remetente: o que já falou com ele, se estiver na lista; senão o do hash
+        chaves = list({chave_cliente(item) for item in itens})
+        fixados = {}
+        with self._lock:
+            for inicio in range(0, len(chaves), 500):
+                parte = chaves[inicio:inicio + 500]
+                fixados.update(self._conexao.execute(
+                    f"SELECT cliente, instancia FROM remetentes_cliente WHERE cliente IN ({','.join('?' * len(parte))})",
+                    parte
+                ).fetchall())
+        return {
+            chave: fixados[chave] if fixados.get(chave) in remetentes else escolher_remetente(chave, remetentes)
+            for chave in chaves
+        }
+
+    def distribuir(self, instancia_job, itens, remetentes, id_job=None):
+        # Cria um shard por remetente; retorna o id do grupo
+        remetentes = list(dict.fromkeys(remetentes))
+        atribuicao = self._atribuir(itens, remetentes)
+        por_remetente = {remetente: [] for remetente in remetentes}
+        for item in itens:
+            por_remetente[atribuicao[chave_cliente(item)]].append(item)
+
+        agora = time.time()
+        with self._lock:
+            self._conexao.executemany(
+                "INSERT OR REPLACE INTO remetentes_cliente (cliente, instancia, atualizado_em) VALUES (?, ?, ?)",
+                [(chave, remetente, agora) for chave, remetente in atribuicao.items()]
+            )
+
+        id_grupo = uuid.uuid4().hex[:12]
+        for remetente, itens_shard in por_remetente.items():
+            if itens_shard:
+                self.criar_envio(remetente, itens_shard, id_grupo, instancia_job, id_job)
+        return id_grupo
+
+    def grupo_em_aberto(self, instancia_job):
+        # Último grupo dos dados desta instância com algum shard sem confirmação completa
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT id_grupo FROM envios WHERE instancia_job = ? AND estado != ? ORDER BY criado_em DESC LIMIT 1",
+                (instancia_job, ESTADO_CONCLUIDO)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def grupo_enviando(self, instancia_job):
+        # Há envio rodando agora sobre os dados desta instância?
+        id_grupo = self.grupo_em_aberto(instancia_job)
+        return id_grupo is not None and any(self.em_andamento(id_envio) for id_envio in self.envios_do_grupo(id_grupo))
+
+    def envios_do_grupo(self, id_grupo):
+        with self._lock:
+            return [linha[0] for linha in self._conexao.execute(
+                "SELECT id_envio FROM envios WHERE id_grupo = ? ORDER BY instancia", (id_grupo,)
+            ).fetchall()]
+
+    def _envio(self, id_envio):
+        with self._lock:
+            return self._conexao.execute(
+                "SELECT instancia, estado, total, lotes_confirmados, ultimo_erro, criado_em, atualizado_em, "
+                "instancia_job, id_grupo, id_job FROM envios WHERE id_envio = ?", (id_envio,)
+            ).fetchone()
+
+    def _pendentes(self, id_envio):
+        with self._lock:
+            return self._conexao.execute(
+                "SELECT posicao, linha, dados FROM itens_envio WHERE id_envio = ? AND status = ? ORDER BY posicao",
+                (id_envio, STATUS_PENDENTE)
+            ).fetchall()
+
+    def _definir_estado(self, id_envio, estado, ultimo_erro=""):
+        with self._lock:
+            self._conexao.execute(
+                "UPDATE envios SET estado = ?, ultimo_erro = ?, atualizado_em = ? WHERE id_envio = ?",
+                (estado, ultimo_erro, time.time(), id_envio)
+            )
+
+    def _confirmar(self, id_envio, status_por_posicao):
+        agora = time.time()
+        with self._lock:
+            self._conexao.execute("BEGIN")
+            self._conexao.executemany(
+                "UPDATE itens_envio SET status = ?, atualizado_em = ? WHERE id_envio = ? AND posicao = ?",
+                [(status, agora, id_envio, posicao) for posicao, status in status_por_posicao.items()]
+            )
+            self._conexao.execute(
+                "UPDATE envios SET lotes_confirmados = lotes_confirmados + 1, ultimo_erro = '', atualizado_em = ? "
+                "WHERE id_envio = ?", (agora, id_envio)
+            )
+            self._conexao.execute("COMMIT")
+
+    def progresso(self, id_envio):
+        envio = self._envio(id_envio)
+        if envio is None:
+            return None
+        instancia, estado, total, lotes, ultimo_erro, criado_em, atualizado_em = envio[:7]
+        with self._lock:
+            contagem = dict(self._conexao.execute(
+                "SELECT status, COUNT(*) FROM itens_envio WHERE id_envio = ? GROUP BY status", (id_envio,)
+            ).fetchall())
+        return {
+            'id_envio': id_envio,
+            'instancia': instancia,
+            'estado': estado,
+            'em_andamento': self.em_andamento(id_envio),
+            'total': total,
+            'enviados': contagem.get(STATUS_ENVIADO, 0),
+            'falhos': contagem.get(STATUS_FALHOU, 0),
+            'pendentes': contagem.get(STATUS_PENDENTE, 0),
+            'lotes_confirmados': lotes,
+            'ultimo_erro': ultimo_erro,
+            'eta_s': self.eta(instancia, contagem.get(STATUS_PENDENTE, 0)),
+            'criado_em': criado_em,
+            'atualizado_em': atualizado_em,
+        }
+
+    def progresso_grupo(self, id_grupo):
+        shards = [p for p in (self.progresso(id_envio) for id_envio in self.envios_do_grupo(id_grupo)) if p]
+        if not shards:
+            return None
+        if all(p['estado'] == ESTADO_CONCLUIDO for p in shards):
+            estado = ESTADO_CONCLUIDO
+        elif any(p['em_andamento'] for p in shards):
+            estado = ESTADO_ENVIANDO
+        else:
+            estado = ESTADO_INTERROMPIDO
+        return {
+            'id_grupo': id_grupo,
+            'estado': estado,
+            'em_andamento': any(p['em_andamento'] for p in shards),
+            'total': sum(p['total'] for p in shards),
+            'enviados': sum(p['enviados'] for p in shards),
+            'falhos': sum(p['falhos'] for p in shards),
+            'pendentes': sum(p['pendentes'] for p in shards),
+            'lotes_confirmados': sum(p['lotes_confirmados'] for p in shards),
+            'ultimo_erro': next((p['ultimo_erro'] for p in shards if p['ultimo_erro']), ""),
+            'eta_s': max(p['eta_s'] for p in shards),    # os shards andam em paralelo
+            'shards': shards,
+        }
+
+    def eta_distribuida(self, itens, remetentes):
+        # Estimativa antes de criar o grupo: cada remetente recebe a sua parte em paralelo
+        atribuicao = self._atribuir(itens, list(dict.fromkeys(remetentes)))
+        contagem = {}
+        for item in itens:
+            remetente = atribuicao[chave_cliente(item)]
+            contagem[remetente] = contagem.get(remetente, 0) + 1
+        return max((self.eta(remetente, n) for remetente, n in contagem.items()), default=0.0)
+
+    # ---------- execução ----------
+    def eta(self, instancia, quantidade):
+        if self.agendador is None:
+            return quantidade * self.intervalo_segundos
+        return self.agendador.eta(instancia, quantidade)
+
+    def _dormir(self, segundos):
+        if self.agendador is None:
+            time.sleep(segundos)
+        else:
+            self.agendador.relogio.dormir(segundos)
+
+    def em_andamento(self, id_envio):
+        with self._lock:
+            thread = self._threads.get(id_envio)
+        return thread is not None and thread.is_alive()
+
+    def iniciar(self, id_envio):
+        # Começa ou retoma; chamar de novo com o envio rodando não duplica nada
+        with self._lock:
+            thread = self._threads.get(id_envio)
+            if thread is not None and thread.is_alive():
+                return False
+            thread = threading.Thread(target=self._executar, args=(id_envio,), name=f"envio-{id_envio}", daemon=True)
+            self._threads[id_envio] = thread
+        self._definir_estado(id_envio, ESTADO_ENVIANDO)
+        thread.start()
+        return True
+
+    def iniciar_grupo(self, id_grupo):
+        for id_envio in self.envios_do_grupo(id_grupo):
+            if self._envio(id_envio)[1] != ESTADO_CONCLUIDO:
+                self.iniciar(id_envio)
+
+    def _postar_lote(self, id_envio, instancia, lote, numero_lote, total_lotes):
+        intervalo = self.intervalo_segundos
+        atrasos = [None] * len(lote)
+        if self.agendador is not None:
+            # Espera o horário da primeira mensagem; as demais saem com o atraso planejado
+            horarios = self.agendador.planejar(instancia, len(lote))
+            self.agendador.aguardar_ate(horarios[0])
+            atrasos = [round(h - horarios[0], 1) for h in horarios]
+            intervalo = round(self.agendador.intervalo_medio(instancia))
+
+        itens = []
+        for (posicao, _, dados), atraso in zip(lote, atrasos):
+            item = json.loads(dados)
+            item.pop("linha", None)
+            item["id"] = f"{id_envio}:{posicao}"
+            if atraso is not None:
+                item["atraso_segundos"] = atraso
+            itens.append(item)
+        resp = self._sessao.post(
+            self.url_webhook,
+            json={
+                "remetente": instancia,
+                "id_envio": id_envio,
+                "lote": numero_lote,
+                "total_lotes": total_lotes,
+                "itens": itens,
+                "intervalo_segundos": intervalo,
+            },
+            headers={"Content-Type": "application/json", "X-Chave-Secreta": self.chave_secreta},
+            timeout=self.timeout,
+        )
+        if resp.status_code != 200:
+            raise requests.exceptions.HTTPError(f"Status {resp.status_code}", response=resp)
+        try:
+            corpo = resp.json()
+        except ValueError:
+            corpo = None
+        if isinstance(corpo, list) and corpo:
+            corpo = corpo[0]
+        return status_do_retorno(corpo, [item["id"] for item in itens])
+
+    def _enviar_lote(self, id_envio, instancia, lote, numero_lote, total_lotes):
+        if self.metricas is None:
+            return self._postar_lote(id_envio, instancia, lote, numero_lote, total_lotes)
+        with self.metricas.medir("envio_lote", instancia, id_envio, itens=len(lote)):
+            return self._postar_lote(id_envio, instancia, lote, numero_lote, total_lotes)
+
+    def _executar(self, id_envio):
+        envio = self._envio(id_envio)
+        instancia, instancia_job, id_job = envio[0], envio[7], envio[9]
+        pendentes = self._pendentes(id_envio)
+        lotes = [pendentes[i:i + self.tamanho_lote] for i in range(0, len(pendentes), self.tamanho_lote)]
+
+        for numero_lote, lote in enumerate(lotes, start=1):
+            for tentativa in range(1, self.max_tentativas + 1):
+                try:
+                    status_por_id = self._enviar_lote(id_envio, instancia, lote, numero_lote, len(lotes))
+                    break
+                except Exception as e:
+                    if self.agendador is not None:
+                        self.agendador.registrar_resultado(instancia, 0, len(lote))
+                    if tentativa == self.max_tentativas:
+                        # Para aqui: os itens deste lote e dos seguintes continuam pendentes
+                        self._definir_estado(id_envio, ESTADO_INTERROMPIDO, str(e)[:300])
+                        return
+                    self._dormir(2 ** tentativa)
+
+            status_por_posicao = {posicao: status_por_id[f"{id_envio}:{posicao}"] for posicao, _, _ in lote}
+            if self.agendador is not None:
+                falhos = sum(1 for status in status_por_posicao.values() if status == STATUS_FALHOU)
+                self.agendador.registrar_resultado(instancia, len(lote) - falhos, falhos)
+            self._confirmar(id_envio, status_por_posicao)
+            if self.registrar_status is not None:
+                try:
+                    self.registrar_status(instancia_job, id_job, {
+                        linha: status_por_posicao[posicao] for posicao, linha, _ in lote if linha is not None
+                    })
+                except Exception:
+                    pass    # o SQLite continua sendo a referência para retomar
+
+        self._definir_estado(id_envio, ESTADO_CONCLUIDO)
+        self._concluir_grupo(envio[8])
+
+    def _concluir_grupo(self, id_grupo):
+        # Quem fecha o grupo é o último shard a terminar, sem depender de sessão
+        # aberta; a marca no SQLite garante um único aviso mesmo em paralelo
+        if self.ao_concluir_grupo is None:
+            return
+        with self._lock:
+            pendentes = self._conexao.execute(
+                "SELECT COUNT(*) FROM envios WHERE id_grupo = ? AND estado != ?", (id_grupo, ESTADO_CONCLUIDO)
+            ).fetchone()[0]
+            if pendentes:
+                return
+            marcados = self._conexao.execute(
+                "UPDATE envios SET grupo_notificado = 1 WHERE id_grupo = ? AND grupo_notificado = 0", (id_grupo,)
+            ).rowcount
+        if marcados:
+            try:
+                self.ao_concluir_grupo(id_grupo, self.progresso_grupo(id_grupo))
+            except Exception:
+                pass
+
+    def estatisticas(self):
+        with self._lock:
+            por_estado = dict(self._conexao.execute("SELECT estado, COUNT(*) FROM envios GROUP BY estado").fetchall())
+            ativos = sum(1 for thread in self._threads.values() if thread.is_alive())
+        return {'envios_por_estado': por_estado, 'envios_ativos': ativos}
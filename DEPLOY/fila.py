@@ -0,0 +1,182 @@
+import math
+import sqlite3
+import threading
+import time
+
+
+# ==============================================
+# CONTROLE DE ADMISSÃO (FILA COMPARTILHADA)
+# ==============================================
+# Estado único para todas as sessões do processo. Com caminho de arquivo,
+# o SQLite também coordena vários processos/réplicas na mesma máquina.
+DURACAO_PADRAO_JOB = 180    # segundos, até existir histórico
+HISTORICO_DURACOES = 20
+
+
+class ControladorAdmissao:
+
+    def __init__(self, max_simultaneos, timeout_lease, caminho=None):
+        self.max_simultaneos = max_simultaneos
+        self.timeout_lease = timeout_lease
+        self.caminho = caminho or ":memory:"
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, isolation_level=None, timeout=10)
+        if caminho:
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS ativos (
+                instancia TEXT PRIMARY KEY,
+                dono TEXT,
+                admitido_em REAL NOT NULL,
+                heartbeat REAL NOT NULL,
+                geracao_iniciada_em REAL
+            );
+            CREATE TABLE IF NOT EXISTS espera (
+                instancia TEXT PRIMARY KEY,
+                dono TEXT,
+                entrada REAL NOT NULL,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS historico (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                duracao REAL NOT NULL
+            );
+        """)
+
+    def _transacao(self, operacao):
+        # BEGIN IMMEDIATE trava a escrita entre processos; o lock cobre as threads
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = operacao(self._conexao, time.time())
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+            self._conexao.execute("COMMIT")
+            return resultado
+
+    def _expirar(self, conexao, agora):
+        limite = agora - self.timeout_lease
+        conexao.execute("DELETE FROM ativos WHERE heartbeat < ?", (limite,))
+        conexao.execute("DELETE FROM espera WHERE heartbeat < ?", (limite,))
+
+    def _duracao_media(self, conexao):
+        linhas = conexao.execute(
+            "SELECT duracao FROM historico ORDER BY id DESC LIMIT ?", (HISTORICO_DURACOES,)
+        ).fetchall()
+        if not linhas:
+            return DURACAO_PADRAO_JOB
+        return sum(l[0] for l in linhas) / len(linhas)
+
+    def solicitar(self, instancia, dono=None):
+        # Entra (ou permanece) na fila e renova o lease. Admite em ordem FIFO
+        # sempre que houver vaga e a instância for a primeira da espera. O dono
+        # (a sessão) impede que outra sessão do mesmo número pegue a mesma vaga.
+        def operacao(conexao, agora):
+            self._expirar(conexao, agora)
+            ativos = conexao.execute("SELECT COUNT(*) FROM ativos").fetchone()[0]
+
+            ativo = conexao.execute("SELECT dono FROM ativos WHERE instancia = ?", (instancia,)).fetchone()
+            if ativo and not self._mesmo_dono(ativo[0], dono):
+                return self._status(False, 0, ativos, conexao, "Este número já está gerando em outra sessão")
+            if ativo:
+                conexao.execute("UPDATE ativos SET heartbeat = ? WHERE instancia = ?", (agora, instancia))
+                return self._status(True, 0, ativos, conexao, "Processando")
+
+            esperando = conexao.execute("SELECT dono FROM espera WHERE instancia = ?", (instancia,)).fetchone()
+            if esperando and not self._mesmo_dono(esperando[0], dono):
+                return self._status(False, 0, ativos, conexao, "Este número já está na fila em outra sessão")
+
+            conexao.execute(
+                "INSERT INTO espera (instancia, dono, entrada, heartbeat) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(instancia) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (instancia, dono, agora, agora)
+            )
+            fila = [l[0] for l in conexao.execute("SELECT instancia FROM espera ORDER BY entrada, instancia")]
+            posicao = fila.index(instancia) + 1
+            vagas = self.max_simultaneos - ativos
+
+            if posicao <= vagas:
+                conexao.execute("DELETE FROM espera WHERE instancia = ?", (instancia,))
+                conexao.execute(
+                    "INSERT INTO ativos (instancia, dono, admitido_em, heartbeat) VALUES (?, ?, ?, ?)",
+                    (instancia, dono, agora, agora)
+                )
+                return self._status(True, 0, ativos + 1, conexao, "Entrou na fila")
+
+            return self._status(False, posicao, ativos, conexao, f"Fila cheia. Sua posição: {posicao}")
+
+        return self._transacao(operacao)
+
+    @staticmethod
+    def _mesmo_dono(registrado, dono):
+        # Sem dono de um dos lados vale a instância, como antes
+        return registrado is None or dono is None or registrado == dono
+
+    def _status(self, admitido, posicao, ativos, conexao, mensagem):
+        na_fila = conexao.execute("SELECT COUNT(*) FROM espera").fetchone()[0]
+        espera = 0
+        if not admitido:
+            # Cada "rodada" libera max_simultaneos vagas, em média a cada duração de job
+            rodadas = math.ceil(posicao / max(1, self.max_simultaneos))
+            espera = int(rodadas * self._duracao_media(conexao))
+        return {
+            'admitido': admitido,
+            'posicao': posicao,
+            'ativos': ativos,
+            'na_fila': na_fila,
+            'espera_estimada_s': espera,
+            'mensagem': mensagem,
+        }
+
+    def heartbeat(self, instancia):
+        def operacao(conexao, agora):
+            conexao.execute("UPDATE ativos SET heartbeat = ? WHERE instancia = ?", (agora, instancia))
+            conexao.execute("UPDATE espera SET heartbeat = ? WHERE instancia = ?", (agora, instancia))
+        self._transacao(operacao)
+
+    def marcar_geracao(self, instancia, em_andamento=True):
+        def operacao(conexao, agora):
+            linha = conexao.execute(
+                "SELECT geracao_iniciada_em FROM ativos WHERE instancia = ?", (instancia,)
+            ).fetchone()
+            if linha is None:
+                return
+            if em_andamento:
+                conexao.execute(
+                    "UPDATE ativos SET geracao_iniciada_em = ?, heartbeat = ? WHERE instancia = ?",
+                    (agora, agora, instancia)
+                )
+            elif linha[0] is not None:
+                conexao.execute("INSERT INTO historico (duracao) VALUES (?)", (agora - linha[0],))
+                conexao.execute("UPDATE ativos SET geracao_iniciada_em = NULL WHERE instancia = ?", (instancia,))
+        self._transacao(operacao)
+
+    def em_geracao(self, instancia):
+        def operacao(conexao, agora):
+            self._expirar(conexao, agora)
+            linha = conexao.execute(
+                "SELECT geracao_iniciada_em FROM ativos WHERE instancia = ?", (instancia,)
+            ).fetchone()
+            return bool(linha and linha[0] is not None)
+        return self._transacao(operacao)
+
+    def liberar(self, instancia, dono=None):
+        # Com dono, só sai a vaga dessa sessão; a de outra sessão do mesmo número fica
+        def operacao(conexao, agora):
+            for tabela in ("ativos", "espera"):
+                conexao.execute(
+                    f"DELETE FROM {tabela} WHERE instancia = ? AND (? IS NULL OR dono IS NULL OR dono = ?)",
+                    (instancia, dono, dono)
+                )
+        self._transacao(operacao)
+
+    def estado(self):
+        def operacao(conexao, agora):
+            self._expirar(conexao, agora)
+            return {
+                'ativos': [l[0] for l in conexao.execute("SELECT instancia FROM ativos ORDER BY admitido_em")],
+                'espera': [l[0] for l in conexao.execute("SELECT instancia FROM espera ORDER BY entrada, instancia")],
+                'duracao_media_s': round(self._duracao_media(conexao), 1),
+            }
+        return self._transacao(operacao)
@@ -0,0 +1,201 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+# ==============================================
+# REGISTRO DURÁVEL DE JOBS
+# ==============================================
+# Cada planilha enviada vira um job (instância + id_job) com etapa,
+# contagens, horários e resultado num SQLite. A planilha de um job que foi
+# para a geração também fica guardada: uma sessão que volta (recarregar a
+# página, conexão caída) reencontra o job da instância e segue do ponto em
+# que estava, sem reenviar a planilha nem disparar a geração de novo.
+ETAPA_CARREGADO = "carregado"
+ETAPA_GERANDO = "gerando"
+ETAPA_REVISAO = "revisao"
+ETAPA_ENVIANDO = "enviando"
+ETAPA_CONCLUIDO = "concluido"
+ETAPA_ABANDONADO = "abandonado"
+
+ETAPAS_RETOMAVEIS = (ETAPA_GERANDO, ETAPA_REVISAO)
+TTL_JOB_ABERTO = 24 * 3600          # jobs parados há mais tempo não são retomados
+TTL_ARQUIVOS = 7 * 24 * 3600        # planilhas guardadas para retomada
+
+CAMPOS_JOB = (
+    "etapa", "id_arquivo", "nome_arquivo", "total_linhas", "total_validos", "total_previsto",
+    "total_gerado", "tom", "id_job_callback", "id_grupo_envio", "resultado",
+)
+
+
+class RegistroJobs:
+
+    def __init__(self, caminho, ttl_job_aberto=TTL_JOB_ABERTO, ttl_arquivos=TTL_ARQUIVOS):
+        self.ttl_job_aberto = ttl_job_aberto
+        self.ttl_arquivos = ttl_arquivos
+        self.retomadas = 0
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        if caminho != ":memory:":
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id_job TEXT PRIMARY KEY,
+                instancia TEXT NOT NULL,
+                etapa TEXT NOT NULL,
+                id_arquivo TEXT,
+                nome_arquivo TEXT,
+                total_linhas INTEGER,
+                total_validos INTEGER,
+                total_previsto INTEGER,
+                total_gerado INTEGER,
+                tom TEXT,
+                id_job_callback TEXT,
+                id_grupo_envio TEXT,
+                resultado TEXT,
+                criado_em REAL NOT NULL,
+                atualizado_em REAL NOT NULL,
+                geracao_iniciada_em REAL,
+                geracao_concluida_em REAL,
+                envio_iniciado_em REAL,
+                concluido_em REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_instancia ON jobs (instancia, atualizado_em);
+            CREATE INDEX IF NOT EXISTS idx_jobs_grupo ON jobs (id_grupo_envio);
+            CREATE TABLE IF NOT EXISTS arquivos (
+                id_arquivo TEXT PRIMARY KEY,
+                nome TEXT NOT NULL,
+                conteudo BLOB NOT NULL,
+                criado_em REAL NOT NULL
+            );
+        """)
+
+    # ---------- registro ----------
+    def criar(self, id_job, instancia, id_arquivo, nome_arquivo, total_linhas):
+        agora = time.time()
+        with self._lock:
+            self._conexao.execute(
+                "INSERT OR IGNORE INTO jobs (id_job, instancia, etapa, id_arquivo, nome_arquivo, total_linhas, "
+                "criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (id_job, instancia, ETAPA_CARREGADO, id_arquivo, nome_arquivo, total_linhas, agora, agora)
+            )
+
+    def atualizar(self, id_job, **campos):
+        # Etapas marcam o próprio horário; "resultado" é gravado como JSON
+        agora = time.time()
+        campos = {chave: valor for chave, valor in campos.items() if chave in CAMPOS_JOB}
+        if "resultado" in campos:
+            campos["resultado"] = json.dumps(campos["resultado"], ensure_ascii=False)
+        marco = {
+            ETAPA_GERANDO: "geracao_iniciada_em",
+            ETAPA_REVISAO: "geracao_concluida_em",
+            ETAPA_ENVIANDO: "envio_iniciado_em",
+            ETAPA_CONCLUIDO: "concluido_em",
+        }.get(campos.get("etapa"))
+        if marco:
+            campos[marco] = agora
+        campos["atualizado_em"] = agora
+        atribuicoes = ", ".join(f"{coluna} = ?" for coluna in campos)
+        with self._lock:
+            self._conexao.execute(
+                f"UPDATE jobs SET {atribuicoes} WHERE id_job = ?", (*campos.values(), id_job)
+            )
+
+    def iniciar_geracao(self, id_job, instancia, conteudo=None, **campos):
+        # Guarda a planilha para a retomada. Só um job da instância gera por
+        # vez; os abertos anteriores deixam de ser retomáveis
+        agora = time.time()
+        with self._lock:
+            if conteudo is not None:
+                self._conexao.execute(
+                    "INSERT OR IGNORE INTO arquivos (id_arquivo, nome, conteudo, criado_em) "
+                    "SELECT id_arquivo, nome_arquivo, ?, ? FROM jobs WHERE id_job = ? AND id_arquivo IS NOT NULL",
+                    (sqlite3.Binary(conteudo), agora, id_job)
+                )
+                self._podar(agora)
+            self._conexao.execute(
+                f"UPDATE jobs SET etapa = ?, atualizado_em = ? WHERE instancia = ? AND id_job != ? "
+                f"AND etapa IN ({','.join('?' * len(ETAPAS_RETOMAVEIS))})",
+                (ETAPA_ABANDONADO, agora, instancia, id_job, *ETAPAS_RETOMAVEIS)
+            )
+        self.atualizar(id_job, etapa=ETAPA_GERANDO, **campos)
+
+    def concluir_envio(self, id_grupo_envio, resultado):
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT id_job FROM jobs WHERE id_grupo_envio = ? AND etapa != ?", (id_grupo_envio, ETAPA_CONCLUIDO)
+            ).fetchone()
+        if linha:
+            self.atualizar(linha[0], etapa=ETAPA_CONCLUIDO, resultado=resultado)
+        return bool(linha)
+
+    # ---------- consulta ----------
+    def obter(self, id_job):
+        with self._lock:
+            cursor = self._conexao.execute("SELECT * FROM jobs WHERE id_job = ?", (id_job,))
+            linha = cursor.fetchone()
+            colunas = [descricao[0] for descricao in cursor.description]
+        return self._como_dict(colunas, linha) if linha else None
+
+    def job_retomavel(self, instancia):
+        # Job mais recente da instância que parou no meio da geração ou da revisão
+        limite = time.time() - self.ttl_job_aberto
+        with self._lock:
+            cursor = self._conexao.execute(
+                f"SELECT * FROM jobs WHERE instancia = ? AND atualizado_em >= ? "
+                f"AND etapa IN ({','.join('?' * len(ETAPAS_RETOMAVEIS))}) "
+                f"ORDER BY atualizado_em DESC LIMIT 1",
+                (instancia, limite, *ETAPAS_RETOMAVEIS)
+            )
+            linha = cursor.fetchone()
+            colunas = [descricao[0] for descricao in cursor.description]
+        return self._como_dict(colunas, linha) if linha else None
+
+    def job_dos_dados(self, instancia):
+        # Job cujos dados estão hoje no armazenamento da instância: o último que foi para a geração
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT id_job FROM jobs WHERE instancia = ? AND geracao_iniciada_em IS NOT NULL "
+                "ORDER BY geracao_iniciada_em DESC LIMIT 1", (instancia,)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def marcar_retomada(self):
+        with self._lock:
+            self.retomadas += 1
+
+    def arquivo(self, id_arquivo):
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT nome, conteudo FROM arquivos WHERE id_arquivo = ?", (id_arquivo,)
+            ).fetchone()
+        return (linha[0], bytes(linha[1])) if linha else (None, None)
+
+    def _como_dict(self, colunas, linha):
+        job = dict(zip(colunas, linha))
+        if job.get("resultado"):
+            job["resultado"] = json.loads(job["resultado"])
+        return job
+
+    def _podar(self, agora):
+        # Planilhas antigas saem, exceto as de jobs que ainda podem ser retomados
+        self._conexao.execute(
+            f"DELETE FROM arquivos WHERE criado_em < ? AND id_arquivo NOT IN "
+            f"(SELECT id_arquivo FROM jobs WHERE etapa IN ({','.join('?' * len(ETAPAS_RETOMAVEIS))}) "
+            f"AND id_arquivo IS NOT NULL)",
+            (agora - self.ttl_arquivos, *ETAPAS_RETOMAVEIS)
+        )
+
+    def estatisticas(self):
+        with self._lock:
+            por_etapa = dict(self._conexao.execute("SELECT etapa, COUNT(*) FROM jobs GROUP BY etapa").fetchall())
+            arquivos, tamanho = self._conexao.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(conteudo)), 0) FROM arquivos"
+            ).fetchone()
+        return {
+            'jobs': por_etapa,
+            'arquivos_guardados': arquivos,
+            'arquivos_mb': round(tamanho / 1e6, 2),
+            'retomadas': self.retomadas,
+        }
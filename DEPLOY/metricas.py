@@ -0,0 +1,299 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ==============================================
+# MÉTRICAS POR ETAPA (PROMETHEUS + LOG POR JOB)
+# ==============================================
+# Cronômetros e contadores em memória, rotulados por etapa e instância.
+# Exportação em texto no formato do Prometheus (endpoint HTTP e/ou arquivo
+# para o textfile collector) e um log JSON Lines por job.
+PREFIXO_METRICAS = "cobra"
+LIMITES_HISTOGRAMA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+INTERVALO_GRAVACAO_ARQUIVO = 10     # segundos entre regravações do arquivo .prom
+HISTORICO_RERUNS = 500              # reruns recentes guardados para o orçamento
+
+
+def _escapar_rotulo(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _rotulos(pares):
+    return "{" + ",".join(f'{chave}="{_escapar_rotulo(valor)}"' for chave, valor in pares) + "}"
+
+
+class RegistroMetricas:
+
+    def __init__(self, arquivo_prometheus=None, diretorio_logs=None,
+                 intervalo_gravacao=INTERVALO_GRAVACAO_ARQUIVO):
+        self.arquivo_prometheus = arquivo_prometheus
+        self.diretorio_logs = diretorio_logs
+        self.intervalo_gravacao = intervalo_gravacao
+        # (etapa, instancia) -> [contagem, soma, máximo, erros, buckets]
+        self._duracoes = {}
+        # (nome, etapa, instancia) -> valor
+        self._contadores = {}
+        self._lock = threading.Lock()
+        self._lock_logs = threading.Lock()
+        self._ultima_gravacao = 0.0
+        # [(total_s, cpu_s, [(secao, duracao_s, cpu_s)])] dos últimos reruns do app
+        self._reruns = deque(maxlen=HISTORICO_RERUNS)
+        if diretorio_logs:
+            os.makedirs(diretorio_logs, exist_ok=True)
+        if arquivo_prometheus:
+            atexit.register(self.gravar_arquivo)
+
+    # ---------- coleta ----------
+    def observar(self, etapa, instancia, duracao, erro=False, id_job=None, **dados):
+        chave = (etapa, instancia or "")
+        with self._lock:
+            serie = self._duracoes.get(chave)
+            if serie is None:
+                serie = self._duracoes[chave] = [0, 0.0, 0.0, 0, [0] * len(LIMITES_HISTOGRAMA)]
+            serie[0] += 1
+            serie[1] += duracao
+            serie[2] = max(serie[2], duracao)
+            serie[3] += 1 if erro else 0
+            for i, limite in enumerate(LIMITES_HISTOGRAMA):
+                if duracao <= limite:
+                    serie[4][i] += 1
+
+        if id_job:
+            self.registrar_evento(id_job, instancia, etapa, duracao_s=round(duracao, 4), ok=not erro, **dados)
+        self._gravar_se_preciso()
+
+    @contextmanager
+    def medir(self, etapa, instancia="", id_job=None, **dados):
+        # Os dados extras vão apenas para o log do job; quem mede pode completá-los
+        # dentro do bloco (ex.: dados['linhas'] = len(df))
+        inicio = time.perf_counter()
+        erro = False
+        try:
+            yield dados
+        except BaseException:
+            erro = True
+            raise
+        finally:
+            self.observar(etapa, instancia, time.perf_counter() - inicio, erro, id_job, **dados)
+
+    def contar(self, nome, etapa, instancia="", valor=1):
+        chave = (nome, etapa, instancia or "")
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+        self._gravar_se_preciso()
+
+    def registrar_rerun(self, cronometro, instancia=""):
+        if not cronometro.secoes:
+            return
+        total = sum(duracao for _, duracao, _ in cronometro.secoes)
+        cpu = sum(cpu for _, _, cpu in cronometro.secoes)
+        with self._lock:
+            self._reruns.append((total, cpu, list(cronometro.secoes)))
+        self.observar("rerun", instancia, total)
+
+    # ---------- log por job ----------
+    def caminho_log(self, id_job):
+        return os.path.join(self.diretorio_logs, f"job-{id_job}.jsonl") if self.diretorio_logs else None
+
+    def registrar_evento(self, id_job, instancia, etapa, **dados):
+        caminho = self.caminho_log(id_job)
+        if not caminho:
+            return
+        evento = {
+            'ts': datetime.now().isoformat(timespec="milliseconds"),
+            'id_job': id_job,
+            'instancia': instancia,
+            'etapa': etapa,
+            **dados,
+        }
+        linha = json.dumps(evento, ensure_ascii=False, default=str)
+        try:
+            with self._lock_logs, open(caminho, "a", encoding="utf-8") as arquivo:
+                arquivo.write(linha + "\n")
+        except OSError:
+            pass
+
+    def ler_log(self, id_job):
+        caminho = self.caminho_log(id_job)
+        if not caminho or not os.path.exists(caminho):
+            return []
+        with open(caminho, encoding="utf-8") as arquivo:
+            return [json.loads(linha) for linha in arquivo if linha.strip()]
+
+    # ---------- exportação ----------
+    def texto_prometheus(self):
+        with self._lock:
+            duracoes = {chave: (c, s, m, e, list(b)) for chave, (c, s, m, e, b) in self._duracoes.items()}
+            contadores = dict(self._contadores)
+
+        nome_duracao = f"{PREFIXO_METRICAS}_etapa_duracao_segundos"
+        linhas = [
+            f"# HELP {nome_duracao} Duração de cada etapa (chamadas externas e passos pesados).",
+            f"# TYPE {nome_duracao} histogram",
+        ]
+        for (etapa, instancia), (contagem, soma, _, _, buckets) in sorted(duracoes.items()):
+            base = [("etapa", etapa), ("instancia", instancia)]
+            for limite, acumulado in zip(LIMITES_HISTOGRAMA, buckets):
+                linhas.append(f"{nome_duracao}_bucket{_rotulos(base + [('le', limite)])} {acumulado}")
+            linhas.append(f"{nome_duracao}_bucket{_rotulos(base + [('le', '+Inf')])} {contagem}")
+            linhas.append(f"{nome_duracao}_sum{_rotulos(base)} {soma:.6f}")
+            linhas.append(f"{nome_duracao}_count{_rotulos(base)} {contagem}")
+
+        for sufixo, indice, ajuda, tipo in (
+            ("etapa_duracao_max_segundos", 2, "Maior duração observada por etapa.", "gauge"),
+            ("etapa_erros_total", 3, "Execuções de etapa que terminaram em exceção.", "counter"),
+        ):
+            nome = f"{PREFIXO_METRICAS}_{sufixo}"
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            for (etapa, instancia), serie in sorted(duracoes.items()):
+                linhas.append(f"{nome}{_rotulos([('etapa', etapa), ('instancia', instancia)])} {serie[indice]:g}")
+
+        for nome_contador in sorted({nome for nome, _, _ in contadores}):
+            nome = f"{PREFIXO_METRICAS}_{nome_contador}_total"
+            linhas.append(f"# TYPE {nome} counter")
+            for (n, etapa, instancia), valor in sorted(contadores.items()):
+                if n == nome_contador:
+                    linhas.append(f"{nome}{_rotulos([('etapa', etapa), ('instancia', instancia)])} {valor}")
+
+        return "\n".join(linhas) + "\n"
+
+    def gravar_arquivo(self, caminho=None):
+        caminho = caminho or self.arquivo_prometheus
+        if not caminho:
+            return
+        # Escrita atômica: o coletor nunca lê um arquivo pela metade
+        temporario = f"{caminho}.tmp"
+        try:
+            with open(temporario, "w", encoding="utf-8") as arquivo:
+                arquivo.write(self.texto_prometheus())
+            os.replace(temporario, caminho)
+        except OSError:
+            pass
+
+    def _gravar_se_preciso(self):
+        if not self.arquivo_prometheus:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if agora - self._ultima_gravacao < self.intervalo_gravacao:
+                return
+            self._ultima_gravacao = agora
+        self.gravar_arquivo()
+
+    def resumo(self, instancia=None):
+        # Para o painel de diagnóstico: etapas mais caras primeiro
+        with self._lock:
+            itens = [
+                (etapa, inst, c, s, m, e) for (etapa, inst), (c, s, m, e, _) in self._duracoes.items()
+                if instancia is None or inst == instancia
+            ]
+        itens.sort(key=lambda item: item[3], reverse=True)
+        return {
+            f"{etapa} [{inst}]" if inst else etapa: {
+                'chamadas': c, 'total_s': round(s, 3), 'media_ms': round(s / c * 1000, 1),
+                'max_ms': round(m * 1000, 1), 'erros': e,
+            }
+            for etapa, inst, c, s, m, e in itens
+        }
+
+    def resumo_reruns(self, orcamento_ms=None):
+        # Orçamento do rerun: tempo por rerun e as seções que mais pesam, em média
+        with self._lock:
+            reruns = list(self._reruns)
+        if not reruns:
+            return {}
+        totais = sorted(total for total, _, _ in reruns)
+        secoes = {}
+        for _, _, marcas in reruns:
+            for secao, duracao, cpu in marcas:
+                serie = secoes.setdefault(secao, [0, 0.0, 0.0, 0.0])
+                serie[0] += 1
+                serie[1] += duracao
+                serie[2] += cpu
+                serie[3] = max(serie[3], duracao)
+        mais_lentas = sorted(secoes.items(), key=lambda item: item[1][1] / item[1][0], reverse=True)
+        resumo = {
+            'reruns': len(reruns),
+            'media_ms': round(sum(totais) / len(totais) * 1000, 1),
+            'p95_ms': round(totais[min(len(totais) - 1, int(len(totais) * 0.95))] * 1000, 1),
+            'max_ms': round(totais[-1] * 1000, 1),
+            'cpu_media_ms': round(sum(cpu for _, cpu, _ in reruns) / len(reruns) * 1000, 1),
+            'secoes_mais_lentas': {
+                secao: {
+                    'media_ms': round(s / c * 1000, 1), 'cpu_media_ms': round(cpu / c * 1000, 1),
+                    'max_ms': round(m * 1000, 1), 'reruns': c,
+                }
+                for secao, (c, s, cpu, m) in mais_lentas[:8]
+            },
+        }
+        if orcamento_ms:
+            resumo['orcamento_ms'] = orcamento_ms
+            resumo['acima_do_orcamento'] = sum(1 for total in totais if total * 1000 > orcamento_ms)
+        return resumo
+
+
+class CronometroRerun:
+    # Criado no topo do script: cada marcar(secao) fecha o trecho desde a
+    # marca anterior. Como st.stop()/st.rerun() interrompem o script, o rerun
+    # é registrado só no início do rerun seguinte (finalizar). O polling
+    # roda em fragmentos, fora do rerun completo, e não entra na conta.
+
+    def __init__(self):
+        self.secoes = []
+        self._ultima = time.perf_counter()
+        self._ultima_cpu = time.thread_time()
+        self._finalizado = False
+
+    def marcar(self, secao):
+        agora, cpu = time.perf_counter(), time.thread_time()
+        self.secoes.append((secao, agora - self._ultima, cpu - self._ultima_cpu))
+        self._ultima, self._ultima_cpu = agora, cpu
+
+    def finalizar(self, registro, instancia=""):
+        if not self._finalizado:
+            self._finalizado = True
+            registro.registrar_rerun(self, instancia)
+        return self.resumo()
+
+    def resumo(self):
+        return {
+            'total_ms': round(sum(duracao for _, duracao, _ in self.secoes) * 1000, 1),
+            'cpu_ms': round(sum(cpu for _, _, cpu in self.secoes) * 1000, 1),
+            'secoes_ms': {secao: round(duracao * 1000, 1) for secao, duracao, _ in self.secoes},
+        }
+
+
+class ServidorMetricas:
+    # GET /metrics no formato texto do Prometheus, numa thread própria
+
+    def __init__(self, registro, host="0.0.0.0", porta=9108):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                corpo = registro.texto_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer((host, porta), Handler)
+        self._http.daemon_threads = True
+        self.porta = self._http.server_address[1]
+        threading.Thread(target=self._http.serve_forever, name="servidor-metricas", daemon=True).start()
+
+    def encerrar(self):
+        self._http.shutdown()
+        self._http.server_close()
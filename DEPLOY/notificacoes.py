@@ -0,0 +1,171 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+import requests
+import toml
+
+
+# ==============================================
+# NOTIFICAÇÕES TELEGRAM EM SEGUNDO PLANO
+# ==============================================
+TAMANHO_FILA_NOTIFICACOES = 200
+INTERVALO_MINIMO_ENVIO = 3.0      # segundos entre mensagens para o mesmo chat
+JANELA_AGRUPAMENTO = 2.0          # eventos que chegam juntos viram um único resumo
+LIMITE_TEXTO_TELEGRAM = 4000      # a API aceita 4096 caracteres
+TIMEOUT_TELEGRAM = (5, 10)
+_FIM = object()
+
+
+def carregar_config_telegram(caminho=".streamlit/secrets.toml"):
+    # Tenta ler do secrets.toml primeiro; se falhar, variáveis de ambiente (produção)
+    try:
+        config = toml.load(caminho)
+        return config.get("TELEGRAM_BOT_TOKEN", ""), config.get("TELEGRAM_CHAT_ID", "")
+    except Exception:
+        return os.environ.get("TELEGRAM_BOT_TOKEN", ""), os.environ.get("TELEGRAM_CHAT_ID", "")
+
+def montar_resumo(textos):
+    if len(textos) == 1:
+        return [textos[0]]
+
+    cabecalho = f"📦 *{len(textos)} eventos*\n\n"
+    partes = []
+    atual = cabecalho
+    for texto in textos:
+        bloco = texto + "\n\n"
+        if len(atual) + len(bloco) > LIMITE_TEXTO_TELEGRAM and atual != cabecalho:
+            partes.append(atual.rstrip())
+            atual = cabecalho
+        atual += bloco
+    partes.append(atual.rstrip())
+    return partes
+
+
+class DespachanteTelegram:
+    # Fila limitada + uma thread de envio: quem notifica nunca espera a rede.
+    # Se a fila encher, a notificação é descartada e contabilizada.
+
+    def __init__(self, bot_token, chat_id, tamanho_fila=TAMANHO_FILA_NOTIFICACOES,
+                 intervalo_minimo=INTERVALO_MINIMO_ENVIO, janela_agrupamento=JANELA_AGRUPAMENTO,
+                 url_api="https://api.telegram.org", metricas=None):
+        self.bot_token = bot_token
+        self.metricas = metricas
+        self.chat_id = chat_id
+        self.intervalo_minimo = intervalo_minimo
+        self.janela_agrupamento = janela_agrupamento
+        self.url_envio = f"{url_api}/bot{bot_token}/sendMessage"
+        self.enviadas = 0
+        self.mensagens_api = 0
+        self.descartadas = 0
+        self.falhas = 0
+        self.latencia_total = 0.0
+        self.latencia_max = 0.0
+        self._ultimo_envio = 0.0
+        self._fila = queue.Queue(maxsize=tamanho_fila)
+        self._sessao = requests.Session()
+        self._thread = None
+        if self.configurado:
+            self._thread = threading.Thread(target=self._trabalhar, name="despachante-telegram", daemon=True)
+            self._thread.start()
+            atexit.register(self.encerrar)
+
+    @property
+    def configurado(self):
+        return bool(self.bot_token and self.chat_id)
+
+    def notificar(self, mensagem):
+        if self._thread is None:
+            return
+        try:
+            self._fila.put_nowait((time.monotonic(), mensagem))
+        except queue.Full:
+            self.descartadas += 1
+
+    def encerrar(self, timeout=10):
+        # Envia o que ainda estiver na fila antes de o processo terminar
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._fila.put(_FIM, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _coletar_lote(self, primeiro):
+        lote = [primeiro]
+        prazo = time.monotonic() + self.janela_agrupamento
+        while True:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                return lote, False
+            try:
+                item = self._fila.get(timeout=restante)
+            except queue.Empty:
+                return lote, False
+            if item is _FIM:
+                return lote, True
+            lote.append(item)
+
+    def _postar(self, texto):
+        espera = self._ultimo_envio + self.intervalo_minimo - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+
+        for _ in range(2):
+            resp = self._sessao.post(
+                self.url_envio,
+                json={"chat_id": self.chat_id, "text": texto, "parse_mode": "Markdown"},
+                timeout=TIMEOUT_TELEGRAM
+            )
+            self._ultimo_envio = time.monotonic()
+            if resp.status_code != 429:
+                break
+            # Limite do Telegram: espera o tempo pedido e tenta uma vez mais
+            try:
+                retry_after = resp.json().get("parameters", {}).get("retry_after", 1)
+            except ValueError:
+                retry_after = 1
+            time.sleep(min(float(retry_after), 30))
+        resp.raise_for_status()
+        self.mensagens_api += 1
+
+    def _trabalhar(self):
+        encerrar = False
+        while not encerrar:
+            item = self._fila.get()
+            if item is _FIM:
+                break
+            lote, encerrar = self._coletar_lote(item)
+
+            try:
+                for texto in montar_resumo([mensagem for _, mensagem in lote]):
+                    if self.metricas is None:
+                        self._postar(texto)
+                        continue
+                    with self.metricas.medir("telegram_envio"):
+                        self._postar(texto)
+            except Exception:
+                self.falhas += len(lote)
+                continue
+
+            agora = time.monotonic()
+            for enfileirado_em, _ in lote:
+                latencia = agora - enfileirado_em
+                self.latencia_total += latencia
+                self.latencia_max = max(self.latencia_max, latencia)
+            self.enviadas += len(lote)
+
+    def estatisticas(self):
+        return {
+            'configurado': self.configurado,
+            'na_fila': self._fila.qsize(),
+            'enviadas': self.enviadas,
+            'mensagens_api': self.mensagens_api,
+            'descartadas': self.descartadas,
+            'falhas': self.falhas,
+            'latencia_media_s': round(self.latencia_total / self.enviadas, 3) if self.enviadas else 0.0,
+            'latencia_max_s': round(self.latencia_max, 3),
+        }
@@ -0,0 +1,341 @@
+import json
+import threading
+from datetime import datetime
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+
+# ==============================================
+# POOL DE CLIENTES GOOGLE SHEETS
+# ==============================================
+ESCOPO_SHEETS = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+LINHAS_ABA_NOVA = 2000
+COLUNAS_ABA_NOVA = 20
+
+# Campo da mensagem -> títulos de coluna aceitos na aba
+ALIASES_COLUNAS = {
+    'nome': ['nome', 'name', 'cliente_nome'],
+    'telefone': ['telefone', 'tel', 'fone', 'whatsapp', 'numero', 'phone', 'whats'],
+    'mensagem': ['mensagem gerada', 'mensagem', 'message', 'msg', 'texto'],
+    'codigo_cliente': ['cliente', 'codigo', 'codigo_cliente', 'id_cliente', 'código', 'cod_cliente'],
+}
+LIMITES_CAMPOS = {'nome': 100, 'telefone': 20, 'mensagem': 2000, 'codigo_cliente': 50}
+MAX_CELULAS_POR_ESCRITA = 20_000   # limita o tamanho de cada requisição de escrita
+EPOCA_SHEETS = datetime(1899, 12, 30)   # dia zero dos números de série de data do Sheets
+
+
+def aba_removida(erro):
+    # Aba apagada/renomeada por fora: o handle em cache deixou de valer
+    if isinstance(erro, gspread.exceptions.WorksheetNotFound):
+        return True
+    if isinstance(erro, gspread.exceptions.APIError):
+        texto = str(erro)
+        return "Unable to parse range" in texto or "No grid with id" in texto
+    return False
+
+
+def autorizar_conta_servico(credenciais):
+    cliente = gspread.authorize(credenciais)
+    cliente.login()
+    return cliente
+
+
+class PoolSheets:
+    # Um cliente autorizado por processo, com planilhas e abas já abertas.
+    # O token é renovado só quando expira; handles de aba são descartados
+    # quando a aba deixa de existir.
+
+    def __init__(self, credenciais_dict=None, escopo=ESCOPO_SHEETS, autorizar=None):
+        # autorizar() devolve um cliente já autenticado; por padrão, a conta de serviço
+        if autorizar is None:
+            credenciais = ServiceAccountCredentials.from_json_keyfile_dict(dict(credenciais_dict), escopo)
+            autorizar = lambda: autorizar_conta_servico(credenciais)
+        self._autorizar = autorizar
+        self._lock = threading.RLock()
+        self._cliente = None
+        self._planilhas = {}
+        self._abas = {}
+        self._colunas = {}
+        self.autorizacoes = 0
+        self.autorizacoes_evitadas = 0
+        self.renovacoes_token = 0
+        self.abas_invalidadas = 0
+        self.cabecalhos_em_cache = 0
+
+    def cliente(self):
+        with self._lock:
+            if self._cliente is None:
+                self._cliente = self._autorizar()
+                self.autorizacoes += 1
+            elif self._cliente.auth.expired or not self._cliente.auth.valid:
+                self._cliente.login()
+                self.renovacoes_token += 1
+            else:
+                self.autorizacoes_evitadas += 1
+            return self._cliente
+
+    def planilha(self, sheet_id):
+        cliente = self.cliente()
+        with self._lock:
+            if sheet_id not in self._planilhas:
+                self._planilhas[sheet_id] = cliente.open_by_key(sheet_id)
+            return self._planilhas[sheet_id]
+
+    def aba(self, sheet_id, nome_aba, criar=False, linhas=LINHAS_ABA_NOVA, colunas=COLUNAS_ABA_NOVA):
+        chave = (sheet_id, nome_aba)
+        with self._lock:
+            if chave in self._abas:
+                self.cliente()  # garante token válido para o handle em cache
+                return self._abas[chave]
+
+            planilha = self.planilha(sheet_id)
+            try:
+                worksheet = planilha.worksheet(nome_aba)
+            except gspread.exceptions.WorksheetNotFound:
+                if not criar:
+                    raise
+                worksheet = planilha.add_worksheet(title=nome_aba, rows=str(linhas), cols=str(colunas))
+
+            self._abas[chave] = worksheet
+            return worksheet
+
+    def invalidar_aba(self, sheet_id, nome_aba):
+        with self._lock:
+            self._colunas.pop((sheet_id, nome_aba), None)
+            if self._abas.pop((sheet_id, nome_aba), None) is not None:
+                self.abas_invalidadas += 1
+
+    def colunas_aba(self, worksheet, sheet_id, nome_aba):
+        # Resolução dos aliases do cabeçalho, feita uma vez por aba
+        chave = (sheet_id, nome_aba)
+        with self._lock:
+            if chave in self._colunas:
+                self.cabecalhos_em_cache += 1
+                return self._colunas[chave]
+
+        colunas = resolver_colunas(worksheet.row_values(1))
+        # Sem coluna de mensagem o n8n ainda pode criá-la: não guarda
+        if 'mensagem' in colunas:
+            with self._lock:
+                self._colunas[chave] = colunas
+        return colunas
+
+    def esquecer_colunas(self, sheet_id, nome_aba):
+        # Chamado quando a aba é reescrita e o cabeçalho pode ter mudado
+        with self._lock:
+            self._colunas.pop((sheet_id, nome_aba), None)
+
+    def com_aba(self, sheet_id, nome_aba, operacao, criar=False):
+        # Executa operacao(worksheet); se a aba sumiu, reabre uma única vez
+        worksheet = self.aba(sheet_id, nome_aba, criar=criar)
+        try:
+            return operacao(worksheet)
+        except Exception as e:
+            if not aba_removida(e):
+                raise
+            self.invalidar_aba(sheet_id, nome_aba)
+            return operacao(self.aba(sheet_id, nome_aba, criar=criar))
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'autorizacoes': self.autorizacoes,
+                'autorizacoes_evitadas': self.autorizacoes_evitadas,
+                'renovacoes_token': self.renovacoes_token,
+                'abas_em_cache': len(self._abas),
+                'abas_invalidadas': self.abas_invalidadas,
+                'cabecalhos_em_cache': self.cabecalhos_em_cache,
+            }
+
+
+# ==============================================
+# ESCRITA DIFERENCIAL EM BLOCOS
+# ==============================================
+def _linha_ajustada(linha, colunas):
+    linha = [str(v) for v in linha[:colunas]]
+    return linha + [""] * (colunas - len(linha))
+
+def _serial_data(texto):
+    # "dd/mm/aaaa" (como preparar_linhas escreve) no número de série que o Sheets guarda
+    try:
+        return float((datetime.strptime(texto, "%d/%m/%Y") - EPOCA_SHEETS).days)
+    except ValueError:
+        return None
+
+def _mesmo_valor(novo, antigo):
+    # A aba é lida com FORMULA, sem formatação: 250.75 volta como número, não
+    # "250,75"; "0123" escrito com USER_ENTERED vira 123 e "12/12/2025" volta
+    # como o número de série 46003. Tudo isso conta como igual
+    if novo == antigo:
+        return True
+    try:
+        antigo = float(antigo)
+    except ValueError:
+        return False
+    try:
+        return float(novo) == antigo
+    except ValueError:
+        return _serial_data(novo) == antigo
+
+def _blocos_alterados(atual, dados, colunas):
+    # Faixas contíguas de linhas diferentes, já com o recorte de colunas alteradas
+    blocos = []
+    inicio = None
+    col_ini, col_fim = colunas, 0
+    for i, linha in enumerate(dados + [None]):
+        antiga = _linha_ajustada(atual[i], colunas) if i < len(atual) else [""] * colunas
+        diferentes = [] if linha is None else [c for c in range(colunas) if not _mesmo_valor(linha[c], antiga[c])]
+        if diferentes:
+            if inicio is None:
+                inicio, col_ini, col_fim = i, colunas, 0
+            col_ini = min(col_ini, diferentes[0])
+            col_fim = max(col_fim, diferentes[-1] + 1)
+        elif inicio is not None:
+            blocos.append((inicio, i, col_ini, col_fim))
+            inicio = None
+    return blocos
+
+def _intervalos_escrita(dados, blocos, max_celulas):
+    # Quebra blocos grandes para que nenhum intervalo passe de max_celulas
+    intervalos = []
+    for lin_ini, lin_fim, col_ini, col_fim in blocos:
+        largura = col_fim - col_ini
+        passo = max(1, max_celulas // largura)
+        for a in range(lin_ini, lin_fim, passo):
+            b = min(a + passo, lin_fim)
+            intervalos.append({
+                'range': f"{gspread.utils.rowcol_to_a1(a + 1, col_ini + 1)}:{gspread.utils.rowcol_to_a1(b, col_fim)}",
+                'values': [linha[col_ini:col_fim] for linha in dados[a:b]],
+            })
+    return intervalos
+
+def escrever_aba(worksheet, dados, max_celulas=MAX_CELULAS_POR_ESCRITA, value_input_option="USER_ENTERED"):
+    # Ajusta a aba ao tamanho dos dados e envia só o que mudou em relação ao
+    # conteúdo atual, agrupado em batch_update de até max_celulas células
+    colunas = max(len(linha) for linha in dados)
+    dados = [_linha_ajustada(linha, colunas) for linha in dados]
+    atual = worksheet.get_all_values(value_render_option=gspread.utils.ValueRenderOption.formula)
+
+    # Encolher a aba descarta sobras da execução anterior (substitui o clear)
+    worksheet.resize(rows=len(dados), cols=colunas)
+
+    intervalos = _intervalos_escrita(dados, _blocos_alterados(atual, dados, colunas), max_celulas)
+
+    relatorio = {
+        'modo': 'diferencial' if atual else 'completo',
+        'linhas': len(dados),
+        'colunas': colunas,
+        'intervalos': len(intervalos),
+        'celulas': 0,
+        'bytes': 0,
+        'requisicoes': 0,
+    }
+
+    lote, celulas_lote = [], 0
+    for intervalo in intervalos + [None]:
+        celulas = 0 if intervalo is None else len(intervalo['values']) * len(intervalo['values'][0])
+        if lote and (intervalo is None or celulas_lote + celulas > max_celulas):
+            worksheet.batch_update(lote, value_input_option=value_input_option)
+            relatorio['requisicoes'] += 1
+            relatorio['celulas'] += celulas_lote
+            relatorio['bytes'] += len(json.dumps([i['values'] for i in lote], ensure_ascii=False).encode("utf-8"))
+            lote, celulas_lote = [], 0
+        if intervalo is not None:
+            lote.append(intervalo)
+            celulas_lote += celulas
+
+    return relatorio
+
+
+# ==============================================
+# LEITURA DAS MENSAGENS GERADAS
+# ==============================================
+def resolver_colunas(cabecalho):
+    # Campo -> índice (0-based) da coluna; se houver repetição, vale a última
+    colunas = {}
+    for indice, titulo in enumerate(cabecalho):
+        titulo_lower = str(titulo).strip().lower()
+        for campo, aliases in ALIASES_COLUNAS.items():
+            if titulo_lower in aliases:
+                colunas[campo] = indice
+                break
+    return colunas
+
+def montar_mensagem(valores, colunas):
+    def valor(campo):
+        indice = colunas.get(campo)
+        if indice is None or indice >= len(valores):
+            return ''
+        return str(valores[indice])
+
+    texto = valor('mensagem')
+    if not texto.strip() or texto.lower() in ('nan', 'none'):
+        return None
+    return {campo: valor(campo)[:limite] for campo, limite in LIMITES_CAMPOS.items()}
+
+def letra_coluna(numero):
+    return gspread.utils.rowcol_to_a1(1, numero).rstrip("0123456789")
+
+
+class LeitorMensagensIncremental:
+    # Lê só as linhas a partir da primeira ainda sem mensagem e só as colunas
+    # usadas (nome, telefone, mensagem, código). Linhas já entregues depois
+    # dessa fronteira ficam em linhas_vistas para não duplicar quando o n8n
+    # preenche fora de ordem.
+
+    def __init__(self, sheet_id, nome_aba):
+        self.sheet_id = sheet_id
+        self.nome_aba = nome_aba
+        self.colunas = None
+        self.proxima_linha = 2  # linha 1 é o cabeçalho
+        self.linhas_vistas = set()
+        self.total_lido = 0
+
+    def _ler_intervalo(self, worksheet, pool):
+        if self.colunas is None:
+            colunas = pool.colunas_aba(worksheet, self.sheet_id, self.nome_aba)
+            if 'mensagem' not in colunas:
+                return []
+            self.colunas = colunas
+
+        # Uma única requisição com um intervalo por coluna projetada
+        campos = list(self.colunas)
+        intervalos = []
+        for campo in campos:
+            letra = letra_coluna(self.colunas[campo] + 1)
+            intervalos.append(f"{letra}{self.proxima_linha}:{letra}")
+        por_coluna = worksheet.batch_get(intervalos)
+
+        total_linhas = max((len(valores) for valores in por_coluna), default=0)
+        linhas = []
+        for i in range(total_linhas):
+            linhas.append([
+                valores[i][0] if i < len(valores) and valores[i] else ''
+                for valores in por_coluna
+            ])
+        return linhas
+
+    def ler_novas(self, pool):
+        linhas = pool.com_aba(self.sheet_id, self.nome_aba, lambda ws: self._ler_intervalo(ws, pool))
+        if not linhas:
+            return []
+        projecao = {campo: i for i, campo in enumerate(self.colunas)}
+
+        novas = []
+        for deslocamento, valores in enumerate(linhas):
+            linha = self.proxima_linha + deslocamento
+            if linha in self.linhas_vistas:
+                continue
+            mensagem = montar_mensagem(valores, projecao)
+            if mensagem:
+                mensagem['linha'] = linha
+                novas.append(mensagem)
+                self.linhas_vistas.add(linha)
+
+        while self.proxima_linha in self.linhas_vistas:
+            self.linhas_vistas.discard(self.proxima_linha)
+            self.proxima_linha += 1
+
+        self.total_lido += len(novas)
+        return novas
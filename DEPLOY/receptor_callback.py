@@ -0,0 +1,218 @@
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from planilhas import montar_mensagem, resolver_colunas
+
+
+# ==============================================
+# RECEPTOR DE CALLBACK DO N8N
+# ==============================================
+# O n8n faz POST em /callback/<id_job> com uma mensagem, uma lista de
+# mensagens ou {"mensagens": [...]}. Cada job tem sua fila em memória,
+# consumida pela sessão que disparou a geração. Reenvios do n8n (retry após
+# timeout) são descartados na chegada para não contar nem enviar em dobro.
+PREFIXO_CALLBACK = "/callback/"
+TAMANHO_MAX_CORPO = 5 * 1024 * 1024
+CAMPOS_LINHA = ('linha', 'row_number', 'row')   # "row_number" é o que o nó do Google Sheets devolve
+
+
+def linha_informada(item):
+    # Linha da aba enviada pelo n8n, se for um número de linha de dados válido
+    for campo in CAMPOS_LINHA:
+        try:
+            linha = int(item[campo])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if linha >= 2:
+            return linha
+    return None
+
+
+def extrair_mensagens(corpo):
+    if isinstance(corpo, dict) and isinstance(corpo.get('mensagens'), list):
+        itens = corpo['mensagens']
+    elif isinstance(corpo, list):
+        itens = corpo
+    else:
+        itens = [corpo]
+
+    mensagens = []
+    for item in itens:
+        if not isinstance(item, dict):
+            continue
+        # Aceita os mesmos nomes de campo usados nas colunas da aba
+        colunas = resolver_colunas(item.keys())
+        mensagem = montar_mensagem(list(item.values()), colunas)
+        if mensagem:
+            linha = linha_informada(item)
+            if linha is not None:
+                mensagem['linha'] = linha
+            mensagens.append(mensagem)
+    return mensagens
+
+
+def chave_texto(mensagem):
+    return (mensagem.get('codigo_cliente', ''), mensagem.get('telefone', ''), mensagem.get('mensagem', ''))
+
+
+def chave_mensagem(mensagem):
+    # A linha da aba quando o n8n a informa; senão cliente, telefone e texto
+    if mensagem.get('linha') is not None:
+        return ('linha', mensagem['linha'])
+    return chave_texto(mensagem)
+
+
+class ReceptorCallback:
+
+    def __init__(self, host, porta, chave_secreta, url_publica=None):
+        self.chave_secreta = chave_secreta
+        self._filas = {}
+        self._vistas = {}       # id_job -> chaves das mensagens já aceitas
+        self._lock = threading.Lock()
+        self.recebidas = 0
+        self.rejeitadas = 0
+        self.duplicadas = 0
+
+        receptor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                receptor._tratar_post(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer((host, porta), Handler)
+        self._servidor.daemon_threads = True
+        self.porta = self._servidor.server_address[1]
+        self.url_base = (url_publica or f"http://{host}:{self.porta}").rstrip("/")
+        self._thread = threading.Thread(target=self._servidor.serve_forever, name="receptor-callback", daemon=True)
+        self._thread.start()
+
+    def url_para(self, id_job):
+        return f"{self.url_base}{PREFIXO_CALLBACK}{id_job}"
+
+    def registrar(self, id_job):
+        with self._lock:
+            self._filas.setdefault(id_job, queue.Queue())
+            self._vistas.setdefault(id_job, set())
+
+    def registrado(self, id_job):
+        with self._lock:
+            return id_job in self._filas
+
+    def remover(self, id_job):
+        with self._lock:
+            self._filas.pop(id_job, None)
+            self._vistas.pop(id_job, None)
+
+    def aguardar(self, id_job, timeout):
+        # Bloqueia até chegar algo (ou estourar o timeout) e esvazia a fila
+        with self._lock:
+            fila = self._filas.get(id_job)
+        if fila is None:
+            return []
+
+        try:
+            mensagens = list(fila.get(timeout=timeout))
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                mensagens.extend(fila.get_nowait())
+            except queue.Empty:
+                return mensagens
+
+    def retomar(self, id_job, ja_lidas):
+        # Sessão que retomou o job releu a aba: o que já está lá é marcado como
+        # visto e sai da fila, para não ser contado de novo. Devolve quantas saíram
+        chaves = {chave_mensagem(m) for m in ja_lidas} | {chave_texto(m) for m in ja_lidas}
+        with self._lock:
+            fila = self._filas.get(id_job)
+            if fila is None:
+                return 0
+            self._vistas[id_job].update(chaves)
+            pendentes = []
+            while True:
+                try:
+                    pendentes.extend(fila.get_nowait())
+                except queue.Empty:
+                    break
+            restantes = [m for m in pendentes if chave_mensagem(m) not in chaves and chave_texto(m) not in chaves]
+            if restantes:
+                fila.put(restantes)
+            self.duplicadas += len(pendentes) - len(restantes)
+        return len(pendentes) - len(restantes)
+
+    def encerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def _responder(self, handler, status, corpo):
+        dados = json.dumps(corpo).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(dados)))
+        handler.end_headers()
+        handler.wfile.write(dados)
+
+    def _tratar_post(self, handler):
+        if handler.headers.get("X-Chave-Secreta") != self.chave_secreta:
+            self.rejeitadas += 1
+            return self._responder(handler, 403, {"erro": "chave inválida"})
+
+        if not handler.path.startswith(PREFIXO_CALLBACK):
+            return self._responder(handler, 404, {"erro": "rota desconhecida"})
+        id_job = handler.path[len(PREFIXO_CALLBACK):].strip("/")
+
+        with self._lock:
+            fila = self._filas.get(id_job)
+        if fila is None:
+            self.rejeitadas += 1
+            return self._responder(handler, 404, {"erro": "job desconhecido"})
+
+        tamanho = int(handler.headers.get("Content-Length") or 0)
+        if tamanho > TAMANHO_MAX_CORPO:
+            return self._responder(handler, 413, {"erro": "corpo muito grande"})
+        try:
+            corpo = json.loads(handler.rfile.read(tamanho) or b"null")
+        except ValueError:
+            return self._responder(handler, 400, {"erro": "JSON inválido"})
+
+        extraidas = extrair_mensagens(corpo)
+        with self._lock:
+            vistas = self._vistas.get(id_job, set())
+            mensagens = []
+            for mensagem in extraidas:
+                chave = chave_mensagem(mensagem)
+                if chave not in vistas:
+                    vistas.add(chave)
+                    mensagens.append(mensagem)
+            self.duplicadas += len(extraidas) - len(mensagens)
+            self.recebidas += len(mensagens)
+            # Dentro do lock, para retomar não perder um lote entre a triagem e a fila
+            if mensagens:
+                fila.put(mensagens)
+        return self._responder(
+            handler, 200, {"recebidas": len(mensagens), "duplicadas": len(extraidas) - len(mensagens)}
+        )
+
+
+def simular_n8n(url_callback, mensagens, chave_secreta, tamanho_lote=10, timeout=10):
+    # Faz o papel do n8n em testes: empurra as mensagens em lotes para o
+    # callback e devolve (status, corpo) de cada resposta
+    respostas = []
+    with requests.Session() as sessao:
+        for i in range(0, len(mensagens), tamanho_lote):
+            resp = sessao.post(
+                url_callback,
+                json={"mensagens": mensagens[i:i + tamanho_lote]},
+                headers={"X-Chave-Secreta": chave_secreta},
+                timeout=timeout
+            )
+            respostas.append((resp.status_code, resp.json()))
+    return respostas
@@ -0,0 +1,95 @@
+import pandas as pd
+
+from envio import STATUS_ENVIADO
+
+
+# ==============================================
+# QUADRO DE REVISÃO E EDIÇÕES DO OPERADOR
+# ==============================================
+# O quadro da revisão é montado uma vez por job (ordenado, sem colunas
+# internas e sem linhas vazias). O que o operador muda no st.data_editor
+# chega como diff ("edited_rows": {posição: {coluna: valor}}); só essas
+# linhas são olhadas de novo, e o envio sabe exatamente o que foi editado.
+COLUNAS_REMOVIDAS = ("status_validacao",)
+COLUNAS_OBRIGATORIAS = ("mensagem", "telefone", "nome")
+
+
+def preparar_quadro_revisao(mensagens):
+    df = pd.DataFrame(mensagens)
+    if df.empty:
+        return df
+    df = df.drop(columns=[c for c in COLUNAS_REMOVIDAS if c in df.columns])
+
+    # Uma passada só: mensagem, telefone e nome não podem ser nulos nem só espaços
+    preenchidas = pd.Series(True, index=df.index)
+    for coluna in COLUNAS_OBRIGATORIAS:
+        if coluna in df.columns:
+            preenchidas &= df[coluna].notna() & df[coluna].astype(str).str.strip().ne("")
+    df = df[preenchidas]
+
+    if 'nome' in df.columns:
+        df = df.sort_values('nome', kind="stable")
+    return df.reset_index(drop=True)
+
+def diferencas_edicao(quadro, edicoes, selecionado_padrao):
+    # Compara só as linhas tocadas no editor com o quadro original
+    editadas, marcadas, desmarcadas = {}, [], []
+    for posicao, mudancas in (edicoes or {}).items():
+        posicao = int(posicao)
+        if posicao >= len(quadro):
+            continue
+        if 'mensagem' in mudancas:
+            nova = "" if mudancas['mensagem'] is None else str(mudancas['mensagem'])
+            if nova != str(quadro.at[posicao, 'mensagem']):
+                editadas[posicao] = nova
+        if 'Enviar' in mudancas and bool(mudancas['Enviar']) != selecionado_padrao:
+            (marcadas if mudancas['Enviar'] else desmarcadas).append(posicao)
+    return {'editadas': editadas, 'marcadas': marcadas, 'desmarcadas': desmarcadas}
+
+def posicoes_aprovadas(quadro, diferencas, selecionado_padrao):
+    if selecionado_padrao:
+        fora = set(diferencas['desmarcadas'])
+        return [posicao for posicao in range(len(quadro)) if posicao not in fora]
+    return sorted(diferencas['marcadas'])
+
+def registros_aprovados(quadro, diferencas, selecionado_padrao):
+    # Linhas aprovadas com o texto final; "editada" marca o que o operador mudou
+    posicoes = posicoes_aprovadas(quadro, diferencas, selecionado_padrao)
+    registros = quadro.iloc[posicoes].to_dict("records")
+    for posicao, registro in zip(posicoes, registros):
+        registro['editada'] = posicao in diferencas['editadas']
+        if registro['editada']:
+            registro['mensagem_original'] = registro['mensagem']
+            registro['mensagem'] = diferencas['editadas'][posicao]
+    return registros
+
+def itens_para_envio(registros, status_envio):
+    # Itens do despachante e o registro das edições (evento "revisao_edicoes");
+    # linhas que o armazenamento já marca como enviadas ficam de fora
+    itens, editadas, ja_enviadas = [], [], 0
+    for registro in registros:
+        try:
+            linha = int(registro["linha"]) if pd.notna(registro.get("linha")) else None
+            if linha is not None and status_envio.get(linha) == STATUS_ENVIADO:
+                ja_enviadas += 1
+                continue
+            if not str(registro.get("mensagem", "")).strip():
+                continue
+            itens.append({
+                "destinatario": str(registro.get("telefone", ""))[:20],
+                "mensagem": str(registro.get("mensagem", ""))[:2000],
+                "codigo_cliente": str(registro.get("codigo_cliente", ""))[:50],
+                "nome": str(registro.get("nome", ""))[:100],
+                "linha": linha,
+            })
+            if registro['editada']:
+                editadas.append({
+                    "linha": linha,
+                    "codigo_cliente": str(registro.get("codigo_cliente", "")),
+                    "nome": str(registro.get("nome", "")),
+                    "mensagem_original": registro['mensagem_original'],
+                    "mensagem": registro['mensagem'],
+                })
+        except Exception:
+            continue
+    return itens, editadas, ja_enviadas
@@ -0,0 +1,291 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gspread
+import requests
+from gspread.utils import a1_range_to_grid_range
+
+from planilhas import PoolSheets
+
+
+# ==============================================
+# SERVIÇOS FALSOS PARA BENCHMARK E TESTES
+# ==============================================
+# Substitutos locais da Evolution API, dos webhooks do n8n e do Google
+# Sheets, com latência e taxa de erro configuráveis e contagem de chamadas.
+
+
+def numero_tem_whatsapp(numero):
+    # Regra determinística: ~90% dos números "existem"
+    return not str(numero).endswith("0")
+
+
+# ==============================================
+# GOOGLE SHEETS FALSO
+# ==============================================
+class AbaFalsa:
+
+    def __init__(self, titulo, linhas, colunas, latencia=0.0, contador=None):
+        self.title = titulo
+        self.row_count = int(linhas)
+        self.col_count = int(colunas)
+        self.latencia = latencia
+        self.chamadas = contador if contador is not None else Counter()
+        self._valores = []
+        self._lock = threading.Lock()
+
+    def _api(self, metodo):
+        self.chamadas[f"sheets.{metodo}"] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def _celula(self, linha, coluna):
+        if linha < len(self._valores) and coluna < len(self._valores[linha]):
+            return self._valores[linha][coluna]
+        return ""
+
+    def _recorte(self, intervalo):
+        grade = a1_range_to_grid_range(intervalo)
+        lin_ini = grade.get('startRowIndex', 0)
+        lin_fim = grade.get('endRowIndex', len(self._valores))
+        col_ini = grade.get('startColumnIndex', 0)
+        col_fim = grade.get('endColumnIndex', max((len(l) for l in self._valores), default=0))
+        linhas = []
+        for lin in range(lin_ini, min(lin_fim, len(self._valores))):
+            valores = [self._celula(lin, col) for col in range(col_ini, col_fim)]
+            while valores and valores[-1] == "":
+                valores.pop()
+            linhas.append(valores)
+        while linhas and not linhas[-1]:
+            linhas.pop()
+        return linhas
+
+    def get_all_values(self, **kwargs):
+        self._api("get_all_values")
+        with self._lock:
+            return [list(l) for l in self._valores]
+
+    def row_values(self, linha):
+        self._api("row_values")
+        with self._lock:
+            return list(self._valores[linha - 1]) if linha <= len(self._valores) else []
+
+    def get(self, intervalo):
+        self._api("get")
+        with self._lock:
+            return self._recorte(intervalo)
+
+    def batch_get(self, intervalos):
+        self._api("batch_get")
+        with self._lock:
+            return [self._recorte(i) for i in intervalos]
+
+    def resize(self, rows=None, cols=None):
+        self._api("resize")
+        with self._lock:
+            self.row_count = rows or self.row_count
+            self.col_count = cols or self.col_count
+            self._valores = [l[:self.col_count] for l in self._valores[:self.row_count]]
+
+    def batch_update(self, dados, **kwargs):
+        self._api("batch_update")
+        with self._lock:
+            for item in dados:
+                grade = a1_range_to_grid_range(item['range'])
+                for i, linha in enumerate(item['values']):
+                    for j, valor in enumerate(linha):
+                        self._escrever(grade.get('startRowIndex', 0) + i, grade.get('startColumnIndex', 0) + j, valor)
+
+    def _escrever(self, linha, coluna, valor):
+        while len(self._valores) <= linha:
+            self._valores.append([])
+        celulas = self._valores[linha]
+        while len(celulas) <= coluna:
+            celulas.append("")
+        celulas[coluna] = str(valor)
+
+    def preencher_coluna(self, titulo_coluna, valores_por_linha):
+        # Usado pelo n8n falso: escreve direto, sem contar como chamada do app
+        with self._lock:
+            cabecalho = self._valores[0] if self._valores else []
+            coluna = cabecalho.index(titulo_coluna)
+            for linha, valor in valores_por_linha:
+                self._escrever(linha - 1, coluna, valor)
+
+    def linhas_dados(self):
+        with self._lock:
+            return [list(l) for l in self._valores]
+
+
+class PlanilhaFalsa:
+
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.chamadas = Counter()
+        self.abas = {}
+
+    def worksheet(self, titulo):
+        self.chamadas["sheets.worksheet"] += 1
+        if titulo not in self.abas:
+            raise gspread.exceptions.WorksheetNotFound(titulo)
+        return self.abas[titulo]
+
+    def add_worksheet(self, title, rows, cols):
+        self.chamadas["sheets.add_worksheet"] += 1
+        self.abas[title] = AbaFalsa(title, rows, cols, self.latencia, self.chamadas)
+        return self.abas[title]
+
+
+class ClienteSheetsFalso:
+    # Cliente "autorizado" que abre sempre a PlanilhaFalsa; o token nunca expira
+
+    class _Auth:
+        expired = False
+        valid = True
+
+    def __init__(self, planilha):
+        self.planilha = planilha
+        self.auth = self._Auth()
+
+    def login(self):
+        pass
+
+    def open_by_key(self, sheet_id):
+        return self.planilha
+
+
+class PoolSheetsFalso(PoolSheets):
+    # Mesmo pool do app, mas autorizando um cliente falso em vez do Google
+
+    def __init__(self, planilha):
+        super().__init__(autorizar=lambda: ClienteSheetsFalso(planilha))
+
+
+# ==============================================
+# EVOLUTION API + N8N FALSOS (HTTP)
+# ==============================================
+class ServidorFalso:
+
+    def __init__(self, latencia=0.0, taxa_erro=0.0, planilha=None, coluna_mensagem="Mensagem Gerada",
+                 lote_geracao=25, intervalo_geracao=0.05, chave_secreta="segredo", semente=42,
+                 taxa_erro_envio=0.0):
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.taxa_erro_envio = taxa_erro_envio      # itens que a "Evolution API" recusa no envio
+        self.planilha = planilha
+        self.coluna_mensagem = coluna_mensagem
+        self.lote_geracao = lote_geracao
+        self.intervalo_geracao = intervalo_geracao
+        self.chave_secreta = chave_secreta
+        self.chamadas = Counter()
+        self.envios_recebidos = []
+        self._aleatorio = random.Random(semente)
+        self._lock = threading.Lock()
+
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                servidor._tratar(self, "GET")
+
+            def do_POST(self):
+                servidor._tratar(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._http.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._http.server_address[1]}"
+        self.url_gerar = f"{self.url}/webhook/cob"
+        self.url_enviar = f"{self.url}/webhook/enviar-wa"
+        threading.Thread(target=self._http.serve_forever, name="servidor-falso", daemon=True).start()
+
+    def encerrar(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+    def _responder(self, handler, status, corpo):
+        dados = json.dumps(corpo).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(dados)))
+        handler.end_headers()
+        handler.wfile.write(dados)
+
+    def _tratar(self, handler, metodo):
+        caminho = handler.path.split("?")[0]
+        rota = "/".join(caminho.split("/")[:3])
+        with self._lock:
+            self.chamadas[f"{metodo} {rota}"] += 1
+            falhar = self._aleatorio.random() < self.taxa_erro
+        if self.latencia:
+            time.sleep(self.latencia)
+        if falhar:
+            return self._responder(handler, 500, {"erro": "falha simulada"})
+
+        tamanho = int(handler.headers.get("Content-Length") or 0)
+        corpo = json.loads(handler.rfile.read(tamanho) or b"null") if tamanho else None
+
+        if metodo == "GET" and caminho.startswith("/instance/connectionState/"):
+            return self._responder(handler, 200, {"instance": {"state": "open"}})
+        if metodo == "POST" and caminho.startswith("/chat/whatsappNumbers/"):
+            numeros = (corpo or {}).get("numbers", [])
+            return self._responder(handler, 200, [
+                {"number": n, "exists": numero_tem_whatsapp(n), "jid": f"{n}@s.whatsapp.net"} for n in numeros
+            ])
+        if metodo == "POST" and caminho == "/webhook/cob":
+            if handler.headers.get("X-Chave-Secreta") != self.chave_secreta:
+                return self._responder(handler, 403, {"erro": "chave inválida"})
+            total = self._iniciar_geracao(corpo or {})
+            return self._responder(handler, 200, {"total_mensagens_previstas": total})
+        if metodo == "POST" and caminho == "/webhook/enviar-wa":
+            if handler.headers.get("X-Chave-Secreta") != self.chave_secreta:
+                return self._responder(handler, 403, {"erro": "chave inválida"})
+            return self._responder(handler, 200, self._receber_envio(corpo or {}))
+        return self._responder(handler, 404, {"erro": "rota desconhecida"})
+
+    def _receber_envio(self, corpo):
+        itens = corpo.get("itens", [])
+        with self._lock:
+            self.envios_recebidos.append(corpo)
+            status = ["erro" if self._aleatorio.random() < self.taxa_erro_envio else "enviado" for _ in itens]
+        return {
+            "recebidos": len(itens),
+            "itens": [{"id": item.get("id"), "status": s} for item, s in zip(itens, status)],
+        }
+
+    def _iniciar_geracao(self, corpo):
+        aba = self.planilha.abas.get(corpo.get("aba_google_sheets")) if self.planilha else None
+        linhas = aba.linhas_dados() if aba else []
+        cabecalho = linhas[0] if linhas else []
+        total = max(0, len(linhas) - 1)
+        threading.Thread(
+            target=self._gerar, args=(aba, cabecalho, linhas[1:], corpo.get("url_callback")), daemon=True
+        ).start()
+        return total
+
+    def _gerar(self, aba, cabecalho, linhas, url_callback):
+        # Escreve as mensagens na aba (ou empurra para o callback) em lotes
+        indice_nome = cabecalho.index("Nome") if "Nome" in cabecalho else None
+        for inicio in range(0, len(linhas), self.lote_geracao):
+            time.sleep(self.intervalo_geracao)
+            lote = []
+            for deslocamento, valores in enumerate(linhas[inicio:inicio + self.lote_geracao]):
+                nome = valores[indice_nome] if indice_nome is not None else ""
+                lote.append((inicio + deslocamento + 2, f"Olá {nome}, temos um boleto em aberto.", valores))
+            if url_callback:
+                mensagens = []
+                for _, texto, valores in lote:
+                    mensagem = dict(zip(cabecalho, valores))
+                    mensagem.pop(self.coluna_mensagem, None)
+                    mensagem["mensagem"] = texto
+                    mensagens.append(mensagem)
+                requests.post(url_callback, json={"mensagens": mensagens},
+                              headers={"X-Chave-Secreta": self.chave_secreta}, timeout=10)
+            elif aba is not None:
+                aba.preencher_coluna(self.coluna_mensagem, [(linha, texto) for linha, texto, _ in lote])
@@ -0,0 +1,79 @@
+import threading
+import time
+
+
+# ==============================================
+# CACHE DO STATUS DE CONEXÃO DAS INSTÂNCIAS
+# ==============================================
+# Os reruns leem o status da memória; uma thread reconsulta a Evolution API
+# apenas para as instâncias usadas recentemente.
+TTL_STATUS = 15                   # segundos até o status ser considerado velho
+INTERVALO_ATUALIZACAO = 5         # frequência com que a thread procura status velhos
+INATIVIDADE_MAXIMA = 600          # instância sem leitura por esse tempo sai do cache
+
+
+class CacheStatusConexao:
+
+    def __init__(self, consultar, ttl=TTL_STATUS, intervalo=INTERVALO_ATUALIZACAO,
+                 inatividade_maxima=INATIVIDADE_MAXIMA):
+        self._consultar = consultar
+        self.ttl = ttl
+        self.intervalo = intervalo
+        self.inatividade_maxima = inatividade_maxima
+        self._estados = {}
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self.leituras_memoria = 0
+        self.consultas_api = 0
+        self._thread = threading.Thread(target=self._trabalhar, name="status-conexao", daemon=True)
+        self._thread.start()
+
+    def _atualizar(self, instancia):
+        status = self._consultar(instancia)
+        agora = time.time()
+        with self._lock:
+            self.consultas_api += 1
+            estado = self._estados.setdefault(instancia, {'ultimo_uso': agora})
+            estado['status'] = status
+            estado['atualizado_em'] = agora
+        return status
+
+    def obter(self, instancia):
+        agora = time.time()
+        with self._lock:
+            estado = self._estados.get(instancia)
+            if estado is not None and 'status' in estado:
+                estado['ultimo_uso'] = agora
+                self.leituras_memoria += 1
+                if agora - estado['atualizado_em'] > self.ttl:
+                    self._acordar.set()
+                return estado['status']
+        # Primeira vez que a instância aparece: não há o que mostrar sem consultar
+        return self._atualizar(instancia)
+
+    def forcar(self, instancia):
+        # Usado no fluxo de QR Code, quando o status acabou de mudar
+        return self._atualizar(instancia)
+
+    def _trabalhar(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            agora = time.time()
+            with self._lock:
+                for instancia in [i for i, e in self._estados.items() if agora - e['ultimo_uso'] > self.inatividade_maxima]:
+                    del self._estados[instancia]
+                velhas = [i for i, e in self._estados.items() if agora - e.get('atualizado_em', 0) > self.ttl]
+            for instancia in velhas:
+                try:
+                    self._atualizar(instancia)
+                except Exception:
+                    continue
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'instancias': len(self._estados),
+                'leituras_memoria': self.leituras_memoria,
+                'consultas_api': self.consultas_api,
+            }
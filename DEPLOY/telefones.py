@@ -0,0 +1,53 @@
+import re
+
+import pandas as pd
+
+
+# ==============================================
+# NORMALIZAÇÃO DE TELEFONES
+# ==============================================
+# Formato canônico: 55 + DDD + 9 + número (13 dígitos para celular).
+# A mesma regra vale para o número corporativo e para a planilha.
+COLUNA_CHAVE_TELEFONE = "_telefone_normalizado"
+
+
+def normalizar_telefone(valor):
+    texto = re.sub(r'\.0+$', '', str(valor or "").strip())
+    nums = re.sub(r'\D', '', texto)
+    if not nums.startswith('55') and len(nums) in (10, 11):
+        nums = '55' + nums
+    if len(nums) == 12:
+        nums = nums[:4] + '9' + nums[4:]
+    return nums
+
+def normalizar_serie(serie):
+    # Versão vetorizada de normalizar_telefone; nulos viram ""
+    nums = (
+        serie.astype("string")
+        .str.strip()
+        .str.replace(r'\.0+$', '', regex=True)
+        .str.replace(r'\D', '', regex=True)
+        .fillna("")
+    )
+    sem_ddi = ~nums.str.startswith('55') & nums.str.len().isin([10, 11])
+    nums = nums.mask(sem_ddi, '55' + nums)
+    sem_nono = nums.str.len() == 12
+    nums = nums.mask(sem_nono, nums.str[:4] + '9' + nums.str[4:])
+    return nums.astype(object)
+
+def adicionar_chave_telefone(df, coluna="Telefone"):
+    if coluna in df.columns:
+        df[COLUNA_CHAVE_TELEFONE] = normalizar_serie(df[coluna])
+    return df
+
+def numeros_unicos(df):
+    chaves = df[COLUNA_CHAVE_TELEFONE]
+    return chaves[chaves != ""].unique().tolist()
+
+def serie_validos(df, resultados):
+    # Junta a coluna de chaves com {numero: {'valido': bool}} sem regex por linha
+    mapa = pd.Series({numero: bool(info.get('valido', False)) for numero, info in resultados.items()}, dtype=bool)
+    return df[COLUNA_CHAVE_TELEFONE].map(mapa).eq(True)
+
+def colunas_visiveis(df):
+    return [c for c in df.columns if c != COLUNA_CHAVE_TELEFONE]
@@ -0,0 +1,29 @@
+import pytest
+
+from agendador import TAXA_MAXIMA_POR_MINUTO, TAXA_MINIMA_POR_MINUTO, TAXA_POR_MINUTO, simular_envio
+
+
+@pytest.mark.parametrize("semente", [1, 2, 42])
+def test_envio_saudavel_acelera_e_eta_acerta(semente):
+    resultado = simular_envio(500, taxa_erro=0.0, semente=semente)
+    assert TAXA_POR_MINUTO <= resultado['vazao_por_minuto'] <= TAXA_MAXIMA_POR_MINUTO
+    assert resultado['taxa_final_por_minuto'] == TAXA_MAXIMA_POR_MINUTO
+    assert abs(resultado['erro_eta_pct']) <= 10
+    assert abs(resultado['erro_eta_meio_pct']) <= 10
+
+
+@pytest.mark.parametrize("semente", [1, 2, 42])
+def test_envio_com_erros_recua_e_eta_refeita_acerta(semente):
+    resultado = simular_envio(500, taxa_erro=0.2, semente=semente)
+    # Erros acima da tolerância derrubam a taxa até o piso
+    assert resultado['taxa_final_por_minuto'] == TAXA_MINIMA_POR_MINUTO
+    assert TAXA_MINIMA_POR_MINUTO <= resultado['vazao_por_minuto'] <= TAXA_MINIMA_POR_MINUTO * 1.1
+    # A ETA inicial não tem como prever os erros; a refeita no meio do envio, sim
+    assert resultado['erro_eta_pct'] < -50
+    assert abs(resultado['erro_eta_meio_pct']) <= 10
+
+
+def test_envio_curto_cabe_na_rajada():
+    resultado = simular_envio(3, taxa_erro=0.0, jitter=0)
+    assert resultado['duracao_s'] == 0
+    assert resultado['vazao_por_minuto'] is None
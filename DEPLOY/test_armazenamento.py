@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+from armazenamento import COLUNA_MENSAGEM, COLUNA_STATUS_ENVIO, ArmazenamentoLocal, ArmazenamentoSheets
+from servicos_falsos import PlanilhaFalsa, PoolSheetsFalso
+
+INSTANCIA = "5511999990000"
+
+
+def criar_backends():
+    return [
+        ArmazenamentoSheets(PoolSheetsFalso(PlanilhaFalsa()), "planilha-teste", "Dados de Cobrança"),
+        ArmazenamentoLocal(":memory:"),
+    ]
+
+
+def dados_job(mensagens=None):
+    # Dois boletos do cliente 1001, um do 1002 e um do 1003; mensagens por posição
+    df = pd.DataFrame({
+        "Cliente": ["1001", "1002", "1001", "1003"],
+        "Nome": ["Ana", "Bruno", "Ana", "Carla"],
+        "Valor": ["10.5", "20", "30", "40"],
+        "Telefone": ["11999990001", "11999990002", "11999990001", "11999990003"],
+    })
+    if mensagens is not None:
+        df[COLUNA_MENSAGEM] = mensagens
+    return df
+
+
+def test_insercao_e_leitura_iguais_nos_dois_backends():
+    resultados = []
+    for armazenamento in criar_backends():
+        armazenamento.inserir_em_lote(INSTANCIA, dados_job(["Oi Ana", "", "Oi de novo", "Oi Carla"]))
+        leitor = armazenamento.criar_leitor(INSTANCIA)
+        primeira = armazenamento.ler_novas(leitor)
+        segunda = armazenamento.ler_novas(leitor)
+        resultados.append((primeira, segunda))
+
+    sheets, local = resultados
+    assert sheets == local
+    assert [m['linha'] for m in sheets[0]] == [2, 4, 5]
+    assert sheets[0][0] == {
+        'nome': "Ana", 'telefone': "11999990001", 'mensagem': "Oi Ana", 'codigo_cliente': "1001", 'linha': 2,
+    }
+    assert sheets[1] == []
+
+
+def test_busca_por_linha_e_status_iguais_nos_dois_backends():
+    resultados = []
+    for armazenamento in criar_backends():
+        armazenamento.inserir_em_lote(INSTANCIA, dados_job(["Oi Ana", "Oi Bruno", "Oi de novo", "Oi Carla"]))
+        armazenamento.atualizar_status_envio(INSTANCIA, {3: "Enviado", 5: "Falhou"})
+        resultados.append((
+            [armazenamento.buscar_linha(INSTANCIA, linha) for linha in (1, 3, 5)],
+            armazenamento.ler_status_envio(INSTANCIA),
+        ))
+
+    sheets, local = resultados
+    assert sheets == local
+    linhas, status = sheets
+    assert linhas[1]["Nome"] == "Bruno"
+    assert linhas[1][COLUNA_STATUS_ENVIO] == "Enviado"
+    assert status == {2: "Pendente", 3: "Enviado", 4: "Pendente", 5: "Falhou"}
+
+
+@pytest.mark.parametrize("armazenamento", criar_backends(), ids=lambda a: a.nome)
+def test_mensagens_de_callback_ganham_a_linha_do_cliente(armazenamento):
+    armazenamento.inserir_em_lote(INSTANCIA, dados_job())
+    mensagens = [
+        {'codigo_cliente': "1001", 'telefone': "11999990001", 'mensagem': "Oi Ana"},
+        {'codigo_cliente': "1003", 'telefone': "11999990003", 'mensagem': "Oi Carla", 'linha': 5},
+        {'codigo_cliente': "1001", 'telefone': "11999990001", 'mensagem': "Oi de novo"},
+        {'codigo_cliente': "9999", 'telefone': "11999990009", 'mensagem': "Sem linha"},
+    ]
+
+    assert armazenamento.registrar_mensagens(INSTANCIA, mensagens) == 3
+    assert [m.get('linha') for m in mensagens] == [2, 5, 4, None]
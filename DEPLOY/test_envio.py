@@ -0,0 +1,178 @@
+import threading
+import time
+
+from agendador import AgendadorEnvio, RelogioSimulado
+from envio import ESTADO_CONCLUIDO, ESTADO_INTERROMPIDO, STATUS_ENVIADO, STATUS_FALHOU, DespachanteEnvios
+
+
+class RespostaFalsa:
+
+    def __init__(self, status_code, corpo=None):
+        self.status_code = status_code
+        self._corpo = corpo
+
+    def json(self):
+        return self._corpo
+
+
+class WebhookFalso:
+    # Faz o papel da sessão HTTP do despachante: guarda cada lote recebido e
+    # responde conforme responder(corpo) -> (status, corpo da resposta)
+
+    def __init__(self, responder=None):
+        self.responder = responder or (lambda corpo: (200, {"recebidos": len(corpo["itens"])}))
+        self.lotes = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        with self._lock:
+            self.lotes.append(json)
+        status, corpo = self.responder(json)
+        return RespostaFalsa(status, corpo)
+
+
+def criar_despachante(caminho, webhook, **kwargs):
+    despachante = DespachanteEnvios(caminho, "http://n8n.invalido/webhook", "segredo", intervalo_segundos=0, **kwargs)
+    despachante._sessao = webhook
+    return despachante
+
+def aguardar(despachante, id_envio, limite=5):
+    prazo = time.monotonic() + limite
+    while despachante.em_andamento(id_envio):
+        assert time.monotonic() < prazo, "envio não terminou"
+        time.sleep(0.01)
+
+def itens(quantidade):
+    return [
+        {"destinatario": f"1199999{i:04d}", "mensagem": f"Olá {i}", "codigo_cliente": f"{1000 + i}", "linha": i + 2}
+        for i in range(quantidade)
+    ]
+
+
+def test_envio_interrompido_retoma_do_primeiro_lote_sem_confirmacao(tmp_path):
+    caminho = str(tmp_path / "envios.sqlite3")
+    lotes_aceitos = []
+
+    def cair_no_segundo_lote(corpo):
+        if corpo["lote"] == 2:
+            return 500, None
+        lotes_aceitos.append([item["id"] for item in corpo["itens"]])
+        return 200, {}
+
+    status_registrados = []
+    despachante = criar_despachante(
+        caminho, WebhookFalso(cair_no_segundo_lote), tamanho_lote=2, max_tentativas=1,
+        registrar_status=lambda instancia, id_job, status: status_registrados.append((instancia, id_job, status)),
+    )
+    id_envio = despachante.criar_envio("5511999990000", itens(5), id_job="job-1")
+    despachante.iniciar(id_envio)
+    aguardar(despachante, id_envio)
+
+    progresso = despachante.progresso(id_envio)
+    assert progresso['estado'] == ESTADO_INTERROMPIDO
+    assert (progresso['enviados'], progresso['pendentes']) == (2, 3)
+    assert progresso['ultimo_erro'] == "Status 500"
+
+    # Outro processo, mesmo SQLite: recomeça na posição 2
+    webhook = WebhookFalso()
+    retomado = criar_despachante(
+        caminho, webhook, tamanho_lote=2,
+        registrar_status=lambda instancia, id_job, status: status_registrados.append((instancia, id_job, status)),
+    )
+    retomado.iniciar(id_envio)
+    aguardar(retomado, id_envio)
+
+    assert [[item["id"] for item in lote["itens"]] for lote in webhook.lotes] == [
+        [f"{id_envio}:2", f"{id_envio}:3"], [f"{id_envio}:4"],
+    ]
+    assert all("linha" not in item for lote in webhook.lotes for item in lote["itens"])
+    progresso = retomado.progresso(id_envio)
+    assert progresso['estado'] == ESTADO_CONCLUIDO
+    assert (progresso['enviados'], progresso['pendentes'], progresso['lotes_confirmados']) == (5, 0, 3)
+    assert status_registrados == [
+        ("5511999990000", "job-1", {2: STATUS_ENVIADO, 3: STATUS_ENVIADO}),
+        ("5511999990000", "job-1", {4: STATUS_ENVIADO, 5: STATUS_ENVIADO}),
+        ("5511999990000", "job-1", {6: STATUS_ENVIADO}),
+    ]
+
+
+def test_erros_por_item_marcam_so_os_itens_recusados():
+    def recusar_pares(corpo):
+        return 200, {"itens": [
+            {"id": item["id"], "status": "erro" if int(item["id"].split(":")[1]) % 2 == 0 else "enviado"}
+            for item in corpo["itens"]
+        ]}
+
+    status_por_linha = {}
+    webhook = WebhookFalso(recusar_pares)
+    despachante = criar_despachante(
+        ":memory:", webhook, tamanho_lote=3,
+        registrar_status=lambda instancia, id_job, status: status_por_linha.update(status),
+    )
+    id_envio = despachante.criar_envio("5511999990000", itens(5))
+    despachante.iniciar(id_envio)
+    aguardar(despachante, id_envio)
+
+    progresso = despachante.progresso(id_envio)
+    assert progresso['estado'] == ESTADO_CONCLUIDO
+    assert (progresso['enviados'], progresso['falhos'], progresso['pendentes']) == (2, 3, 0)
+    assert status_por_linha == {
+        2: STATUS_FALHOU, 3: STATUS_ENVIADO, 4: STATUS_FALHOU, 5: STATUS_ENVIADO, 6: STATUS_FALHOU,
+    }
+    # Recusados pelo n8n não voltam a ser postados
+    assert len(webhook.lotes) == 2
+
+
+def test_shards_que_terminam_juntos_concluem_o_grupo_uma_vez():
+    remetentes = ["5511000000001", "5511000000002", "5511000000003"]
+    # Cada shard posta um único lote e todos respondem no mesmo instante
+    barreira = threading.Barrier(len(remetentes), timeout=5)
+
+    def responder_juntos(corpo):
+        barreira.wait()
+        return 200, {}
+
+    concluidos = []
+    despachante = criar_despachante(
+        ":memory:", WebhookFalso(responder_juntos), tamanho_lote=100,
+        ao_concluir_grupo=lambda id_grupo, progresso: concluidos.append((id_grupo, progresso)),
+    )
+    id_grupo = despachante.distribuir("5511999990000", itens(30), remetentes, id_job="job-1")
+    shards = despachante.envios_do_grupo(id_grupo)
+    assert len(shards) == len(remetentes)
+
+    despachante.iniciar_grupo(id_grupo)
+    for id_envio in shards:
+        aguardar(despachante, id_envio)
+
+    assert len(concluidos) == 1
+    grupo, progresso = concluidos[0]
+    assert grupo == id_grupo
+    assert progresso['estado'] == ESTADO_CONCLUIDO
+    assert (progresso['total'], progresso['enviados']) == (30, 30)
+    # Retomar um grupo já concluído não avisa de novo
+    despachante.iniciar_grupo(id_grupo)
+    assert len(concluidos) == 1
+
+
+def test_erros_da_evolution_no_retorno_derrubam_a_taxa_do_remetente():
+    # O n8n repassa o erro da Evolution por item: corpo de erro ou status HTTP
+    def evolution_recusa(corpo):
+        itens = [{"id": item["id"], "status": 200} for item in corpo["itens"]]
+        itens[0] = {"id": itens[0]["id"], "status": 400, "error": "number not on WhatsApp"}
+        itens[1] = {"id": itens[1]["id"], "erro": "Connection Closed"}
+        return 200, {"itens": itens}
+
+    agendador = AgendadorEnvio(taxa_por_minuto=4.0, rajada=100, jitter=0, relogio=RelogioSimulado())
+    despachante = criar_despachante(
+        ":memory:", WebhookFalso(evolution_recusa), tamanho_lote=5, agendador=agendador,
+    )
+    id_envio = despachante.criar_envio("5511999990000", itens(5))
+    despachante.iniciar(id_envio)
+    aguardar(despachante, id_envio)
+
+    progresso = despachante.progresso(id_envio)
+    assert (progresso['enviados'], progresso['falhos']) == (3, 2)
+    assert agendador.estatisticas()["5511999990000"] == {
+        'taxa_por_minuto': 2.0, 'fichas': 95.0, 'enviados': 3, 'erros': 2,
+    }
@@ -0,0 +1,71 @@
+import pytest
+
+import fila
+from fila import ControladorAdmissao
+
+TIMEOUT_LEASE = 30
+
+
+class RelogioFalso:
+    # Substitui o módulo time dentro de fila.py: o lease vence quando o teste quiser
+
+    def __init__(self):
+        self.agora = 1_000_000.0
+
+    def time(self):
+        return self.agora
+
+    def avancar(self, segundos):
+        self.agora += segundos
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = RelogioFalso()
+    monkeypatch.setattr(fila, "time", relogio)
+    return relogio
+
+
+def test_sessao_alem_do_limite_espera_a_vez(relogio):
+    controlador = ControladorAdmissao(2, TIMEOUT_LEASE)
+
+    assert controlador.solicitar("5511000000001", "s1")['admitido']
+    assert controlador.solicitar("5511000000002", "s2")['admitido']
+    terceira = controlador.solicitar("5511000000003", "s3")
+
+    assert (terceira['admitido'], terceira['posicao'], terceira['ativos'], terceira['na_fila']) == (False, 1, 2, 1)
+    assert terceira['espera_estimada_s'] > 0
+
+    controlador.liberar("5511000000001", "s1")
+    assert controlador.solicitar("5511000000003", "s3")['admitido']
+    assert controlador.estado()['ativos'] == ["5511000000002", "5511000000003"]
+
+
+def test_heartbeat_perdido_libera_a_vaga(relogio):
+    controlador = ControladorAdmissao(2, TIMEOUT_LEASE)
+    controlador.solicitar("5511000000001", "s1")
+    controlador.solicitar("5511000000002", "s2")
+    assert not controlador.solicitar("5511000000003", "s3")['admitido']
+
+    # s1 e a espera continuam batendo; s2 fecha a aba e para de renovar
+    relogio.avancar(TIMEOUT_LEASE - 5)
+    controlador.heartbeat("5511000000001")
+    controlador.heartbeat("5511000000003")
+    relogio.avancar(10)
+
+    assert controlador.solicitar("5511000000003", "s3")['admitido']
+    assert controlador.estado()['ativos'] == ["5511000000001", "5511000000003"]
+
+
+def test_mesmo_numero_em_outra_sessao_e_recusado(relogio):
+    controlador = ControladorAdmissao(2, TIMEOUT_LEASE)
+    assert controlador.solicitar("5511000000001", "s1")['admitido']
+
+    outra = controlador.solicitar("5511000000001", "s2")
+    assert (outra['admitido'], outra['mensagem']) == (False, "Este número já está gerando em outra sessão")
+    # "Sair da fila" na segunda sessão não derruba a vaga da primeira
+    controlador.liberar("5511000000001", "s2")
+    assert controlador.solicitar("5511000000001", "s1")['mensagem'] == "Processando"
+
+    controlador.liberar("5511000000001", "s1")
+    assert controlador.solicitar("5511000000001", "s2")['admitido']
@@ -0,0 +1,149 @@
+from datetime import datetime
+
+import gspread
+
+from planilhas import MAX_CELULAS_POR_ESCRITA, LeitorMensagensIncremental, _blocos_alterados, escrever_aba
+from servicos_falsos import AbaFalsa, PlanilhaFalsa, PoolSheetsFalso
+
+
+class AbaUserEntered:
+    # Guarda os valores como o Sheets depois de um USER_ENTERED: números viram
+    # número e "dd/mm/aaaa" vira o número de série da data; lê como FORMULA
+
+    def __init__(self, valores=None):
+        self.valores = [list(linha) for linha in valores or []]
+        self.redimensionamentos = []
+        self.escritas = []
+
+    def get_all_values(self, value_render_option=None):
+        assert value_render_option == gspread.utils.ValueRenderOption.formula
+        return [list(linha) for linha in self.valores]
+
+    def resize(self, rows=None, cols=None):
+        self.redimensionamentos.append((rows, cols))
+        self.valores = [linha[:cols] for linha in self.valores[:rows]]
+
+    def batch_update(self, dados, value_input_option=None):
+        self.escritas.append([item['range'] for item in dados])
+        for item in dados:
+            grade = gspread.utils.a1_range_to_grid_range(item['range'])
+            for i, linha in enumerate(item['values']):
+                for j, valor in enumerate(linha):
+                    self._escrever(grade['startRowIndex'] + i, grade['startColumnIndex'] + j, valor)
+
+    def _escrever(self, linha, coluna, valor):
+        while len(self.valores) <= linha:
+            self.valores.append([])
+        while len(self.valores[linha]) <= coluna:
+            self.valores[linha].append("")
+        self.valores[linha][coluna] = self._interpretar(valor)
+
+    @staticmethod
+    def _interpretar(valor):
+        try:
+            return float(valor)
+        except ValueError:
+            pass
+        try:
+            return (datetime.strptime(valor, "%d/%m/%Y") - datetime(1899, 12, 30)).days
+        except ValueError:
+            return valor
+
+
+class AbaRegistrada(AbaFalsa):
+    # Guarda os intervalos pedidos em cada batch_get do leitor
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.leituras = []
+
+    def batch_get(self, intervalos):
+        self.leituras.append(list(intervalos))
+        return super().batch_get(intervalos)
+
+
+def dados_job(valores, vencimentos):
+    return [["Nome", "Valor", "Vencimento"]] + [
+        [f"Cliente {i}", valor, vencimento] for i, (valor, vencimento) in enumerate(zip(valores, vencimentos))
+    ]
+
+
+def test_numeros_e_datas_iguais_nao_sao_reescritos():
+    aba = AbaUserEntered()
+    dados = dados_job(["250.75", "0123", "10"], ["12/12/2025", "01/02/2026", "28/02/2026"])
+    escrever_aba(aba, dados)
+    assert aba.valores[1][1:] == [250.75, 46003]
+
+    relatorio = escrever_aba(aba, dados)
+
+    assert aba.escritas == [["A1:C4"]]
+    assert (relatorio['modo'], relatorio['intervalos'], relatorio['requisicoes']) == ('diferencial', 0, 0)
+
+
+def test_so_as_celulas_alteradas_sao_enviadas():
+    aba = AbaUserEntered()
+    escrever_aba(aba, dados_job(["1", "2", "3", "4"], ["01/01/2026"] * 4))
+
+    # Valor da 2ª linha e vencimento da 4ª: dois blocos de uma célula; depois um bloco B3:C4
+    escrever_aba(aba, dados_job(["1", "20", "3", "4"], ["01/01/2026", "01/01/2026", "01/01/2026", "15/03/2026"]))
+    assert aba.escritas[-1] == ["B3:B3", "C5:C5"]
+
+    escrever_aba(aba, dados_job(["1", "21", "4", "4"], ["01/01/2026", "02/01/2026", "01/01/2026", "15/03/2026"]))
+    assert aba.escritas[-1] == ["B3:C4"]
+
+
+def test_aba_encolhe_e_so_linhas_novas_sao_escritas():
+    aba = AbaUserEntered()
+    escrever_aba(aba, dados_job(["1", "2", "3", "4", "5"], ["01/01/2026"] * 5))
+
+    relatorio = escrever_aba(aba, dados_job(["1", "2", "9"], ["01/01/2026"] * 3))
+
+    assert aba.redimensionamentos[-1] == (4, 3)
+    assert aba.escritas[-1] == ["B4:B4"]
+    assert len(aba.valores) == 4
+    assert relatorio['celulas'] == 1
+
+
+def test_blocos_alterados_ignoram_colunas_iguais_nas_pontas():
+    atual = [["Nome", "Valor", "Vencimento"], ["Ana", "10", "46003"], ["Bia", "20", "46003"]]
+    dados = [["Nome", "Valor", "Vencimento"], ["Ana", "11", "12/12/2025"], ["Bia", "21", "13/12/2025"]]
+    assert _blocos_alterados(atual, dados, 3) == [(1, 3, 1, 3)]
+
+
+def test_escrita_grande_quebra_no_limite_de_celulas():
+    # 2001 linhas x 10 colunas: 2000 linhas cabem em 20 mil células, a última vai em outra requisição
+    aba = AbaUserEntered()
+    dados = [[f"c{j}" for j in range(10)]] + [[f"{i}-{j}x" for j in range(10)] for i in range(2000)]
+
+    relatorio = escrever_aba(aba, dados)
+
+    assert MAX_CELULAS_POR_ESCRITA == 20_000
+    assert aba.escritas == [["A1:J2000"], ["A2001:J2001"]]
+    assert (relatorio['requisicoes'], relatorio['celulas']) == (2, 20_010)
+
+
+def test_leitor_nao_repete_linhas_preenchidas_fora_de_ordem():
+    planilha = PlanilhaFalsa()
+    aba = planilha.abas["Dados"] = AbaRegistrada("Dados", 10, 7)
+    aba.batch_update([{'range': "A1:G6", 'values': [
+        ["Cliente", "Nome", "Valor", "Vencimento", "Telefone", "Observação", "Mensagem Gerada"],
+    ] + [[f"{1000 + i}", f"Cliente {i}", "10", "01/01/2026", f"1199999000{i}", "", ""] for i in range(5)]}])
+    leitor = LeitorMensagensIncremental("planilha-teste", "Dados")
+    pool = PoolSheetsFalso(planilha)
+
+    lidas = []
+    # O n8n preenche as linhas 3 e 5, depois 2 e 6, por fim a 4
+    for preenchidas in ([3, 5], [2, 6], [4], []):
+        aba.preencher_coluna("Mensagem Gerada", [(linha, f"Oi {linha}") for linha in preenchidas])
+        novas = leitor.ler_novas(pool)
+        assert sorted(m['linha'] for m in novas) == preenchidas
+        lidas.extend(novas)
+
+    assert sorted(m['linha'] for m in lidas) == [2, 3, 4, 5, 6]
+    assert (leitor.proxima_linha, leitor.total_lido) == (7, 5)
+    assert lidas[0] == {'codigo_cliente': "1001", 'nome': "Cliente 1", 'telefone': "11999990001", 'mensagem': "Oi 3", 'linha': 3}
+    # Só as colunas resolvidas, a partir da primeira linha ainda sem mensagem
+    assert aba.leituras == [
+        ["A2:A", "B2:B", "E2:E", "G2:G"], ["A2:A", "B2:B", "E2:E", "G2:G"],
+        ["A4:A", "B4:B", "E4:E", "G4:G"], ["A7:A", "B7:B", "E7:E", "G7:G"],
+    ]
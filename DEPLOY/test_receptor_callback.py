@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+
+from armazenamento import COLUNA_MENSAGEM, ArmazenamentoSheets
+from receptor_callback import ReceptorCallback, simular_n8n
+from servicos_falsos import PlanilhaFalsa, PoolSheetsFalso
+
+CHAVE = "segredo"
+INSTANCIA = "5511999990000"
+
+
+@pytest.fixture
+def receptor():
+    receptor = ReceptorCallback("127.0.0.1", 0, CHAVE)
+    yield receptor
+    receptor.encerrar()
+
+
+def mensagens_n8n():
+    # Como o n8n devolve as linhas da aba: colunas da planilha + o texto gerado
+    return [
+        {"Cliente": "1001", "Nome": "Ana", "Telefone": "11999990001", "mensagem": "Oi Ana"},
+        {"Cliente": "1002", "Nome": "Bruno", "Telefone": "11999990002", "mensagem": "Oi Bruno"},
+        {"Cliente": "1001", "Nome": "Ana", "Telefone": "11999990001", "mensagem": "Oi de novo, Ana"},
+    ]
+
+
+def test_lote_repetido_pelo_n8n_volta_como_duplicadas(receptor):
+    receptor.registrar("job-1")
+    url = receptor.url_para("job-1")
+
+    assert simular_n8n(url, mensagens_n8n(), CHAVE, tamanho_lote=2) == [
+        (200, {"recebidas": 2, "duplicadas": 0}), (200, {"recebidas": 1, "duplicadas": 0}),
+    ]
+    # Retry do n8n após timeout: o mesmo lote chega de novo
+    assert simular_n8n(url, mensagens_n8n()[:2], CHAVE) == [(200, {"recebidas": 0, "duplicadas": 2})]
+
+    recebidas = receptor.aguardar("job-1", timeout=1)
+    assert [m['mensagem'] for m in recebidas] == ["Oi Ana", "Oi Bruno", "Oi de novo, Ana"]
+    assert (receptor.recebidas, receptor.duplicadas) == (3, 2)
+
+
+def test_chave_errada_e_job_desconhecido_sao_recusados(receptor):
+    receptor.registrar("job-1")
+
+    assert simular_n8n(receptor.url_para("job-1"), mensagens_n8n(), "outra") == [(403, {"erro": "chave inválida"})]
+    assert simular_n8n(receptor.url_para("job-2"), mensagens_n8n(), CHAVE) == [(404, {"erro": "job desconhecido"})]
+    assert receptor.aguardar("job-1", timeout=0.1) == []
+    assert receptor.rejeitadas == 2
+
+
+def test_mensagens_sem_linha_ganham_a_linha_da_aba_do_job(receptor):
+    armazenamento = ArmazenamentoSheets(PoolSheetsFalso(PlanilhaFalsa()), "planilha-teste", "Dados de Cobrança")
+    armazenamento.inserir_em_lote(INSTANCIA, pd.DataFrame({
+        "Cliente": ["1001", "1002", "1001", "1003"],
+        "Nome": ["Ana", "Bruno", "Ana", "Carla"],
+        "Telefone": ["11999990001", "11999990002", "11999990001", "11999990003"],
+    }))
+    receptor.registrar("job-1")
+    mensagens = mensagens_n8n() + [
+        {"Cliente": "1003", "Nome": "Carla", "Telefone": "11999990003", "mensagem": "Oi Carla", "row_number": 5},
+    ]
+
+    simular_n8n(receptor.url_para("job-1"), mensagens, CHAVE)
+    recebidas = receptor.aguardar("job-1", timeout=1)
+
+    assert armazenamento.registrar_mensagens(INSTANCIA, recebidas) == 4
+    assert [(m['mensagem'], m['linha']) for m in recebidas] == [
+        ("Oi Ana", 2), ("Oi Bruno", 3), ("Oi de novo, Ana", 4), ("Oi Carla", 5),
+    ]
+
+
+def test_job_retomado_nao_conta_de_novo_o_que_ja_esta_na_aba(receptor):
+    armazenamento = ArmazenamentoSheets(PoolSheetsFalso(PlanilhaFalsa()), "planilha-teste", "Dados de Cobrança")
+    # O n8n grava o texto na aba antes de avisar: a 2ª da Ana ainda não foi gravada
+    armazenamento.inserir_em_lote(INSTANCIA, pd.DataFrame({
+        "Cliente": ["1001", "1002", "1001", "1003"],
+        "Nome": ["Ana", "Bruno", "Ana", "Carla"],
+        "Telefone": ["11999990001", "11999990002", "11999990001", "11999990003"],
+        COLUNA_MENSAGEM: ["Oi Ana", "Oi Bruno", "", "Oi Carla"],
+    }))
+    receptor.registrar("job-1")
+    url = receptor.url_para("job-1")
+    carla = {"Cliente": "1003", "Nome": "Carla", "Telefone": "11999990003", "mensagem": "Oi Carla", "row_number": 5}
+
+    # A sessão original consumiu as duas primeiras antes de cair; ficam na fila a 2ª da Ana e a da Carla
+    simular_n8n(url, mensagens_n8n()[:2], CHAVE)
+    armazenamento.registrar_mensagens(INSTANCIA, receptor.aguardar("job-1", timeout=1))
+    simular_n8n(url, [mensagens_n8n()[2], carla], CHAVE)
+
+    ja_lidas = armazenamento.ler_novas(armazenamento.criar_leitor(INSTANCIA))
+    assert receptor.retomar("job-1", ja_lidas) == 1
+    restantes = receptor.aguardar("job-1", timeout=1)
+
+    assert [m['mensagem'] for m in ja_lidas + restantes] == ["Oi Ana", "Oi Bruno", "Oi Carla", "Oi de novo, Ana"]
+    # Retry do n8n de uma mensagem que a sessão retomada leu da aba
+    assert simular_n8n(url, mensagens_n8n()[:1], CHAVE) == [(200, {"recebidas": 0, "duplicadas": 1})]
+    assert receptor.aguardar("job-1", timeout=0.1) == []
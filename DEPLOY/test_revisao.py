@@ -0,0 +1,68 @@
+from envio import STATUS_ENVIADO
+from revisao import diferencas_edicao, itens_para_envio, preparar_quadro_revisao, registros_aprovados
+
+
+def mensagens_geradas():
+    # Na ordem em que chegaram da aba; duas Anas para conferir a ordenação estável
+    return [
+        {"nome": "Carla", "telefone": "11999990003", "mensagem": "Oi Carla", "codigo_cliente": "1003", "linha": 2},
+        {"nome": "Ana", "telefone": "11999990001", "mensagem": "Oi Ana", "codigo_cliente": "1001", "linha": 3},
+        {"nome": "Bruno", "telefone": "11999990002", "mensagem": "Oi Bruno", "codigo_cliente": "1002", "linha": 4},
+        {"nome": "Ana", "telefone": "11999990001", "mensagem": "Oi de novo, Ana", "codigo_cliente": "1001", "linha": 5},
+        {"nome": "Davi", "telefone": "11999990004", "mensagem": "  ", "codigo_cliente": "1004", "linha": 6},
+    ]
+
+
+def revisar(edicoes, selecionado_padrao, status_envio=None):
+    quadro = preparar_quadro_revisao(mensagens_geradas())
+    diferencas = diferencas_edicao(quadro, edicoes, selecionado_padrao)
+    registros = registros_aprovados(quadro, diferencas, selecionado_padrao)
+    return itens_para_envio(registros, status_envio or {})
+
+
+def test_quadro_ordenado_por_nome_mantem_a_ordem_de_chegada_nos_empates():
+    quadro = preparar_quadro_revisao(mensagens_geradas())
+
+    assert list(quadro["linha"]) == [3, 5, 4, 2]
+    # A ordem não muda ao montar o quadro de novo (as posições do editor dependem dela)
+    assert preparar_quadro_revisao(mensagens_geradas()).equals(quadro)
+
+
+def test_linha_editada_mas_desmarcada_nao_vai_nem_entra_nas_edicoes():
+    # Posições do quadro: 0 Ana (3), 1 Ana (5), 2 Bruno (4), 3 Carla (2)
+    itens, editadas, ja_enviadas = revisar({
+        "0": {"mensagem": "Oi Ana, texto novo", "Enviar": False},
+        "2": {"mensagem": "Oi Bruno, texto novo"},
+    }, selecionado_padrao=True)
+
+    assert [(item["linha"], item["mensagem"]) for item in itens] == [
+        (5, "Oi de novo, Ana"), (4, "Oi Bruno, texto novo"), (2, "Oi Carla"),
+    ]
+    assert editadas == [{
+        "linha": 4, "codigo_cliente": "1002", "nome": "Bruno",
+        "mensagem_original": "Oi Bruno", "mensagem": "Oi Bruno, texto novo",
+    }]
+    assert ja_enviadas == 0
+
+
+def test_com_marcar_todos_desligado_so_vao_as_linhas_marcadas():
+    itens, editadas, _ = revisar({
+        "3": {"Enviar": True},
+        "1": {"Enviar": True, "mensagem": "Oi de novo, Ana!"},
+        "2": {"mensagem": "Editada sem marcar"},
+    }, selecionado_padrao=False)
+
+    assert itens == [
+        {"destinatario": "11999990001", "mensagem": "Oi de novo, Ana!", "codigo_cliente": "1001", "nome": "Ana", "linha": 5},
+        {"destinatario": "11999990003", "mensagem": "Oi Carla", "codigo_cliente": "1003", "nome": "Carla", "linha": 2},
+    ]
+    assert [(item["linha"], item["mensagem_original"]) for item in editadas] == [(5, "Oi de novo, Ana")]
+
+
+def test_linhas_ja_enviadas_ficam_de_fora():
+    itens, editadas, ja_enviadas = revisar(
+        {"3": {"mensagem": "Oi Carla, de novo"}}, selecionado_padrao=True, status_envio={2: STATUS_ENVIADO},
+    )
+
+    assert [item["linha"] for item in itens] == [3, 5, 4]
+    assert (editadas, ja_enviadas) == ([], 1)
@@ -0,0 +1,41 @@
+import time
+
+from validacao import ESTADO_CONCLUIDA, ESTADO_FALHOU, ExecutorValidacao
+
+
+class ExecutorInstavel(ExecutorValidacao):
+    # A primeira validação cai (Evolution fora do ar); as seguintes respondem
+
+    def __init__(self):
+        super().__init__("http://evolution.invalida", "chave")
+        self.tentativas = 0
+
+    def _validar(self, numeros, trabalho, ao_progresso, id_job):
+        self.tentativas += 1
+        if self.tentativas == 1:
+            raise ConnectionError("Evolution indisponível")
+        return {numero: {'valido': True} for numero in numeros}
+
+
+def aguardar_fim(executor, chave, limite=5):
+    prazo = time.monotonic() + limite
+    while executor.obter(chave)['estado'] not in (ESTADO_CONCLUIDA, ESTADO_FALHOU):
+        assert time.monotonic() < prazo, "validação não terminou"
+        time.sleep(0.01)
+    return executor.obter(chave)
+
+
+def test_validacao_que_falhou_recomeca_ao_tentar_de_novo():
+    executor = ExecutorInstavel()
+    chave = ("arquivo", "5511999990000")
+
+    executor.iniciar(chave, ["5511999990001", "5511999990002"], "5511999990000")
+    trabalho = aguardar_fim(executor, chave)
+    assert (trabalho['estado'], trabalho['erro']) == (ESTADO_FALHOU, "Evolution indisponível")
+    assert executor.resultados(chave) is None
+
+    executor.iniciar(chave, ["5511999990001", "5511999990002"], "5511999990000")
+    assert aguardar_fim(executor, chave)['estado'] == ESTADO_CONCLUIDA
+    assert executor.resultados(chave) == {"5511999990001": {'valido': True}, "5511999990002": {'valido': True}}
+    assert executor.tentativas == 2
+    assert executor.estatisticas() == {'trabalhos': 1, ESTADO_CONCLUIDA: 1}
@@ -0,0 +1,350 @@
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# ==============================================
+# VALIDAÇÃO DE WHATSAPP EM LOTE
+# ==============================================
+TAMANHO_LOTE_VALIDACAO = 50
+MAX_REQUISICOES_PARALELAS = 4
+TIMEOUT_VALIDACAO = (5, 30)  # (conexão, leitura)
+
+CACHE_TTL_POSITIVO = 30 * 24 * 3600   # número com WhatsApp raramente deixa de ter
+CACHE_TTL_NEGATIVO = 24 * 3600        # número sem WhatsApp é reconsultado mais cedo
+CACHE_MAX_ENTRADAS = 200_000
+
+
+def criar_sessao_http(max_paralelo=MAX_REQUISICOES_PARALELAS):
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max_paralelo)
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    return sessao
+
+def consultar_lote(sessao, url, headers, lote, timeout=TIMEOUT_VALIDACAO):
+    resp = sessao.post(url, json={"numbers": lote}, headers=headers, timeout=timeout)
+    if resp.status_code not in (200, 201):
+        raise requests.exceptions.HTTPError(f"Status {resp.status_code}", response=resp)
+
+    try:
+        dados = resp.json()
+    except ValueError:
+        dados = []
+
+    pendentes = set(lote)
+    existe = {}
+    if isinstance(dados, list):
+        for posicao, item in enumerate(dados):
+            if not isinstance(item, dict):
+                continue
+            numero = re.sub(r'\D', '', str(item.get('number', '')))
+            # A API pode devolver o número reformatado; cai para a posição no lote
+            if numero not in pendentes and posicao < len(lote):
+                numero = lote[posicao]
+            existe[numero] = bool(item.get('exists', False))
+
+    return {numero: existe.get(numero, False) for numero in lote}
+
+# ==============================================
+# CACHE PERSISTENTE (SQLITE)
+# ==============================================
+class CacheValidacao:
+    # Resultado da consulta por número normalizado, compartilhado entre sessões.
+    # Entradas expiram pelo TTL (positivo/negativo) e, acima de max_entradas,
+    # as menos acessadas recentemente são descartadas.
+
+    def __init__(self, caminho, ttl_positivo=CACHE_TTL_POSITIVO, ttl_negativo=CACHE_TTL_NEGATIVO,
+                 max_entradas=CACHE_MAX_ENTRADAS):
+        self.caminho = caminho
+        self.ttl_positivo = ttl_positivo
+        self.ttl_negativo = ttl_negativo
+        self.max_entradas = max_entradas
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.descartados = 0
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS numeros (
+                numero TEXT PRIMARY KEY,
+                valido INTEGER NOT NULL,
+                verificado_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            )
+        """)
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_numeros_acesso ON numeros (ultimo_acesso)")
+
+    def buscar(self, numeros):
+        # Retorna {numero: valido} apenas para entradas dentro do TTL
+        agora = time.time()
+        encontrados = {}
+        numeros = list(numeros)
+        with self._lock:
+            for i in range(0, len(numeros), 500):
+                parte = numeros[i:i + 500]
+                marcadores = ",".join("?" * len(parte))
+                linhas = self._conexao.execute(
+                    f"SELECT numero, valido, verificado_em FROM numeros WHERE numero IN ({marcadores})",
+                    parte
+                ).fetchall()
+                for numero, valido, verificado_em in linhas:
+                    ttl = self.ttl_positivo if valido else self.ttl_negativo
+                    if agora - verificado_em < ttl:
+                        encontrados[numero] = bool(valido)
+                    else:
+                        self.expirados += 1
+
+            if encontrados:
+                self._conexao.executemany(
+                    "UPDATE numeros SET ultimo_acesso = ? WHERE numero = ?",
+                    [(agora, numero) for numero in encontrados]
+                )
+            self.hits += len(encontrados)
+            self.misses += len(numeros) - len(encontrados)
+        return encontrados
+
+    def gravar(self, resultados):
+        if not resultados:
+            return
+        agora = time.time()
+        with self._lock:
+            self._conexao.executemany(
+                "INSERT OR REPLACE INTO numeros (numero, valido, verificado_em, ultimo_acesso) VALUES (?, ?, ?, ?)",
+                [(numero, int(valido), agora, agora) for numero, valido in resultados.items()]
+            )
+            self._podar()
+
+    def _podar(self):
+        total = self._conexao.execute("SELECT COUNT(*) FROM numeros").fetchone()[0]
+        excesso = total - self.max_entradas
+        if excesso > 0:
+            self._conexao.execute(
+                "DELETE FROM numeros WHERE numero IN "
+                "(SELECT numero FROM numeros ORDER BY ultimo_acesso ASC LIMIT ?)",
+                (excesso,)
+            )
+            self.descartados += excesso
+
+    def estatisticas(self):
+        with self._lock:
+            total = self._conexao.execute("SELECT COUNT(*) FROM numeros").fetchone()[0]
+        consultas = self.hits + self.misses
+        return {
+            'entradas': total,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expirados': self.expirados,
+            'descartados': self.descartados,
+            'taxa_acerto': (self.hits / consultas) if consultas else 0.0,
+        }
+
+def validar_numeros(numeros, instancia, api_url, api_key,
+                    tamanho_lote=TAMANHO_LOTE_VALIDACAO,
+                    max_paralelo=MAX_REQUISICOES_PARALELAS,
+                    ao_progresso=None, sessao=None, cache=None, metricas=None, id_job=None,
+                    cancelado=None):
+    # Recebe números já normalizados (ver telefones.py) e retorna
+    # {numero: {'valido': bool}}. Cada número é consultado uma única vez e,
+    # com cache, só vão à API os desconhecidos ou expirados. Com "cancelado"
+    # (threading.Event) setado, os lotes que ainda não saíram são descartados.
+    unicos = {numero for numero in numeros if numero}
+
+    em_cache = cache.buscar(unicos) if cache is not None else {}
+    resultados = {numero: {'valido': valido} for numero, valido in em_cache.items()}
+
+    normalizados = sorted(unicos - set(em_cache))
+    lotes = [normalizados[i:i + tamanho_lote] for i in range(0, len(normalizados), tamanho_lote)]
+
+    url = f"{api_url}/chat/whatsappNumbers/{instancia}"
+    headers = {"apikey": api_key, "Content-Type": "application/json"}
+    sessao = sessao or criar_sessao_http(max_paralelo)
+
+    if metricas is not None:
+        metricas.contar("numeros_validados", "validacao_cache", instancia, len(em_cache))
+        metricas.contar("numeros_validados", "validacao_api", instancia, len(normalizados))
+
+    def consultar_medindo(lote):
+        if metricas is None:
+            return consultar_lote(sessao, url, headers, lote)
+        with metricas.medir("validacao_lote", instancia, id_job, numeros=len(lote)):
+            return consultar_lote(sessao, url, headers, lote)
+
+    concluidos = 0
+    if ao_progresso:
+        ao_progresso(0, len(lotes), 0, len(normalizados))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_paralelo, len(lotes)))) as executor:
+        futuros = {executor.submit(consultar_medindo, lote): lote for lote in lotes}
+        for lotes_prontos, futuro in enumerate(as_completed(futuros), start=1):
+            lote = futuros[futuro]
+            try:
+                existe = futuro.result()
+                parcial = {numero: {'valido': existe[numero]} for numero in lote}
+            except Exception:
+                parcial = {numero: {'valido': False, 'erro': True} for numero in lote}
+
+            resultados.update(parcial)
+
+            # Falhas de rede não entram no cache para serem reconsultadas
+            if cache is not None:
+                cache.gravar({n: i['valido'] for n, i in parcial.items() if not i.get('erro')})
+
+            concluidos += len(lote)
+            if ao_progresso:
+                ao_progresso(lotes_prontos, len(lotes), concluidos, len(normalizados))
+
+            if cancelado is not None and cancelado.is_set():
+                for pendente in futuros:
+                    pendente.cancel()
+                break
+
+    return resultados
+
+# ==============================================
+# EXECUTOR EM SEGUNDO PLANO
+# ==============================================
+# A validação roda fora dos reruns do Streamlit: um trabalho por (hash do
+# upload, instância), compartilhado entre sessões com a mesma planilha. A
+# interface só lê o progresso e, ao fim, os resultados publicados aqui.
+MAX_VALIDACOES_SIMULTANEAS = 2
+TTL_TRABALHOS_ENCERRADOS = 3600     # segundos que um resultado fica disponível
+
+ESTADO_NA_FILA = "na_fila"
+ESTADO_VALIDANDO = "validando"
+ESTADO_CONCLUIDA = "concluida"
+ESTADO_CANCELADA = "cancelada"
+ESTADO_FALHOU = "falhou"
+
+
+class _TrabalhoValidacao:
+
+    def __init__(self, chave, instancia, total):
+        self.chave = chave
+        self.instancia = instancia
+        self.estado = ESTADO_NA_FILA
+        self.total = total
+        self.concluidos = 0
+        self.lotes_prontos = 0
+        self.total_lotes = 0
+        self.resultados = None
+        self.erro = None
+        self.criado_em = time.time()
+        self.encerrado_em = None
+        self.cancelado = threading.Event()
+
+
+class ExecutorValidacao:
+
+    def __init__(self, api_url, api_key, cache=None, metricas=None,
+                 max_simultaneas=MAX_VALIDACOES_SIMULTANEAS, ttl_encerrados=TTL_TRABALHOS_ENCERRADOS):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.cache = cache
+        self.metricas = metricas
+        self.ttl_encerrados = ttl_encerrados
+        self._executor = ThreadPoolExecutor(max_workers=max_simultaneas, thread_name_prefix="validacao")
+        self._trabalhos = {}
+        self._lock = threading.Lock()
+
+    def iniciar(self, chave, numeros, instancia, id_job=None):
+        # Idempotente: a mesma chave reaproveita o trabalho em andamento ou concluído;
+        # um cancelado ou que falhou é substituído por um novo
+        with self._lock:
+            self._podar()
+            trabalho = self._trabalhos.get(chave)
+            if trabalho is not None and trabalho.estado not in (ESTADO_CANCELADA, ESTADO_FALHOU):
+                return self._retrato(trabalho)
+            trabalho = self._trabalhos[chave] = _TrabalhoValidacao(chave, instancia, len(numeros))
+        self._executor.submit(self._executar, trabalho, list(numeros), id_job)
+        return self._retrato(trabalho)
+
+    def _executar(self, trabalho, numeros, id_job):
+        if trabalho.cancelado.is_set():
+            return
+        with self._lock:
+            trabalho.estado = ESTADO_VALIDANDO
+
+        def ao_progresso(lotes_prontos, total_lotes, concluidos, total_consultados):
+            with self._lock:
+                trabalho.lotes_prontos = lotes_prontos
+                trabalho.total_lotes = total_lotes
+                # Os que vieram do cache já contam como prontos
+                trabalho.concluidos = trabalho.total - total_consultados + concluidos
+
+        try:
+            resultados = self._validar(numeros, trabalho, ao_progresso, id_job)
+        except Exception as e:
+            with self._lock:
+                trabalho.estado = ESTADO_FALHOU
+                trabalho.erro = str(e)
+                trabalho.encerrado_em = time.time()
+            return
+
+        with self._lock:
+            trabalho.estado = ESTADO_CANCELADA if trabalho.cancelado.is_set() else ESTADO_CONCLUIDA
+            trabalho.resultados = resultados
+            trabalho.encerrado_em = time.time()
+
+    def _validar(self, numeros, trabalho, ao_progresso, id_job):
+        def validar():
+            return validar_numeros(
+                numeros, trabalho.instancia, self.api_url, self.api_key,
+                ao_progresso=ao_progresso, cache=self.cache, metricas=self.metricas,
+                id_job=id_job, cancelado=trabalho.cancelado,
+            )
+        if self.metricas is None:
+            return validar()
+        with self.metricas.medir("validacao", trabalho.instancia, id_job, numeros=len(numeros)):
+            return validar()
+
+    def obter(self, chave):
+        with self._lock:
+            trabalho = self._trabalhos.get(chave)
+            return self._retrato(trabalho) if trabalho is not None else None
+
+    def resultados(self, chave):
+        with self._lock:
+            trabalho = self._trabalhos.get(chave)
+            return trabalho.resultados if trabalho is not None and trabalho.estado == ESTADO_CONCLUIDA else None
+
+    def cancelar(self, chave):
+        with self._lock:
+            trabalho = self._trabalhos.get(chave)
+            if trabalho is None or trabalho.encerrado_em is not None:
+                return False
+            trabalho.cancelado.set()
+            if trabalho.estado == ESTADO_NA_FILA:
+                trabalho.estado = ESTADO_CANCELADA
+                trabalho.encerrado_em = time.time()
+            return True
+
+    def _retrato(self, trabalho):
+        return {
+            'estado': trabalho.estado,
+            'total': trabalho.total,
+            'concluidos': trabalho.concluidos,
+            'lotes_prontos': trabalho.lotes_prontos,
+            'total_lotes': trabalho.total_lotes,
+            'erro': trabalho.erro,
+            'duracao_s': round((trabalho.encerrado_em or time.time()) - trabalho.criado_em, 2),
+        }
+
+    def _podar(self):
+        limite = time.time() - self.ttl_encerrados
+        for chave in [c for c, t in self._trabalhos.items() if t.encerrado_em and t.encerrado_em < limite]:
+            del self._trabalhos[chave]
+
+    def estatisticas(self):
+        with self._lock:
+            por_estado = {}
+            for trabalho in self._trabalhos.values():
+                por_estado[trabalho.estado] = por_estado.get(trabalho.estado, 0) + 1
+        return {'trabalhos': sum(por_estado.values()), **por_estado}